@@ -0,0 +1,291 @@
+"""Benchmarks for the reward scale algorithms.
+
+    -> scaling: time the density engines on synthetic datasets.
+    -> suite: time loading, building and querying every dataset in graph_data
+        and some synthetic datasets, measure peak memory and the error against
+        reward_scale_correct, and write the results to a json file.
+    -> compare: compare two suite result files and report regressions.
+"""
+
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import click
+import numpy as np
+
+from chain_vars import *
+from hex_arrays import geo_to_cells
+from loader import read_node_chunks
+from reward_graph import HexDict
+from snapshot import chain_vars_key
+
+# Center and hotspot density of the chicago dataset. Synthetic datasets keep
+# the same density by growing the box with the number of hotspots.
+SYNTHETIC_CENTER = (41.85, -87.70)
+SYNTHETIC_DENSITY = 432 / 0.25
+
+def synthetic_hotspots(count, seed=0):
+    """Generate count random (lat, lng) pairs at a metro-like density.
+
+    RETURNS:
+        -> A list of (lat, lng) tuples.
+    """
+    rng = random.Random(seed)
+    half_side = math.sqrt(count / SYNTHETIC_DENSITY) / 2
+    lat, lng = SYNTHETIC_CENTER
+    return [
+        (rng.uniform(lat - half_side, lat + half_side), rng.uniform(lng - half_side, lng + half_side))
+        for _ in range(count)
+    ]
+
+def time_density_engine(hotspots, engine):
+    """Build a HexDict from hotspots with the given engine.
+
+    RETURNS:
+        -> (seconds spent in add_hex, seconds spent building the densities)
+    """
+    hex_dict = HexDict()
+    start = time.perf_counter()
+    for i, (lat, lng) in enumerate(hotspots):
+        hex_dict.add_hex(lat, lng, i)
+    loaded = time.perf_counter()
+    if engine == 'legacy':
+        hex_dict.generate_max_res_meta()
+        hex_dict.generate_parents()
+    else:
+        hex_dict.generate_densities()
+    return loaded - start, time.perf_counter() - loaded
+
+# Version of the suite result files.
+RESULTS_VERSION = 1
+
+# Minimum seconds a query throughput is measured for.
+MIN_QUERY_TIME = 0.2
+
+# Maximum number of hotspots queried one at a time per dataset.
+SCALAR_QUERIES = 1000
+
+# Suite metrics compared between runs, and whether higher values are better.
+COMPARED_METRICS = {
+    'load_s': False,
+    'build_total_s': False,
+    'batch_queries_per_s': True,
+    'scalar_queries_per_s': True,
+    'peak_memory_bytes': False,
+}
+
+def graph_datasets(directory='graph_data'):
+    """Return the names of the node files in directory, sorted."""
+    return sorted(name[:-len('_nodes.csv')] for name in os.listdir(directory) if name.endswith('_nodes.csv'))
+
+def _query_rate(function, count):
+    """Return the number of queries per second of function, which answers count queries."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_QUERY_TIME:
+            return count * calls / elapsed
+
+def _build_densities(hex_dict):
+    """Build the densities of hex_dict one resolution at a time.
+
+    RETURNS:
+        -> dict: the seconds spent on every resolution.
+    """
+    build_s = {}
+    start = time.perf_counter()
+    hex_dict.generate_max_res_meta()
+    build_s[RES_MAX] = time.perf_counter() - start
+    for res in range(RES_MAX - 1, RES_MIN - 2, -1):
+        start = time.perf_counter()
+        hex_dict.aggregate_level(res)
+        hex_dict.clip_level(res)
+        build_s[res] = time.perf_counter() - start
+    hex_dict.generated = True
+    return build_s
+
+def error_stats(computed, correct):
+    """Return error statistics of computed against correct reward scales.
+
+    Nodes without a correct reward scale (nan) are ignored.
+
+    RETURNS:
+        -> dict, or None if no node has a correct reward scale.
+    """
+    known = ~np.isnan(correct)
+    if not known.any():
+        return None
+    errors = np.abs(computed[known] - correct[known])
+    return {
+        'nodes': int(known.sum()),
+        'mean_abs': float(errors.mean()),
+        'max_abs': float(errors.max()),
+        'rmse': float(np.sqrt((errors ** 2).mean())),
+        'within_1e-3': float((errors <= 1e-3).mean()),
+    }
+
+def benchmark_dataset(name, load):
+    """Benchmark a dataset.
+
+    REQUIRES:
+        -> load: a function returning (lats, lngs, names, reward_scale_correct)
+            arrays. It is timed as part of the load time.
+    RETURNS:
+        -> dict: the results of the dataset.
+    """
+    start = time.perf_counter()
+    lats, lngs, names, reward_scale_correct = load()
+    hex_dict = HexDict()
+    hex_dict.add_hexes(lats, lngs, names)
+    load_s = time.perf_counter() - start
+
+    build_s = _build_densities(hex_dict)
+    cells = geo_to_cells(lats, lngs, RES_MAX)
+    computed = hex_dict.packed().reward_scales(cells)
+    sample = list(zip(lats[:SCALAR_QUERIES].tolist(), lngs[:SCALAR_QUERIES].tolist()))
+
+    def scalar_queries():
+        for lat, lng in sample:
+            hex_dict.compute_reward_scale(lat, lng)
+
+    batch_rate = _query_rate(lambda: hex_dict.packed().reward_scales(cells), len(cells))
+    scalar_rate = _query_rate(scalar_queries, len(sample))
+
+    # Memory is measured in a second pass, tracing slows the build down.
+    hex_dict = None
+    tracemalloc.start()
+    lats, lngs, names, _ = load()
+    hex_dict = HexDict()
+    hex_dict.add_hexes(lats, lngs, names)
+    hex_dict.generate_densities()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'hotspots': len(lats),
+        'load_s': load_s,
+        'build_s': {str(res): seconds for res, seconds in build_s.items()},
+        'build_total_s': sum(build_s.values()),
+        'hexes': {str(res): len(hex_dict.hex_dict[res]) for res in build_s},
+        'batch_queries_per_s': batch_rate,
+        'scalar_queries_per_s': scalar_rate,
+        'peak_memory_bytes': peak_memory,
+        'error': error_stats(computed, reward_scale_correct),
+    }
+
+def load_graph_dataset(name, directory='graph_data'):
+    """Return a load function for benchmark_dataset reading a node file."""
+    def load():
+        chunks = list(read_node_chunks(f'{directory}/{name}_nodes.csv'))
+        return (
+            np.concatenate([chunk.lat for chunk in chunks]),
+            np.concatenate([chunk.lng for chunk in chunks]),
+            [address for chunk in chunks for address in chunk.address.tolist()],
+            np.concatenate([chunk.reward_scale_correct for chunk in chunks]),
+        )
+    return load
+
+def load_synthetic_dataset(size, seed=0):
+    """Return a load function for benchmark_dataset generating synthetic hotspots."""
+    def load():
+        hotspots = np.array(synthetic_hotspots(size, seed), dtype=np.float64).reshape(-1, 2)
+        return hotspots[:, 0], hotspots[:, 1], list(range(size)), np.full(size, np.nan)
+    return load
+
+@click.group()
+def cli():
+    """Benchmarks for the reward scale algorithms."""
+
+@cli.command()
+@click.option('--sizes', default='1000,10000,100000,1000000', help='Comma separated hotspot counts.')
+@click.option('--legacy-max', default=1000, help='Largest size the legacy engine is run on.')
+@click.option('--seed', default=0)
+def scaling(sizes, legacy_max, seed):
+    """Time the density engines on synthetic datasets of increasing size."""
+    print('engine,hotspots,add_hex_s,densities_s,us_per_hotspot')
+    for size in [int(s) for s in sizes.split(',')]:
+        hotspots = synthetic_hotspots(size, seed)
+        for engine in ('linear', 'legacy'):
+            if engine == 'legacy' and size > legacy_max:
+                continue
+            load_time, build_time = time_density_engine(hotspots, engine)
+            print(f'{engine},{size},{load_time:.3f},{build_time:.3f},{build_time / size * 1e6:.2f}')
+
+@cli.command()
+@click.option('--datasets', default=None, help='Comma separated graph_data datasets, defaults to all of them.')
+@click.option('--synthetic', default='10000,100000', help='Comma separated synthetic hotspot counts, empty for none.')
+@click.option('--seed', default=0)
+@click.option('--output', default='benchmark_results.json', help='File the results are written to.')
+def suite(datasets, synthetic, seed, output):
+    """Benchmark the graph_data datasets and synthetic datasets."""
+    names = graph_datasets() if datasets is None else datasets.split(',')
+    runs = [(name, load_graph_dataset(name)) for name in names]
+    runs += [(f'synthetic_{size}', load_synthetic_dataset(int(size), seed)) for size in synthetic.split(',') if size]
+
+    results = []
+    for name, load in runs:
+        result = benchmark_dataset(name, load)
+        results.append(result)
+        error = result['error']
+        print(
+            f"{name}: {result['hotspots']} hotspots, load {result['load_s']:.3f}s, "
+            f"build {result['build_total_s']:.3f}s, {result['batch_queries_per_s']:.0f} batch q/s, "
+            f"{result['scalar_queries_per_s']:.0f} q/s, peak {result['peak_memory_bytes'] / 2**20:.1f} MiB"
+            + ('' if error is None else f", max error {error['max_abs']:.2e}")
+        )
+
+    with open(output, 'w') as f:
+        json.dump({
+            'version': RESULTS_VERSION,
+            'created': datetime.datetime.now().isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'chain_vars': chain_vars_key(),
+            'datasets': results,
+        }, f, indent=2)
+    print(f'Wrote {output}')
+
+@cli.command()
+@click.argument('baseline')
+@click.argument('current')
+@click.option('--threshold', default=0.2, help='Relative change of a metric reported as a regression.')
+def compare(baseline, current, threshold):
+    """Compare two suite result files. Exits with 1 if anything regressed."""
+    with open(baseline) as f:
+        baseline = json.load(f)
+    with open(current) as f:
+        current = json.load(f)
+    if baseline['chain_vars'] != current['chain_vars']:
+        print('Warning: the results were computed with different chain variables.')
+
+    regressions = 0
+    before = {result['name']: result for result in baseline['datasets']}
+    for result in current['datasets']:
+        old = before.get(result['name'])
+        if old is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            regressed = (-change if higher_is_better else change) > threshold
+            regressions += regressed
+            print(f"{result['name']},{metric},{old[metric]:.6g},{result[metric]:.6g},{change:+.1%}{',REGRESSION' if regressed else ''}")
+        if old['error'] is not None and result['error'] is not None and result['error']['max_abs'] > old['error']['max_abs']:
+            regressions += 1
+            print(f"{result['name']},error.max_abs,{old['error']['max_abs']:.6g},{result['error']['max_abs']:.6g},REGRESSION")
+    if regressions:
+        print(f'{regressions} regressions')
+        sys.exit(1)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,92 @@
+"""Versioned sets of HIP17 chain variables.
+
+A ChainParams holds the [N, density_tgt, density_max] table of every
+resolution. It is passed to RewardGraph, HexDict and CompactHexDict, so
+proposed parameter changes can be evaluated side by side without editing
+chain_vars.py. The resolution range (RES_MIN to RES_MAX) is not part of a
+parameter set: the h3 indexing of the hotspots and the hex hierarchy depend
+on it.
+
+Parameter sets are identified by key(), a hash of their contents, and can
+be read from json files of the form:
+    {"name": "proposal", "res_meta": {"8": [2, 1, 4], "9": [2, 1, 2]}}
+Resolutions missing from res_meta keep their chain_vars values.
+"""
+
+import hashlib
+import json
+
+from chain_vars import *
+
+# Version of the json representation of a parameter set.
+PARAMS_VERSION = 1
+
+class ChainParams:
+    """A set of HIP17 chain variables."""
+
+    def __init__(self, res_meta=HIP_RES_META, name='default'):
+        """Constructor.
+
+        REQUIRES:
+            -> res_meta: an [N, density_tgt, density_max] row for every
+                resolution, laid out like chain_vars.HIP_RES_META.
+            -> name: a label, not part of the key.
+        """
+        if len(res_meta) != len(HIP_RES_META):
+            raise Exception(f"Chain params need {len(HIP_RES_META)} resolutions, got {len(res_meta)}.")
+        for row in res_meta:
+            if len(row) != 3 or min(row) < 1:
+                raise Exception(f"Invalid chain params row: {row}.")
+        self.name = name
+        self.res_meta = tuple(tuple(int(value) for value in row) for row in res_meta)
+
+    def key(self):
+        """Return a key identifying the values of the parameter set."""
+        params = json.dumps([RES_MAX, RES_MIN, [list(row) for row in self.res_meta]])
+        return hashlib.sha256(params.encode()).hexdigest()
+
+    def __eq__(self, other):
+        return isinstance(other, ChainParams) and self.res_meta == other.res_meta
+
+    def __hash__(self):
+        return hash(self.res_meta)
+
+    def __repr__(self):
+        return f"ChainParams({self.name!r}, {self.key()[:12]})"
+
+    def replace(self, name, res_meta):
+        """Return a copy with the rows of res_meta (a dict of res -> row) replaced."""
+        rows = [list(row) for row in self.res_meta]
+        for res, row in res_meta.items():
+            rows[int(res)] = row
+        return ChainParams(rows, name)
+
+    def to_dict(self):
+        """Return the json representation of the parameter set."""
+        return {
+            'version': PARAMS_VERSION,
+            'name': self.name,
+            'res_meta': {str(res): list(row) for res, row in enumerate(self.res_meta)},
+        }
+
+    @classmethod
+    def from_dict(cls, params):
+        """Create a parameter set from its json representation."""
+        if params.get('version', PARAMS_VERSION) != PARAMS_VERSION:
+            raise Exception(f"Unsupported chain params version {params['version']}, expected {PARAMS_VERSION}.")
+        return DEFAULT_PARAMS.replace(params.get('name', 'unnamed'), params.get('res_meta', {}))
+
+# The chain variables of chain_vars.py.
+DEFAULT_PARAMS = ChainParams()
+
+def read_params_file(path):
+    """Read a json file holding one parameter set or a list of them.
+
+    RETURNS:
+        -> list: the ChainParams of the file, in order.
+    """
+    with open(path) as f:
+        params = json.load(f)
+    if isinstance(params, dict):
+        params = [params]
+    return [ChainParams.from_dict(entry) for entry in params]
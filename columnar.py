@@ -0,0 +1,161 @@
+"""Parquet and Arrow import and export of datasets and results.
+
+Hotspots can be read from Parquet or Arrow IPC (.arrow, .feather) files with
+the NODE_COLUMNS of the csv node files. A lat/lng bounding box is pushed
+down to the reader, so row groups outside the box are skipped rather than
+parsed and filtered.
+
+Results are written as two Parquet files:
+    -> nodes: address, name, lat, lng, reward_scale_correct, reward_scale
+        and the RES_MAX cell of every node.
+    -> densities: res, hex_id, unclipped_density, clipped_density,
+        occupied_count and hex_density_limit, one row group per resolution.
+Numeric columns wrap the numpy arrays without copying them.
+
+pyarrow is an optional dependency, only needed by this module.
+"""
+
+import click
+import numpy as np
+
+from chain_vars import *
+from compact_hex_dict import CompactHexDict
+from hex_arrays import geo_to_cells
+from loader import CHUNK_SIZE
+from loader import NODE_COLUMNS
+from loader import NodeColumns
+from loader import read_node_chunks
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# File extensions of the Arrow IPC format, anything else is read as Parquet.
+IPC_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+def _require_pyarrow():
+    if pa is None:
+        raise Exception("Parquet and Arrow support requires pyarrow, install it with 'pip install pyarrow'.")
+
+def _dataset(path):
+    """Open a Parquet or Arrow IPC file, or a directory of them, as a pyarrow dataset."""
+    _require_pyarrow()
+    return ds.dataset(path, format='ipc' if path.endswith(IPC_EXTENSIONS) else 'parquet')
+
+def bbox_filter(swlat, swlng, nelat, nelng):
+    """Return a dataset filter keeping the rows inside a lat/lng bounding box."""
+    _require_pyarrow()
+    return (
+        (ds.field('lat') >= swlat) & (ds.field('lat') <= nelat) &
+        (ds.field('lng') >= swlng) & (ds.field('lng') <= nelng)
+    )
+
+def _strings(column):
+    """Convert an arrow string column to a numpy array of strings, nulls become ''."""
+    return np.array(pc.fill_null(column, '').to_pylist(), dtype=str)
+
+def _floats(column):
+    """Convert an arrow numeric column to a float64 array, nulls become nan."""
+    column = pc.cast(column, pa.float64())
+    if column.null_count:
+        column = pc.fill_null(column, np.nan)
+    return column.to_numpy()
+
+def read_table_chunks(path, bbox=None, chunk_size=CHUNK_SIZE):
+    """Read the hotspots of a Parquet or Arrow file in chunks of typed columns.
+
+    REQUIRES:
+        -> path: a Parquet or Arrow IPC file with the NODE_COLUMNS.
+        -> bbox: an optional (swlat, swlng, nelat, nelng) tuple, only the
+            hotspots inside it are read.
+    RETURNS:
+        -> A generator of loader.NodeColumns, like loader.read_node_chunks.
+    """
+    dataset = _dataset(path)
+    for column in NODE_COLUMNS:
+        if column not in dataset.schema.names:
+            raise Exception(f"Node file {path} is missing the {column} column.")
+    batches = dataset.to_batches(
+        columns=list(NODE_COLUMNS), filter=None if bbox is None else bbox_filter(*bbox), batch_size=chunk_size
+    )
+    for batch in batches:
+        if not batch.num_rows:
+            continue
+        lat, lng = _floats(batch.column('lat')), _floats(batch.column('lng'))
+        if np.isnan(lat).any() or np.isnan(lng).any():
+            raise Exception("Node file contains an invalid coordinate.")
+        yield NodeColumns(
+            _strings(batch.column('address')),
+            _strings(batch.column('name')),
+            lat,
+            lng,
+            _floats(batch.column('reward_scale_correct'))
+        )
+
+def write_nodes_table(path, columns):
+    """Write node columns to a Parquet file.
+
+    REQUIRES:
+        -> columns: a dict of column name -> list or numpy array, all of the
+            same length.
+    """
+    _require_pyarrow()
+    pq.write_table(pa.table({name: pa.array(values) for name, values in columns.items()}), path)
+
+def write_densities_table(path, hex_dict):
+    """Write the densities of every resolution to a Parquet file.
+
+    REQUIRES:
+        -> hex_dict: a generated HexDict or CompactHexDict.
+    """
+    _require_pyarrow()
+    if not isinstance(hex_dict, CompactHexDict):
+        hex_dict = CompactHexDict.from_hex_dict(hex_dict)
+    schema = pa.schema([
+        ('res', pa.int8()),
+        ('hex_id', pa.uint64()),
+        ('unclipped_density', pa.int64()),
+        ('clipped_density', pa.int64()),
+        ('occupied_count', pa.int64()),
+        ('hex_density_limit', pa.int64()),
+    ])
+    with pq.ParquetWriter(path, schema) as writer:
+        for res in range(RES_MAX, RES_MIN - 2, -1):
+            hex_ids = hex_dict.hex_ids[res]
+            writer.write_table(pa.table([
+                pa.array(np.full(len(hex_ids), res, dtype=np.int8)),
+                pa.array(hex_ids),
+                pa.array(hex_dict.unclipped_density[res]),
+                pa.array(hex_dict.clipped_density[res]),
+                pa.array(hex_dict.occupied_count[res]),
+                pa.array(hex_dict.hex_density_limit[res]),
+            ], schema=schema))
+
+@click.command()
+@click.argument('node_file')
+@click.argument('output')
+def main(node_file, output):
+    """Convert a csv node file to a Parquet file, with the RES_MAX cell of every node."""
+    _require_pyarrow()
+    writer = None
+    for columns in read_node_chunks(node_file):
+        table = pa.table({
+            'address': pa.array(columns.address.tolist(), pa.string()),
+            'name': pa.array(columns.name.tolist(), pa.string()),
+            'lat': pa.array(columns.lat),
+            'lng': pa.array(columns.lng),
+            'reward_scale_correct': pa.array(columns.reward_scale_correct),
+            'cell': pa.array(geo_to_cells(columns.lat, columns.lng, RES_MAX)),
+        })
+        if writer is None:
+            writer = pq.ParquetWriter(output, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Compact struct-of-arrays storage for the HIP17 hex densities.
+
+CompactHexDict stores every resolution as parallel numpy arrays sorted by
+the integer h3 index, instead of a dict of Hexagon objects. Resolution
+metadata is read from chain_vars, and the residents of a hex are derived on
+demand from the sorted RES_MAX cells of the hotspots, so memory grows with
+the number of occupied hexes rather than hotspots x resolutions.
+
+The compact storage is built in one pass and is read only: incremental
+updates and what-if overlays need the dict based HexDict.
+"""
+
+from h3.api import basic_int as h3_int
+import numpy as np
+
+from chain_params import DEFAULT_PARAMS
+from chain_vars import *
+from hex_arrays import PackedLevels
+from hex_arrays import cells_to_descendant_bounds
+from hex_arrays import cells_to_parents
+from hex_arrays import geo_to_cells
+from topology import TopologyCache
+import profiling
+
+class CompactHexDict:
+    """A read only HexDict backed by per-resolution arrays."""
+
+    def __init__(self, topology=None, params=DEFAULT_PARAMS):
+        """Constructor for a compact hex map.
+
+        REQUIRES:
+            -> topology: an optional, possibly shared, TopologyCache.
+                Defaults to a new cache in precompute mode.
+            -> params: the chain_params.ChainParams used to clip densities.
+        """
+        self.topology = TopologyCache(maxsize=None) if topology is None else topology
+        self.params = params
+
+        # Hotspots added since the last generate_densities, as array chunks.
+        self._pending_cells = []
+        self._pending_names = []
+
+        # RES_MAX cell and name of every hotspot, sorted by cell.
+        self.hotspot_cells = np.zeros(0, dtype=np.uint64)
+        self.hotspot_names = []
+
+        # res -> sorted uint64 hex ids, and the parallel arrays of densities.
+        self.hex_ids = {}
+        self.unclipped_density = {}
+        self.clipped_density = {}
+        self.occupied_count = {}
+        self.hex_density_limit = {}
+
+        self.generated = False
+        self.packed_levels = None
+
+    @classmethod
+    def from_hex_dict(cls, hex_dict):
+        """Convert a generated HexDict to compact storage.
+
+        REQUIRES:
+            -> hex_dict: a HexDict whose densities have been generated.
+        """
+        if not hex_dict.generated:
+            raise Exception("Cannot convert hex dict. Densities have not been generated.")
+        compact = cls(topology=hex_dict.topology, params=hex_dict.params)
+        cells = []
+        names = []
+        for hex_id, hex in hex_dict.hex_dict[RES_MAX].items():
+            for resident in hex.residents:
+                cells.append(int(hex_id, 16))
+                names.append(resident)
+        cells = np.array(cells, dtype=np.uint64)
+        order = np.argsort(cells, kind='stable')
+        compact.hotspot_cells = cells[order]
+        compact.hotspot_names = [names[i] for i in order.tolist()]
+
+        for res in range(RES_MIN - 1, RES_MAX + 1):
+            hexes = sorted(hex_dict.hex_dict[res].values(), key=lambda hex: int(hex.hex_id, 16))
+            compact.hex_ids[res] = np.array([int(hex.hex_id, 16) for hex in hexes], dtype=np.uint64)
+            compact.unclipped_density[res] = np.array([hex.unclipped_density for hex in hexes], dtype=np.int64)
+            compact.clipped_density[res] = np.array([hex.clipped_density for hex in hexes], dtype=np.int64)
+            compact.occupied_count[res] = np.array([hex.occupied_count for hex in hexes], dtype=np.int64)
+            compact.hex_density_limit[res] = np.array([hex.hex_density_limit for hex in hexes], dtype=np.int64)
+        compact.generated = True
+        return compact
+
+    def __len__(self):
+        """Return the number of hotspots."""
+        return len(self.hotspot_cells) + sum(len(cells) for cells in self._pending_cells)
+
+    def __contains__(self, hex_id):
+        """Determine if a given hex_id is in the hex dict."""
+        return self._position(hex_id) is not None
+
+    def add_hex(self, lat:float, lng:float, name=None):
+        """Insert a hotspot into the hex dict."""
+        self.add_hexes([lat], [lng], [name])
+
+    def add_hexes(self, lats, lngs, names):
+        """Insert many hotspots into the hex dict at once."""
+        self.generated = False
+        self.packed_levels = None
+        self._pending_cells.append(geo_to_cells(lats, lngs, RES_MAX))
+        self._pending_names.extend(names)
+
+    def generate_densities(self):
+        """Generate the densities of every resolution from RES_MAX to RES_MIN - 1.
+
+        Produces the same densities as HexDict.generate_densities, using
+        vectorized aggregation and one h3 call per occupied hex.
+        """
+        cells = np.concatenate([self.hotspot_cells] + self._pending_cells)
+        names = list(self.hotspot_names) + self._pending_names
+        order = np.argsort(cells, kind='stable')
+        self.hotspot_cells = cells[order]
+        self.hotspot_names = [names[i] for i in order.tolist()]
+        self._pending_cells = []
+        self._pending_names = []
+
+        hex_ids, raw_density = np.unique(self.hotspot_cells, return_counts=True)
+        unclipped = raw_density.astype(np.int64)
+        for res in range(RES_MAX, RES_MIN - 2, -1):
+            with profiling.phase(f'res_{res}'):
+                if res < RES_MAX:
+                    parents = cells_to_parents(hex_ids, res)
+                    # hex_ids are sorted, so are their parents.
+                    starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+                    hex_ids = parents[starts]
+                    unclipped = np.add.reduceat(self.clipped_density[res + 1], starts) if len(starts) else unclipped[:0]
+                self.hex_ids[res] = hex_ids
+                self.unclipped_density[res] = unclipped
+                self._clip_level(res)
+
+        self.generated = True
+        self.packed_levels = None
+
+    def add_hotspot(self, lat:float, lng:float, name=None):
+        raise Exception("Incremental updates are not supported by the compact storage backend.")
+
+    def move_hotspot(self, old_lat:float, old_lng:float, lat:float, lng:float, name=None):
+        raise Exception("Incremental updates are not supported by the compact storage backend.")
+
+    def remove_hotspot(self, lat:float, lng:float, name=None):
+        raise Exception("Incremental updates are not supported by the compact storage backend.")
+
+    def _clip_level(self, res):
+        """Compute the occupied counts, limits and clipped densities at res."""
+        N, density_tgt, density_max = self.params.res_meta[res]
+        hex_ids = self.hex_ids[res]
+        unclipped = self.unclipped_density[res]
+
+        # Every occupied hex adds one to the occupied count of each neighbor,
+        # itself included. Neighborhoods are symmetric, so this matches
+        # counting the occupied neighbors of every hex.
+        occupied = hex_ids[unclipped >= density_tgt]
+        neighbors = np.concatenate(
+            [self.topology.cell_neighbors(hex_id) for hex_id in occupied.tolist()] + [np.zeros(0, dtype=np.uint64)]
+        )
+        positions = np.searchsorted(hex_ids, neighbors)
+        positions[positions == len(hex_ids)] = 0
+        occupied_count = np.zeros(len(hex_ids), dtype=np.int64)
+        if len(hex_ids):
+            np.add.at(occupied_count, positions[hex_ids[positions] == neighbors], 1)
+
+        limit = np.minimum(density_tgt * np.maximum(occupied_count - N + 1, 1), density_max)
+        self.occupied_count[res] = occupied_count
+        self.hex_density_limit[res] = limit
+        self.clipped_density[res] = np.minimum(unclipped, limit)
+
+    def _position(self, hex_id):
+        """Return the position of hex_id in its level, None if it is absent."""
+        cell = np.uint64(int(hex_id, 16))
+        res = h3_int.h3_get_resolution(int(cell))
+        hex_ids = self.hex_ids.get(res)
+        if hex_ids is None:
+            return None
+        position = int(np.searchsorted(hex_ids, cell))
+        if position == len(hex_ids) or hex_ids[position] != cell:
+            return None
+        return position
+
+    def density(self, hex_id):
+        """Return (clipped, unclipped) density of hex_id, (0, 0) if absent."""
+        position = self._position(hex_id)
+        if position is None:
+            return 0, 0
+        res = h3_int.h3_get_resolution(int(hex_id, 16))
+        return int(self.clipped_density[res][position]), int(self.unclipped_density[res][position])
+
+    def residents(self, hex_id):
+        """Return the names of all hotspots within hex_id."""
+        cell = np.uint64(int(hex_id, 16))
+        res = h3_int.h3_get_resolution(int(cell))
+        low, high = cells_to_descendant_bounds(np.array([cell]), res, RES_MAX)
+        start = np.searchsorted(self.hotspot_cells, low[0], side='left')
+        end = np.searchsorted(self.hotspot_cells, high[0], side='right')
+        return self.hotspot_names[start:end]
+
+    def packed(self):
+        """Return the densities as PackedLevels, for vectorized lookups."""
+        if not self.generated:
+            raise Exception("Cannot pack hex dict. Densities have not been generated.")
+        if self.packed_levels is None:
+            self.packed_levels = PackedLevels({
+                res: (self.hex_ids[res], self.clipped_density[res], self.unclipped_density[res])
+                for res in range(RES_MIN - 1, RES_MAX + 1)
+            })
+        return self.packed_levels
+
+    def compute_reward_scale(self, lat:float, lng:float):
+        """Generate the reward scale for a given location."""
+        return float(self.packed().reward_scales(geo_to_cells([lat], [lng], RES_MAX))[0])
+
+    def hex_reward_scale(self, hex_id):
+        """Generate the reward scale for a given RES_MAX hex."""
+        return float(self.packed().reward_scales(np.array([int(hex_id, 16)], dtype=np.uint64))[0])
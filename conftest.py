@@ -0,0 +1,53 @@
+"""Shared fixtures of the tests.
+
+Every storage backend and density engine is compared against the baseline:
+the original recursive HexDict.generate_parents, scored one hotspot at a time
+with HexDict.compute_reward_scale, on graph_data/chicago_nodes.csv.
+"""
+
+import os
+
+import pytest
+
+from chain_params import DEFAULT_PARAMS
+from reward_graph import RewardGraph
+
+GRAPH_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'graph_data')
+
+# Differs from the defaults at res 7 and 8, which changes the reward scale of
+# many chicago hotspots.
+MODIFIED_PARAMS = DEFAULT_PARAMS.replace('modified', {7: [1, 3, 10], 8: [2, 1, 3]})
+
+def load_chicago(**graph_args):
+    """Return a RewardGraph holding the chicago hotspots, densities not generated."""
+    reward_graph = RewardGraph(**graph_args)
+    reward_graph.import_graph_from_csv('chicago', directory=GRAPH_DATA)
+    return reward_graph
+
+def baseline_reward_scales(reward_graph):
+    """Return node_id -> reward scale, recomputed from scratch with the legacy engine."""
+    baseline = RewardGraph(density_engine='legacy', params=reward_graph.params)
+    for node in reward_graph.nodes():
+        baseline.hex_dict.add_hex(node['lat'], node['lng'], node.node_identifier)
+    baseline.hex_dict.generate_max_res_meta()
+    baseline.hex_dict.generate_parents()
+    return {
+        node.node_identifier: baseline.hex_dict.compute_reward_scale(node['lat'], node['lng'])
+        for node in reward_graph.nodes()
+    }
+
+def hex_densities(hex_dict, res):
+    """Return hex_id -> (unclipped, clipped, occupied count, limit) of a HexDict level."""
+    return {
+        hex_id: (hex.unclipped_density, hex.clipped_density, hex.occupied_count, hex.hex_density_limit)
+        for hex_id, hex in hex_dict.hex_dict[res].items()
+    }
+
+@pytest.fixture(scope='session', params=[DEFAULT_PARAMS, MODIFIED_PARAMS], ids=['default', 'modified'])
+def params(request):
+    return request.param
+
+@pytest.fixture(scope='session')
+def baseline(params):
+    """The baseline reward scale of every chicago hotspot, by node id."""
+    return baseline_reward_scales(load_chicago(params=params))
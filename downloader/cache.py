@@ -0,0 +1,99 @@
+"""A local content-addressed cache of api responses.
+
+Entries are stored as json files named after the sha256 of the request
+they answer, and expire after a time to live. The cache directory may be
+shared with other caches (e.g. sweep.py writes to .cache/sweep), so only
+files named like an entry are ever deleted.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+DEFAULT_CACHE_DIR = '.cache'
+
+# Seconds an entry is served before it is fetched again.
+DEFAULT_TTL = 3600
+
+# Name of an entry file, stored in the subdirectory named after its first two characters.
+ENTRY_NAME = re.compile(r'[0-9a-f]{64}\.json')
+
+class ResponseCache:
+    """A directory of cached json responses."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL):
+        """Constructor.
+
+        REQUIRES:
+            -> directory: where entries are stored, created if needed.
+            -> ttl: default time to live of an entry, in seconds.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*request):
+        """Return the key of a request, e.g. key(url, path, params)."""
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key, ttl=None):
+        """Return the cached value of key, None if missing or expired."""
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if time.time() - entry['stored'] > ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['value']
+
+    def put(self, key, value):
+        """Store value under key, replacing any previous entry atomically."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'stored': time.time(), 'value': value}, f)
+        os.replace(tmp_path, path)
+
+    def prune(self):
+        """Delete every expired or unreadable entry.
+
+        Files and directories that are not entries of this cache are left
+        alone.
+
+        RETURNS:
+            -> int: the number of entries deleted.
+        """
+        deleted = 0
+        now = time.time()
+        for prefix in os.listdir(self.directory):
+            root = os.path.join(self.directory, prefix)
+            if not re.fullmatch(r'[0-9a-f]{2}', prefix) or not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                if not ENTRY_NAME.fullmatch(name) or not name.startswith(prefix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    with open(path) as f:
+                        expired = now - json.load(f)['stored'] > self.ttl
+                except (OSError, ValueError, KeyError):
+                    expired = True
+                if expired:
+                    os.remove(path)
+                    deleted += 1
+        return deleted
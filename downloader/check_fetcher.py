@@ -0,0 +1,142 @@
+"""Checks of the fetcher against a local fake_api server.
+
+Every check starts its own FakeHeliumApi on a free port and runs a
+HeliumFetcher against it:
+    -> retries: 503 and 429 answers are retried with exponential backoff,
+        and a request fails once its retries are used up.
+    -> pagination: every page of a box query is followed through its cursor.
+    -> rate limit: requests past the token bucket burst are spaced at rate.
+    -> download: download_nodes writes every recently challenged hotspot.
+
+Run with 'python3 check_fetcher.py', exits with 1 if a check fails.
+"""
+
+import asyncio
+import contextlib
+import csv
+import io
+import math
+import os
+import sys
+import tempfile
+import time
+
+import click
+
+from fake_api import FakeHeliumApi
+from fetcher import HeliumFetcher
+from fetcher import download_nodes
+
+# Box the synthetic hotspots are placed in: swlat, swlon, nelat, nelon.
+BOX = (42.0, -84.0, 42.5, -83.5)
+
+def synthetic_hotspots(count):
+    """Return count hotspot dicts spread over BOX."""
+    swlat, swlon, nelat, nelon = BOX
+    side = math.ceil(math.sqrt(count))
+    return [
+        {
+            'address': f'hotspot{i}',
+            'name': f'hotspot-{i}',
+            'lat': swlat + (nelat - swlat) * (i // side + 0.5) / side,
+            'lng': swlon + (nelon - swlon) * (i % side + 0.5) / side,
+        }
+        for i in range(count)
+    ]
+
+@contextlib.asynccontextmanager
+async def serve(api, **fetcher_args):
+    """Serve api and yield a HeliumFetcher pointed at it."""
+    runner, url = await api.start()
+    try:
+        async with HeliumFetcher(url, **fetcher_args) as fetcher:
+            yield fetcher
+    finally:
+        await runner.cleanup()
+
+def expect(condition, message):
+    if not condition:
+        raise Exception(message)
+
+async def check_retries():
+    api = FakeHeliumApi(synthetic_hotspots(1))
+    backoff = 0.05
+    async with serve(api, backoff=backoff, retries=3, rate=1000) as fetcher:
+        api.fail_next(503, 429)
+        start = time.monotonic()
+        height = await fetcher.get_height()
+        elapsed = time.monotonic() - start
+        expect(height == api.height, f"got height {height}, expected {api.height}")
+        expect(api.requests == 3, f"{api.requests} requests for 2 failures, expected 3")
+        expect(elapsed >= backoff * (1 + 2), f"retried after {elapsed:.3f}s, expected a backoff of at least {backoff * 3}s")
+
+        api.fail_next(*[503] * (fetcher.retries + 1))
+        requests = api.requests
+        try:
+            await fetcher.get_height()
+        except Exception:
+            pass
+        else:
+            raise Exception("request succeeded after its retries were used up")
+        expect(api.requests - requests == fetcher.retries + 1, "failing request was not tried retries + 1 times")
+
+async def check_pagination():
+    hotspots = synthetic_hotspots(30)
+    api = FakeHeliumApi(hotspots, page_size=7)
+    async with serve(api, rate=1000) as fetcher:
+        addresses = [node['address'] async for node in fetcher.get_nodes_box(*BOX)]
+    expect(sorted(addresses) == sorted(hotspot['address'] for hotspot in hotspots), "pages are missing hotspots")
+    expect(len(addresses) == len(set(addresses)), "pages repeat hotspots")
+    expect(api.requests == math.ceil(len(hotspots) / 7), f"{api.requests} requests for {math.ceil(len(hotspots) / 7)} pages")
+
+async def check_rate_limit():
+    api = FakeHeliumApi(synthetic_hotspots(1))
+    rate, count = 20, 40
+    async with serve(api, rate=rate, concurrency=count) as fetcher:
+        start = time.monotonic()
+        await asyncio.gather(*(fetcher.get_height() for _ in range(count)))
+        elapsed = time.monotonic() - start
+    # The bucket starts full with rate tokens, the other requests wait for theirs.
+    minimum = (count - rate) / rate
+    expect(elapsed >= 0.9 * minimum, f"{count} requests took {elapsed:.3f}s, expected at least {minimum}s at {rate}/s")
+
+async def check_download():
+    api = FakeHeliumApi(synthetic_hotspots(50), page_size=8, seed=1)
+    interactivity_blocks = 3600
+    expected = {
+        address for address, hotspot in api.hotspots.items()
+        if api.height - hotspot['last_poc_challenge'] <= interactivity_blocks
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'nodes.csv')
+        async with serve(api, rate=1000) as fetcher:
+            with contextlib.redirect_stdout(io.StringIO()):
+                written = await download_nodes(fetcher, path, *BOX, interactivity_blocks=interactivity_blocks)
+        with open(path, newline='') as f:
+            addresses = {row['address'] for row in csv.DictReader(f)}
+    expect(written == len(addresses), f"reported {written} hotspots, wrote {len(addresses)}")
+    expect(addresses == expected, f"wrote {len(addresses)} hotspots, expected {len(expected)}")
+
+CHECKS = {
+    'retries': check_retries,
+    'pagination': check_pagination,
+    'rate limit': check_rate_limit,
+    'download': check_download,
+}
+
+@click.command()
+def main_func():
+    """Run the fetcher checks against a local fake api."""
+    failed = 0
+    for name, check in CHECKS.items():
+        try:
+            asyncio.run(check())
+            print(f'{name}: ok')
+        except Exception as error:
+            failed += 1
+            print(f'{name}: FAILED, {error}')
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_func()
@@ -0,0 +1,150 @@
+"""A local stand-in for the helium api, for tests and offline development.
+
+Serves the endpoints used by the downloader from a nodes csv file:
+    /v1/blocks/height
+    /v1/hotspots/location/box      (paginated with cursors)
+    /v1/hotspots/{address}
+    /v1/hotspots/{address}/rewards/sum
+
+Run with 'python3 fake_api.py (nodes_file)', then point the downloader at it
+with '--api http://127.0.0.1:8080'.
+"""
+
+import asyncio
+import collections
+import csv
+import random
+
+from aiohttp import web
+import click
+
+class FakeHeliumApi:
+    """State of the fake api: hotspots, height and injected failures."""
+
+    def __init__(self, hotspots, height=1000000, page_size=100, failure_rate=0.0, latency=0.0, seed=0):
+        """Constructor.
+
+        REQUIRES:
+            -> hotspots: a list of hotspot dicts with at least address, name,
+                lat and lng. Missing api fields are filled in.
+            -> failure_rate: fraction of requests answered with a 503 or 429.
+            -> latency: seconds every request is delayed by.
+        """
+        self.height = height
+        self.page_size = page_size
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.requests = 0
+        # Statuses of the next failed requests, see fail_next.
+        self.failures = collections.deque()
+        self.hotspots = {}
+        for hotspot in hotspots:
+            hotspot = dict(hotspot)
+            hotspot['lat'] = float(hotspot['lat'])
+            hotspot['lng'] = float(hotspot['lng'])
+            hotspot.setdefault('reward_scale', 1.0)
+            hotspot.setdefault('last_poc_challenge', height - self.random.randrange(5000))
+            hotspot.setdefault('last_change_block', height - self.random.randrange(100000))
+            hotspot.setdefault('location', f"{hotspot['lat']},{hotspot['lng']}")
+            hotspot.setdefault('status', {'online': 'online'})
+            hotspot.setdefault('rewards', round(self.random.uniform(0, 500), 8))
+            self.hotspots[hotspot['address']] = hotspot
+
+    @classmethod
+    def from_nodes_file(cls, node_file, **kwargs):
+        """Create a fake api serving the hotspots of a nodes csv file."""
+        with open(node_file, newline='') as f:
+            hotspots = [
+                {'address': row['address'], 'name': row['name'], 'lat': row['lat'], 'lng': row['lng']}
+                for row in csv.DictReader(f)
+            ]
+        return cls(hotspots, **kwargs)
+
+    def fail_next(self, *statuses):
+        """Answer the next requests with these error statuses, e.g. fail_next(503, 429)."""
+        self.failures.extend(statuses)
+
+    def public(self, hotspot):
+        """Return the api representation of a hotspot."""
+        return {key: value for key, value in hotspot.items() if key != 'rewards'}
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        """Count requests, add latency and inject failures."""
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failures:
+            status = self.failures.popleft()
+            return web.json_response({'error': 'injected'}, status=status, headers={'Retry-After': '0'})
+        if self.random.random() < self.failure_rate:
+            if self.random.random() < 0.5:
+                return web.json_response({'error': 'rate limited'}, status=429, headers={'Retry-After': '0'})
+            return web.json_response({'error': 'unavailable'}, status=503)
+        return await handler(request)
+
+    async def get_height(self, request):
+        return web.json_response({'data': {'height': self.height}})
+
+    async def get_box(self, request):
+        query = request.query
+        swlat, swlon = float(query['swlat']), float(query['swlon'])
+        nelat, nelon = float(query['nelat']), float(query['nelon'])
+        start = int(query.get('cursor', 0))
+        matches = [
+            hotspot for hotspot in self.hotspots.values()
+            if swlat <= hotspot['lat'] <= nelat and swlon <= hotspot['lng'] <= nelon
+        ]
+        body = {'data': [self.public(hotspot) for hotspot in matches[start:start + self.page_size]]}
+        if start + self.page_size < len(matches):
+            body['cursor'] = str(start + self.page_size)
+        return web.json_response(body)
+
+    async def get_hotspot(self, request):
+        hotspot = self.hotspots.get(request.match_info['address'])
+        if hotspot is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.json_response({'data': self.public(hotspot)})
+
+    async def get_rewards_sum(self, request):
+        hotspot = self.hotspots.get(request.match_info['address'])
+        if hotspot is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.json_response({'data': {'total': hotspot['rewards']}})
+
+    def make_app(self):
+        """Return the aiohttp application serving the api."""
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/v1/blocks/height', self.get_height)
+        app.router.add_get('/v1/hotspots/location/box', self.get_box)
+        app.router.add_get('/v1/hotspots/{address}', self.get_hotspot)
+        app.router.add_get('/v1/hotspots/{address}/rewards/sum', self.get_rewards_sum)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start serving in the running event loop.
+
+        RETURNS:
+            -> (runner, url): call 'await runner.cleanup()' to stop the server.
+        """
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = runner.addresses[0][1]
+        return runner, f"http://{host}:{port}"
+
+@click.command()
+@click.argument('node_file')
+@click.option('--port', default=8080)
+@click.option('--page-size', default=100)
+@click.option('--failure-rate', default=0.0, help='Fraction of requests that fail.')
+@click.option('--latency', default=0.0, help='Seconds added to every request.')
+def main_func(node_file, port, page_size, failure_rate, latency):
+    """Serve the hotspots of node_file as a fake helium api."""
+    api = FakeHeliumApi.from_nodes_file(node_file, page_size=page_size, failure_rate=failure_rate, latency=latency)
+    web.run_app(api.make_app(), host='127.0.0.1', port=port)
+
+if __name__ == "__main__":
+    main_func()
@@ -0,0 +1,216 @@
+"""Concurrent, rate limited access to the helium api.
+
+HeliumFetcher keeps a pool of keep-alive connections, bounds the number of
+requests in flight, spaces requests with a token bucket, retries failed
+requests with exponential backoff and follows cursors on paginated
+endpoints.
+"""
+
+import asyncio
+import csv
+import datetime
+import random
+import time
+
+import aiohttp
+
+from tiling import get_nodes_box_tiled
+
+API_URL = "https://api.helium.io"
+
+# HTTP statuses that are worth retrying.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+NODE_FIELDS = ('address', 'name', 'lat', 'lng', 'reward_scale_correct')
+
+class TokenBucket:
+    """A token bucket rate limiter for asyncio tasks."""
+
+    def __init__(self, rate, capacity=None):
+        """Constructor.
+
+        REQUIRES:
+            -> rate: tokens added per second.
+            -> capacity: maximum number of tokens, i.e. the largest burst.
+                Defaults to rate.
+        """
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and consume it."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class HeliumFetcher:
+    """An async client for the helium api.
+
+    Use as an async context manager:
+        async with HeliumFetcher() as fetcher:
+            height = await fetcher.get_height()
+    """
+
+    def __init__(self, api_url=API_URL, concurrency=16, rate=10, retries=5, backoff=0.5, timeout=30):
+        """Constructor.
+
+        REQUIRES:
+            -> api_url: base url of the api, e.g. a local fake_api server.
+            -> concurrency: maximum number of requests in flight.
+            -> rate: maximum number of requests started per second.
+            -> retries: number of retries of a failed request.
+            -> backoff: delay before the first retry, doubled on every retry.
+        """
+        self.api_url = api_url.rstrip('/')
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.bucket = TokenBucket(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get_json(self, path, params=None):
+        """GET an api path and return the decoded json body.
+
+        Retries connection errors and RETRY_STATUSES with exponential backoff.
+        """
+        url = self.api_url + path
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+            await self.bucket.acquire()
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url, params=params) as response:
+                        if response.status not in RETRY_STATUSES:
+                            response.raise_for_status()
+                            return await response.json()
+                        retry_after = response.headers.get('Retry-After')
+                        if retry_after is not None and retry_after.isdigit():
+                            delay = max(delay, int(retry_after))
+                        error = f"status {response.status}"
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = repr(e)
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+        raise Exception(f"Request to {url} failed after {self.retries + 1} attempts: {error}")
+
+    async def paginate(self, path, params=None):
+        """Yield every item of a paginated endpoint, following the cursors."""
+        params = dict(params or {})
+        while True:
+            body = await self.get_json(path, params)
+            for item in body['data']:
+                yield item
+            cursor = body.get('cursor')
+            if not cursor:
+                return
+            params['cursor'] = cursor
+
+    def get_nodes_box(self, swlat, swlon, nelat, nelon):
+        """Yield all hotspots within a box, across all pages."""
+        params = {'swlat': swlat, 'swlon': swlon, 'nelat': nelat, 'nelon': nelon}
+        return self.paginate("/v1/hotspots/location/box", params)
+
+    async def get_height(self):
+        """Return the current block height."""
+        return int((await self.get_json("/v1/blocks/height"))['data']['height'])
+
+    async def get_hotspot(self, addr):
+        """Return the api data of a hotspot."""
+        return (await self.get_json(f"/v1/hotspots/{addr}"))['data']
+
+    async def get_last_poc_challenge(self, addr):
+        """Return the height of the last poc challenge of a hotspot, 0 if none."""
+        last_poc_challenge = (await self.get_hotspot(addr))['last_poc_challenge']
+        return 0 if last_poc_challenge is None else int(last_poc_challenge)
+
+    async def compute_miner_earnings(self, miner_addr):
+        """Return the earnings of a given miner in the past 30 days."""
+        time_max = datetime.datetime.now()
+        time_min = time_max - datetime.timedelta(30)
+        params = {'min_time': time_min.isoformat(), 'max_time': time_max.isoformat()}
+        return (await self.get_json(f"/v1/hotspots/{miner_addr}/rewards/sum", params))['data']
+
+async def map_unordered(items, function, limit):
+    """Apply an async function to every item, yielding (item, result) as they complete.
+
+    At most limit calls are scheduled at once, so large async iterables of
+    items are consumed as the results are yielded.
+    """
+    pending = set()
+    async for item in items:
+        pending.add(asyncio.ensure_future(_paired(item, function)))
+        if len(pending) >= limit:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
+
+async def _paired(item, function):
+    return item, await function(item)
+
+def nodes_in_box(fetcher, swlat, swlon, nelat, nelon, tile_size=None, cache=None):
+    """Return an async iterable of the hotspots in a box.
+
+    REQUIRES:
+        -> tile_size: if given, the box is fetched as cached grid tiles
+            (see tiling.py), otherwise with one paginated query.
+    """
+    if tile_size is None:
+        return fetcher.get_nodes_box(swlat, swlon, nelat, nelon)
+
+    async def tiled():
+        for node in await get_nodes_box_tiled(fetcher, swlat, swlon, nelat, nelon, tile_size, cache):
+            yield node
+    return tiled()
+
+async def download_nodes(fetcher, file, swlat, swlon, nelat, nelon, interactivity_blocks=3600, tile_size=None, cache=None):
+    """Stream the active hotspots of a box into a nodes csv file.
+
+    Hotspots whose last poc challenge is older than interactivity_blocks are
+    skipped. Rows are written as soon as a hotspot's status is known. See
+    nodes_in_box for tile_size and cache.
+
+    RETURNS:
+        -> int: the number of hotspots written.
+    """
+    current_height = await fetcher.get_height()
+
+    async def last_poc_challenge(node):
+        if node.get('last_poc_challenge') is not None:
+            return int(node['last_poc_challenge'])
+        return await fetcher.get_last_poc_challenge(node['address'])
+
+    written = 0
+    with open(file, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(NODE_FIELDS)
+        nodes = nodes_in_box(fetcher, swlat, swlon, nelat, nelon, tile_size, cache)
+        async for node, last_poc in map_unordered(nodes, last_poc_challenge, fetcher.concurrency * 4):
+            print(f"Contacting node: {node['name']} | poc {current_height - last_poc}")
+            if current_height - last_poc > interactivity_blocks:
+                continue
+            writer.writerow([node['address'], node['name'], node['lat'], node['lng'], node['reward_scale']])
+            written += 1
+    return written
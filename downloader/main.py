@@ -1,39 +1,48 @@
 """Download graph data for given latitude and longitude."""
 
+import asyncio
+
 import click
 
-from utils import get_nodes_box
-from utils import compute_miner_earnings
+from cache import DEFAULT_CACHE_DIR
+from cache import DEFAULT_TTL
+from cache import ResponseCache
+from fetcher import API_URL
+from fetcher import HeliumFetcher
+from fetcher import map_unordered
+from fetcher import nodes_in_box
+from tiling import DEFAULT_TILE_SIZE
 
 @click.command()
 @click.argument('nelat')
 @click.argument('nelon')
 @click.argument('swlat')
 @click.argument('swlon')
-def main_func(nelat, nelon, swlat, swlon):
+@click.option('--api', default=API_URL, help='Base url of the helium api.')
+@click.option('--concurrency', default=16, help='Maximum number of requests in flight.')
+@click.option('--rate', default=10.0, help='Maximum number of requests per second.')
+@click.option('--tile-size', default=DEFAULT_TILE_SIZE, help='Edge of the fetched tiles in degrees, 0 fetches the box in one query.')
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory of the tile cache.')
+@click.option('--cache-ttl', default=DEFAULT_TTL, help='Seconds a cached tile is reused.')
+def main_func(nelat, nelon, swlat, swlon, api, concurrency, rate, tile_size, cache_dir, cache_ttl):
     """For negative coords, prepend a 'n' on the number. Ex(n83 = -83)"""
     swlat = swlat.replace('n', '-')
     swlon = swlon.replace('n', '-')
     nelat = nelat.replace('n', '-')
     nelon = nelon.replace('n', '-')
-    
-    nodes = (get_nodes_box(swlat, swlon, nelat, nelon))
-
-    earnings = []
-
-    for i, node in enumerate(nodes):
-        node_addr = node['address']
-        lat = node['lat']
-        lng = node['lng']
-        reward_scale = node['reward_scale']
-
-        
-        node_earnings = compute_miner_earnings(node_addr)['total']
-
-        print('Indexing node: {i} - {e}'.format(i=i, e=node_earnings))
-
-        earnings.append( (node_earnings, lat, lng, reward_scale, node_addr) )
 
+    async def download():
+        earnings = []
+        async with HeliumFetcher(api, concurrency=concurrency, rate=rate) as fetcher:
+            cache = ResponseCache(cache_dir, cache_ttl)
+            nodes = nodes_in_box(fetcher, swlat, swlon, nelat, nelon, tile_size or None, cache)
+            miner_earnings = lambda node: fetcher.compute_miner_earnings(node['address'])
+            async for node, node_earnings in map_unordered(nodes, miner_earnings, concurrency * 4):
+                print('Indexing node: {i} - {e}'.format(i=len(earnings), e=node_earnings['total']))
+                earnings.append( (node_earnings['total'], node['lat'], node['lng'], node['reward_scale'], node['address']) )
+        return earnings
+
+    earnings = asyncio.run(download())
     earnings = sorted(earnings, key = lambda t: float(t[0]), reverse=True)
 
     with open('tmp.txt', 'w') as f:
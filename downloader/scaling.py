@@ -1,10 +1,20 @@
 """Download graph data for given latitude and longitude."""
 
+import asyncio
+
 import click
 
-from utils import get_nodes_box
-from utils import compute_miner_earnings
-from utils import *
+from cache import DEFAULT_CACHE_DIR
+from cache import DEFAULT_TTL
+from cache import ResponseCache
+from fetcher import API_URL
+from fetcher import HeliumFetcher
+from fetcher import download_nodes
+from sync import HotspotStore
+from sync import sync
+from sync import write_changes
+from sync import write_nodes_file
+from tiling import DEFAULT_TILE_SIZE
 
 @click.command()
 @click.argument('file')
@@ -12,39 +22,42 @@ from utils import *
 @click.argument('nelon')
 @click.argument('swlat')
 @click.argument('swlon')
-def main_func(file, nelat, nelon, swlat, swlon):
+@click.option('--api', default=API_URL, help='Base url of the helium api.')
+@click.option('--concurrency', default=16, help='Maximum number of requests in flight.')
+@click.option('--rate', default=10.0, help='Maximum number of requests per second.')
+@click.option('--tile-size', default=DEFAULT_TILE_SIZE, help='Edge of the fetched tiles in degrees, 0 fetches the box in one query.')
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory of the tile cache.')
+@click.option('--cache-ttl', default=DEFAULT_TTL, help='Seconds a cached tile is reused.')
+@click.option('--sync', 'sync_mode', is_flag=True, help='Refresh (file)_hotspots.db incrementally and write (file)_changes.jsonl.')
+def main_func(file, nelat, nelon, swlat, swlon, api, concurrency, rate, tile_size, cache_dir, cache_ttl, sync_mode):
     """For negative coords, prepend a 'n' on the number. Ex(n83 = -83)"""
     swlat = swlat.replace('n', '-')
     swlon = swlon.replace('n', '-')
     nelat = nelat.replace('n', '-')
     nelon = nelon.replace('n', '-')
-    
-    nodes = (get_nodes_box(swlat, swlon, nelat, nelon))
-
-    node_info = []
-
-    current_height = get_height()
-
-    with open(f'{file}_nodes.csv','w') as f:
-        f.write('address,name,lat,lng,reward_scale_correct\n')
-        for node in nodes:
-            name = node['name']
-            last_poc_challene = get_last_poc_challenge(node['address'])
-            s = current_height - last_poc_challene
-            stat = node['status']['online']
-            print(f'Contacting node: { name } | poc {s} | status {stat}')
-            
-            if current_height - last_poc_challene > 3600:
-                continue
-
-            #if node['status']['online'] != 'online':
-            #    continue
-
-            f.write(str(node['address'])+',')
-            f.write(str(node['name'])+',')
-            f.write(str(node['lat'])+',')
-            f.write(str(node['lng'])+',')
-            f.write(str(node['reward_scale'])+'\n')
+
+    async def download():
+        async with HeliumFetcher(api, concurrency=concurrency, rate=rate) as fetcher:
+            return await download_nodes(
+                fetcher, f'{file}_nodes.csv', swlat, swlon, nelat, nelon,
+                tile_size=tile_size or None, cache=ResponseCache(cache_dir, cache_ttl)
+            )
+
+    async def refresh(store):
+        async with HeliumFetcher(api, concurrency=concurrency, rate=rate) as fetcher:
+            return await sync(fetcher, store, swlat, swlon, nelat, nelon, tile_size=tile_size or None)
+
+    if sync_mode:
+        store = HotspotStore(f'{file}_hotspots.db')
+        changes, fetched = asyncio.run(refresh(store))
+        write_nodes_file(store, f'{file}_nodes.csv')
+        write_changes(changes, f'{file}_changes.jsonl')
+        store.close()
+        print(f'Fetched {fetched} changed hotspots, wrote {len(changes)} changes to {file}_changes.jsonl')
+        return
+
+    written = asyncio.run(download())
+    print(f'Wrote {written} nodes to {file}_nodes.csv')
 
 
 if __name__ == "__main__":
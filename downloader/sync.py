@@ -0,0 +1,162 @@
+"""Incrementally refresh a hotspot dataset.
+
+A local sqlite store keeps every hotspot of a region keyed by address, with
+its location, last poc challenge and the height it was last seen at. A sync
+lists the region, only fetches details for hotspots whose state may have
+changed, applies the HIP17 interactivity filter locally against the current
+height, and emits the change set between the previous and the new set of
+active hotspots:
+    {"op": "add", "address": ..., "name": ..., "lat": ..., "lng": ...}
+    {"op": "move", "address": ..., "lat": ..., "lng": ...}
+    {"op": "remove", "address": ...}
+RewardGraph.apply_changes consumes these to update reward scales incrementally.
+"""
+
+import csv
+import json
+import sqlite3
+
+from fetcher import NODE_FIELDS
+from fetcher import map_unordered
+from fetcher import nodes_in_box
+from tiling import DEFAULT_TILE_SIZE
+
+# Same as chain_vars.HIP_17_INTERACTIVITY_BLOCKS.
+INTERACTIVITY_BLOCKS = 3600
+
+class HotspotStore:
+    """A sqlite store of the hotspots of a region."""
+
+    def __init__(self, path):
+        """Open or create the store at path."""
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS hotspots (
+                address TEXT PRIMARY KEY,
+                name TEXT,
+                lat REAL,
+                lng REAL,
+                reward_scale REAL,
+                last_poc_challenge INTEGER,
+                last_change_block INTEGER,
+                last_seen_height INTEGER,
+                active INTEGER
+            )
+        """)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        self.db.close()
+
+    def height(self):
+        """Return the height of the last sync, None if never synced."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'height'").fetchone()
+        return None if row is None else int(row[0])
+
+    def hotspots(self):
+        """Return a dict of address -> hotspot row dict."""
+        cursor = self.db.execute("SELECT * FROM hotspots")
+        columns = [column[0] for column in cursor.description]
+        return {row[0]: dict(zip(columns, row)) for row in cursor}
+
+    def save(self, hotspots, height):
+        """Replace the stored hotspots and record the sync height."""
+        with self.db:
+            self.db.execute("DELETE FROM hotspots")
+            self.db.executemany(
+                "INSERT INTO hotspots VALUES (:address, :name, :lat, :lng, :reward_scale, "
+                ":last_poc_challenge, :last_change_block, :last_seen_height, :active)",
+                hotspots.values()
+            )
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('height', ?)", (str(height),))
+
+def needs_details(node, stored):
+    """Return True if the listing of a hotspot is not enough to update it."""
+    if node.get('last_poc_challenge') is not None:
+        return False
+    return stored is None or stored['last_change_block'] != node.get('last_change_block')
+
+def diff_active(old, new):
+    """Return the change set between two dicts of address -> hotspot rows."""
+    changes = []
+    for address, hotspot in new.items():
+        if not hotspot['active']:
+            continue
+        before = old.get(address)
+        if before is None or not before['active']:
+            changes.append({'op': 'add', 'address': address, 'name': hotspot['name'], 'lat': hotspot['lat'], 'lng': hotspot['lng']})
+        elif (before['lat'], before['lng']) != (hotspot['lat'], hotspot['lng']):
+            changes.append({'op': 'move', 'address': address, 'lat': hotspot['lat'], 'lng': hotspot['lng']})
+    for address, hotspot in old.items():
+        if hotspot['active'] and not new.get(address, {'active': False})['active']:
+            changes.append({'op': 'remove', 'address': address})
+    return changes
+
+async def sync(fetcher, store, swlat, swlon, nelat, nelon, interactivity_blocks=INTERACTIVITY_BLOCKS, tile_size=DEFAULT_TILE_SIZE):
+    """Refresh the store with the hotspots of a box.
+
+    The box is listed in full, but hotspot details are only requested for
+    hotspots that are new or whose last_change_block moved, so a refresh
+    costs the listing plus one request per changed hotspot. Hotspots that
+    left the box are dropped from the store.
+
+    RETURNS:
+        -> (changes, fetched): the change set of the active hotspots, and the
+            number of hotspots whose details had to be fetched.
+    """
+    height = await fetcher.get_height()
+    old = store.hotspots()
+    new = {}
+    listed = []
+    async for node in nodes_in_box(fetcher, swlat, swlon, nelat, nelon, tile_size):
+        if node['lat'] is None or node['lng'] is None:
+            continue
+        stored = old.get(node['address'])
+        new[node['address']] = {
+            'address': node['address'],
+            'name': node['name'],
+            'lat': node['lat'],
+            'lng': node['lng'],
+            'reward_scale': node.get('reward_scale'),
+            'last_poc_challenge': node.get('last_poc_challenge'),
+            'last_change_block': node.get('last_change_block'),
+            'last_seen_height': height,
+            'active': 0
+        }
+        if needs_details(node, stored):
+            listed.append(node)
+        elif node.get('last_poc_challenge') is None:
+            new[node['address']]['last_poc_challenge'] = stored['last_poc_challenge']
+
+    async def items():
+        for node in listed:
+            yield node
+
+    fetched = 0
+    get_details = lambda node: fetcher.get_last_poc_challenge(node['address'])
+    async for node, last_poc_challenge in map_unordered(items(), get_details, fetcher.concurrency * 4):
+        new[node['address']]['last_poc_challenge'] = last_poc_challenge
+        fetched += 1
+
+    for hotspot in new.values():
+        last_poc_challenge = hotspot['last_poc_challenge'] or 0
+        hotspot['active'] = int(height - last_poc_challenge <= interactivity_blocks)
+
+    changes = diff_active(old, new)
+    store.save(new, height)
+    return changes, fetched
+
+def write_nodes_file(store, file):
+    """Write the active hotspots of the store to a nodes csv file."""
+    with open(file, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(NODE_FIELDS)
+        for hotspot in store.hotspots().values():
+            if hotspot['active']:
+                writer.writerow([hotspot['address'], hotspot['name'], hotspot['lat'], hotspot['lng'], hotspot['reward_scale']])
+
+def write_changes(changes, file):
+    """Write a change set as json lines."""
+    with open(file, 'w') as f:
+        for change in changes:
+            f.write(json.dumps(change) + '\n')
@@ -0,0 +1,65 @@
+"""Fetch large boxes as tiles of a fixed lat/lng grid.
+
+Tiles are aligned to a global grid, so overlapping regions request the same
+tiles and can be served from the response cache. Tiles are fetched in
+parallel and merged, keeping one entry per hotspot address.
+"""
+
+import asyncio
+import math
+
+# Edge length of a tile, in degrees.
+DEFAULT_TILE_SIZE = 0.25
+
+def split_box(swlat, swlon, nelat, nelon, tile_size=DEFAULT_TILE_SIZE):
+    """Return the grid tiles covering a box.
+
+    RETURNS:
+        -> A list of (swlat, swlon, nelat, nelon) tiles. Tile corners are
+            multiples of tile_size, rounded to avoid float noise.
+    """
+    swlat, swlon, nelat, nelon = float(swlat), float(swlon), float(nelat), float(nelon)
+    tiles = []
+    for i in range(math.floor(swlat / tile_size), math.ceil(nelat / tile_size)):
+        for j in range(math.floor(swlon / tile_size), math.ceil(nelon / tile_size)):
+            tiles.append((
+                round(i * tile_size, 9), round(j * tile_size, 9),
+                round((i + 1) * tile_size, 9), round((j + 1) * tile_size, 9)
+            ))
+    return tiles
+
+async def fetch_tile(fetcher, tile, cache=None, ttl=None):
+    """Return all hotspots of a tile, from the cache when possible."""
+    if cache is not None:
+        key = cache.key(fetcher.api_url, "/v1/hotspots/location/box", tile)
+        nodes = cache.get(key, ttl)
+        if nodes is not None:
+            return nodes
+    nodes = [node async for node in fetcher.get_nodes_box(*tile)]
+    if cache is not None:
+        cache.put(key, nodes)
+    return nodes
+
+async def get_nodes_box_tiled(fetcher, swlat, swlon, nelat, nelon, tile_size=DEFAULT_TILE_SIZE, cache=None, ttl=None):
+    """Return all hotspots within a box, fetched as cached grid tiles.
+
+    REQUIRES:
+        -> fetcher: an open fetcher.HeliumFetcher.
+        -> cache: an optional cache.ResponseCache.
+    RETURNS:
+        -> list: the hotspots inside the box, one per address.
+    """
+    swlat, swlon, nelat, nelon = float(swlat), float(swlon), float(nelat), float(nelon)
+    tiles = split_box(swlat, swlon, nelat, nelon, tile_size)
+    results = await asyncio.gather(*(fetch_tile(fetcher, tile, cache, ttl) for tile in tiles))
+
+    nodes = {}
+    for tile_nodes in results:
+        for node in tile_nodes:
+            if node['address'] in nodes:
+                continue
+            if node['lat'] is None or node['lng'] is None:
+                continue
+            if swlat <= node['lat'] <= nelat and swlon <= node['lng'] <= nelon:
+                nodes[node['address']] = node
+    return list(nodes.values())
@@ -1,23 +1,36 @@
-"""Utilities for downloading data from the helium api."""
+"""Utilities for downloading data from the helium api.
+
+requests is imported by the functions that use it, so importing this module
+stays fast for commands that never reach the api.
+"""
 
 import json
-import requests
 import datetime
 
 def get_nodes_box(swlat, swlon, nelat, nelon):
     """Downloads the nodes in a given box."""
+    import requests
+
     endpoint = "https://api.helium.io/v1/hotspots/location/box"
     query = "?swlat={swlat}&swlon={swlon}&nelat={nelat}&nelon={nelon}"
     query = query.format(swlat=swlat, swlon=swlon, nelat=nelat, nelon=nelon)
 
     print(endpoint+query)
 
-    r = requests.get(endpoint+query)
-
-    return json.loads(r.text)['data']
+    nodes = []
+    cursor = None
+    while True:
+        r = requests.get(endpoint+query + ("" if cursor is None else f"&cursor={cursor}"))
+        body = json.loads(r.text)
+        nodes += body['data']
+        cursor = body.get('cursor')
+        if not cursor:
+            return nodes
 
 def compute_miner_earnings(miner_addr):
     """Return the earnings of a given miner in the past 30 days."""
+    import requests
+
     time_max = datetime.datetime.now()
     time_min = time_max - datetime.timedelta(30)
     endpoint = "https://api.helium.io/v1/hotspots/{}/rewards/sum".format(miner_addr)
@@ -30,6 +43,8 @@ def compute_miner_earnings(miner_addr):
     return miner_data
 
 def get_last_poc_challenge(addr):
+    import requests
+
     endpoint = f"https://api.helium.io/v1/hotspots/{addr}"
     r = requests.get(endpoint)
     data = json.loads(r.text)
@@ -38,5 +53,7 @@ def get_last_poc_challenge(addr):
     return int(data['data']['last_poc_challenge'])
 
 def get_height():
+    import requests
+
     endpoint = "https://api.helium.io/v1/blocks/height"
     return int(json.loads(requests.get(endpoint).text)['data']['height'])
\ No newline at end of file
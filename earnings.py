@@ -0,0 +1,461 @@
+"""HNT earnings prediction from reward scale and hotspot density features.
+
+Every location is described by features read from a generated RewardGraph:
+    -> reward_scale: the product of the clipped / unclipped ratios of the
+        ancestors of its RES_MAX hex, its reward scale if the hex holds a
+        hotspot, and the scale of its neighborhood otherwise.
+    -> the clipped and unclipped densities of its ancestor at every
+        resolution of FEATURE_RES, 0 where the ancestor is empty.
+    -> the number of hotspots in its ancestor at every resolution of
+        COUNT_RES.
+    -> the number of hotspots in the k-ring (k = 1) of its NEIGHBOR_RES
+        ancestor, and their density in hotspots per square km.
+Counts and densities are log1p transformed. Features are computed with
+numpy lookups into the packed densities, one batch of locations at a time,
+with one h3 call per distinct NEIGHBOR_RES ancestor.
+
+A new hotspot is predicted from the features of its location in the graph
+as it is. Training rows describe the same situation: every trained hotspot
+is left out of its own features, by scoring its location on a
+whatif.HexOverlay with the hotspot removed. Otherwise every training row
+would count its own hotspot at every level, and locations far from other
+hotspots would never be seen in training.
+
+EarningsModel is a ridge regression of log1p(earnings) on the standardized
+features, solved in closed form with numpy. It is saved to an .npz file
+holding everything prediction needs, so predicting never refits.
+
+Training data is the output of downloader/main.py: one
+'earnings,lat,lng,reward_scale,address' line per hotspot, no header.
+"""
+
+import csv
+import sys
+
+import click
+import h3
+import numpy as np
+
+from chain_vars import *
+from hex_arrays import cells_to_descendant_bounds
+from hex_arrays import cells_to_parents
+from hex_arrays import cells_to_strings
+from hex_arrays import geo_to_cells
+from hex_arrays import strings_to_cells
+from heatmap import bbox_cells
+from lazy_hex_dict import LazyHexDict
+from reward_graph import RewardGraph
+from whatif import HexOverlay
+
+# Resolutions whose ancestor densities are features.
+FEATURE_RES = range(RES_MIN, RES_MAX)
+
+# Resolutions whose ancestor hotspot counts are features.
+COUNT_RES = range(RES_MAX - 1, RES_MAX - 5, -1)
+
+# Resolution of the hexes whose k-ring hotspots are counted.
+NEIGHBOR_RES = 8
+
+# Number of locations featurized and predicted at once.
+BATCH_SIZE = 65536
+
+# Version of the saved model format.
+MODEL_VERSION = 2
+
+def feature_names():
+    """Return the names of the features, in the order of their columns."""
+    names = ['reward_scale']
+    for res in FEATURE_RES:
+        names += [f'unclipped_{res}', f'clipped_{res}']
+    names += [f'hotspots_{res}' for res in COUNT_RES]
+    names += ['neighbors', 'neighbor_density']
+    return names
+
+def read_earnings_file(path):
+    """Read the earnings of hotspots written by downloader/main.py.
+
+    RETURNS:
+        -> (earnings, lats, lngs, addresses): float64 arrays and a list.
+    """
+    earnings, lats, lngs, addresses = [], [], [], []
+    with open(path, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            if len(row) < 5:
+                raise Exception(f"Invalid earnings line in {path}: {','.join(row)}")
+            earnings.append(float(row[0]))
+            lats.append(float(row[1]))
+            lngs.append(float(row[2]))
+            addresses.append(row[4].strip())
+    return (
+        np.array(earnings, dtype=np.float64),
+        np.array(lats, dtype=np.float64),
+        np.array(lngs, dtype=np.float64),
+        addresses
+    )
+
+class FeatureBuilder:
+    """Computes the features of locations against the densities of a RewardGraph."""
+
+    def __init__(self, reward_graph):
+        """Constructor.
+
+        REQUIRES:
+            -> reward_graph: a RewardGraph with the dict or compact storage
+                backend. Densities are generated if needed.
+        """
+        if isinstance(reward_graph.hex_dict, LazyHexDict):
+            raise Exception("Earnings features are not supported by the lazy storage backend.")
+        if not reward_graph.hex_dict.generated:
+            reward_graph._generate_reward_scales()
+        self.params = reward_graph.params
+        self.hex_dict = reward_graph.hex_dict
+        self.topology = reward_graph.hex_dict.topology
+        self.packed = reward_graph.hex_dict.packed()
+        # Occupied RES_MAX hexes, and the running total of their hotspots.
+        hex_ids, _, raw_density = self.packed.levels[RES_MAX]
+        self.hex_ids = hex_ids
+        self.cumulative_density = np.concatenate([[0], np.cumsum(raw_density)])
+        # NEIGHBOR_RES cell -> hotspots in its k-ring.
+        self._neighbor_counts = {}
+        self._neighbor_area = 7 * h3.hex_area(NEIGHBOR_RES, unit='km^2')
+
+    def hotspot_counts(self, cells, res):
+        """Return the number of hotspots below every hex of cells at res."""
+        low, high = cells_to_descendant_bounds(cells, res, RES_MAX)
+        starts = np.searchsorted(self.hex_ids, low, side='left')
+        ends = np.searchsorted(self.hex_ids, high, side='right')
+        return self.cumulative_density[ends] - self.cumulative_density[starts]
+
+    def neighbor_counts(self, cells):
+        """Return the number of hotspots in the k-ring of every NEIGHBOR_RES cell."""
+        unique, inverse = np.unique(cells, return_inverse=True)
+        counts = np.empty(len(unique), dtype=np.int64)
+        for i, cell in enumerate(unique.tolist()):
+            count = self._neighbor_counts.get(cell)
+            if count is None:
+                count = self._neighbor_counts[cell] = int(
+                    self.hotspot_counts(self.topology.cell_neighbors(cell), NEIGHBOR_RES).sum()
+                )
+            counts[i] = count
+        return counts[inverse]
+
+    def excluded_densities(self, cells):
+        """Compute the ancestor densities of occupied cells with one of their hotspots removed.
+
+        Every distinct cell is removed from its own HexOverlay, so the
+        densities of its ancestors are reclipped exactly as if the hotspot
+        had never been added.
+
+        REQUIRES:
+            -> The graph uses the dict storage backend.
+        RETURNS:
+            -> (removed, densities): removed is 1 for every cell holding a
+                hotspot and 0 otherwise, densities a dict of
+                res -> (clipped, unclipped) arrays for every res below
+                RES_MAX, only meaningful where removed is 1.
+        """
+        _, occupied = self.packed.lookup(cells, RES_MAX)
+        unique, inverse = np.unique(cells[occupied], return_inverse=True)
+        parents = {res: cells_to_strings(cells_to_parents(unique, res)) for res in range(RES_MIN - 1, RES_MAX)}
+        levels = {res: np.zeros((2, len(unique)), dtype=np.int64) for res in parents}
+        for i, hex_id in enumerate(cells_to_strings(unique)):
+            overlay = HexOverlay(self.hex_dict)
+            overlay.update_raw_densities({hex_id: -1})
+            for res, level in levels.items():
+                hex = overlay.hex_dict[res].get(parents[res][i])
+                if hex is not None:
+                    level[0, i] = hex.clipped_density
+                    level[1, i] = hex.unclipped_density
+        densities = {}
+        for res, level in levels.items():
+            clipped = np.zeros(len(cells), dtype=np.int64)
+            unclipped = np.zeros(len(cells), dtype=np.int64)
+            clipped[occupied] = level[0][inverse]
+            unclipped[occupied] = level[1][inverse]
+            densities[res] = (clipped, unclipped)
+        return occupied.astype(np.int64), densities
+
+    def features(self, cells, exclude=False):
+        """Compute the features of RES_MAX cells.
+
+        REQUIRES:
+            -> exclude: if True, cells holding a hotspot get the features they
+                would have without one of their hotspots, see
+                excluded_densities. Used for the rows of trained hotspots.
+        RETURNS:
+            -> np.ndarray[float64]: one row per cell, one column per feature_names entry.
+        """
+        cells = np.asarray(cells, dtype=np.uint64)
+        removed = np.zeros(len(cells), dtype=np.int64)
+        if exclude:
+            removed, excluded = self.excluded_densities(cells)
+        columns = {}
+        reward_scales = np.ones(len(cells), dtype=np.float64)
+        # Multiplied in the order of PackedLevels.reward_scales, so occupied
+        # hexes get their exact reward scale.
+        for res in range(RES_MAX - 1, RES_MIN - 2, -1):
+            _, clipped, unclipped = self.packed.levels[res]
+            positions, found = self.packed.lookup(cells_to_parents(cells, res), res)
+            clipped = np.where(found, clipped[positions] if len(clipped) else 0, 0)
+            unclipped = np.where(found, unclipped[positions] if len(unclipped) else 0, 0)
+            if exclude:
+                # Hexes emptied by the removal are not part of the graph.
+                found = np.where(removed == 1, excluded[res][1] > 0, found)
+                clipped = np.where(removed == 1, excluded[res][0], clipped)
+                unclipped = np.where(removed == 1, excluded[res][1], unclipped)
+            reward_scales *= np.where(found, clipped / np.maximum(unclipped, 1), 1.0)
+            columns[f'unclipped_{res}'] = np.log1p(unclipped)
+            columns[f'clipped_{res}'] = np.log1p(clipped)
+        columns['reward_scale'] = reward_scales
+        # The removed hotspot lies below every ancestor and in its own k-ring.
+        for res in COUNT_RES:
+            columns[f'hotspots_{res}'] = np.log1p(self.hotspot_counts(cells_to_parents(cells, res), res) - removed)
+        neighbors = self.neighbor_counts(cells_to_parents(cells, NEIGHBOR_RES)) - removed
+        columns['neighbors'] = np.log1p(neighbors)
+        columns['neighbor_density'] = np.log1p(neighbors / self._neighbor_area)
+        return np.column_stack([columns[name] for name in feature_names()])
+
+    def location_features(self, lats, lngs, exclude=False):
+        """Compute the features of locations, see features."""
+        return self.features(geo_to_cells(lats, lngs, RES_MAX), exclude)
+
+class EarningsModel:
+    """A ridge regression of log1p(earnings) on standardized features."""
+
+    def __init__(self, names, mean, scale, coef, intercept, alpha, params_key):
+        """Constructor, see fit to train a model.
+
+        REQUIRES:
+            -> names: the feature names the model was fit on.
+            -> mean, scale: float64 arrays standardizing every feature.
+            -> coef, intercept: the regression weights.
+            -> params_key: the key of the chain params of the training graph.
+        """
+        self.names = list(names)
+        self.mean = mean
+        self.scale = scale
+        self.coef = coef
+        self.intercept = float(intercept)
+        self.alpha = float(alpha)
+        self.params_key = params_key
+
+    @classmethod
+    def fit(cls, features, earnings, alpha=1.0, params_key=''):
+        """Fit a model.
+
+        REQUIRES:
+            -> features: a (hotspots x features) array from FeatureBuilder.
+            -> earnings: the earnings of every hotspot, negative values count as 0.
+            -> alpha: the ridge penalty on the standardized weights.
+        """
+        features = np.asarray(features, dtype=np.float64)
+        target = np.log1p(np.maximum(np.asarray(earnings, dtype=np.float64), 0.0))
+        if len(target) == 0:
+            raise Exception("Cannot fit earnings model. No hotspots with earnings.")
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1.0
+        standardized = (features - mean) / scale
+        intercept = target.mean()
+        gram = standardized.T @ standardized + alpha * np.eye(features.shape[1])
+        coef = np.linalg.lstsq(gram, standardized.T @ (target - intercept), rcond=None)[0]
+        return cls(feature_names(), mean, scale, coef, intercept, alpha, params_key)
+
+    def predict_log(self, features):
+        """Predict log1p(earnings) from a (locations x features) array."""
+        return ((np.asarray(features, dtype=np.float64) - self.mean) / self.scale) @ self.coef + self.intercept
+
+    def predict(self, features):
+        """Predict the earnings of every row of a (locations x features) array."""
+        return np.maximum(np.expm1(self.predict_log(features)), 0.0)
+
+    def evaluate(self, features, earnings):
+        """Score the model on known earnings.
+
+        RETURNS:
+            -> dict: rmse and r2 of log1p(earnings), and the mean absolute
+                error of earnings.
+        """
+        earnings = np.maximum(np.asarray(earnings, dtype=np.float64), 0.0)
+        target = np.log1p(earnings)
+        predicted = self.predict_log(features)
+        residuals = target - predicted
+        total = ((target - target.mean()) ** 2).sum()
+        return {
+            'rmse': float(np.sqrt((residuals ** 2).mean())),
+            'r2': float(1 - (residuals ** 2).sum() / total) if total else 0.0,
+            'mae': float(np.abs(earnings - np.maximum(np.expm1(predicted), 0.0)).mean()),
+        }
+
+    def save(self, path):
+        """Write the model to an .npz file."""
+        np.savez(
+            path, version=MODEL_VERSION, names=np.array(self.names), mean=self.mean, scale=self.scale,
+            coef=self.coef, intercept=self.intercept, alpha=self.alpha, params_key=self.params_key
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read a model written by save."""
+        with np.load(path) as data:
+            if int(data['version']) != MODEL_VERSION:
+                raise Exception(f"Unsupported earnings model version {int(data['version'])} in {path}.")
+            names = data['names'].tolist()
+            if names != feature_names():
+                raise Exception(f"Earnings model {path} was fit on different features.")
+            return cls(
+                names, data['mean'], data['scale'], data['coef'],
+                float(data['intercept']), float(data['alpha']), str(data['params_key'])
+            )
+
+def fit_model(reward_graph, lats, lngs, earnings, alpha=1.0):
+    """Fit an EarningsModel on the earnings of hotspots of a RewardGraph.
+
+    Every hotspot of the graph is left out of its own features, see
+    FeatureBuilder.features.
+
+    REQUIRES:
+        -> reward_graph: a RewardGraph with the dict storage backend.
+    RETURNS:
+        -> (model, features): the model and the features of the hotspots.
+    """
+    builder = FeatureBuilder(reward_graph)
+    features = builder.location_features(lats, lngs, exclude=True)
+    return EarningsModel.fit(features, earnings, alpha, reward_graph.params.key()), features
+
+def predict_cells(reward_graph, model, cells, batch_size=BATCH_SIZE):
+    """Predict the earnings of a hotspot placed in every RES_MAX cell.
+
+    REQUIRES:
+        -> model: an EarningsModel fit with the chain params of reward_graph.
+    RETURNS:
+        -> np.ndarray[float64]: the predicted earnings of every cell.
+    """
+    if model.params_key and model.params_key != reward_graph.params.key():
+        raise Exception("Earnings model was fit with different chain params.")
+    builder = FeatureBuilder(reward_graph)
+    cells = np.asarray(cells, dtype=np.uint64)
+    earnings = np.empty(len(cells), dtype=np.float64)
+    for start in range(0, len(cells), batch_size):
+        end = min(start + batch_size, len(cells))
+        earnings[start:end] = model.predict(builder.features(cells[start:end]))
+    return earnings
+
+def predict_locations(reward_graph, model, lats, lngs, batch_size=BATCH_SIZE):
+    """Predict the earnings of a hotspot placed at every location, see predict_cells."""
+    return predict_cells(reward_graph, model, geo_to_cells(lats, lngs, RES_MAX), batch_size)
+
+def check_training_features(reward_graph, node_ids):
+    """Check that the training row of hotspots matches the features predicted at their location.
+
+    Every hotspot is removed from the graph, the features of its location
+    are computed as for a new placement, and the hotspot is added back.
+
+    REQUIRES:
+        -> reward_graph: a RewardGraph with the dict storage backend.
+        -> node_ids: ids of nodes of the graph.
+    RETURNS:
+        -> list: (node_id, feature name, training value, predicted value) of
+            every mismatching feature.
+    """
+    nodes = [reward_graph.graph.node(node_id) for node_id in node_ids]
+    lats = np.array([node['lat'] for node in nodes], dtype=np.float64)
+    lngs = np.array([node['lng'] for node in nodes], dtype=np.float64)
+    training = FeatureBuilder(reward_graph).location_features(lats, lngs, exclude=True)
+    mismatches = []
+    for node, row in zip(nodes, training):
+        attributes = {key: value for key, value in node.attributes.items() if key not in ('lat', 'lng')}
+        reward_graph.remove_hotspot(node.node_identifier)
+        predicted = FeatureBuilder(reward_graph).location_features([node['lat']], [node['lng']])[0]
+        reward_graph.add_hotspot(node.node_identifier, node['lat'], node['lng'], **attributes)
+        for name, expected, value in zip(feature_names(), row.tolist(), predicted.tolist()):
+            if not np.isclose(expected, value, rtol=0, atol=1e-12):
+                mismatches.append((node.node_identifier, name, expected, value))
+    return mismatches
+
+def grid_cells(nelat:float, nelng:float, swlat:float, swlng:float, res:int):
+    """Return the h3 cells at res whose center lies in a box, with their center RES_MAX cells.
+
+    RETURNS:
+        -> (cells, centers): sorted uint64 arrays. The center child of a cell
+            shares its center, and is the lowest of its descendants.
+    """
+    cells = strings_to_cells(bbox_cells(nelat, nelng, swlat, swlng, res))
+    return cells, cells_to_descendant_bounds(cells, res, RES_MAX)[0]
+
+def _coordinate(value):
+    """Parse a coordinate where a leading 'n' stands for a minus sign."""
+    return float(value.replace('n', '-'))
+
+@click.group()
+def main():
+    """Fit and apply HNT earnings models."""
+
+@main.command()
+@click.argument('graph_file')
+@click.argument('earnings_file')
+@click.argument('model_file')
+@click.option('--alpha', default=1.0, help='Ridge penalty of the model weights.')
+@click.option('--holdout', default=0.2, help='Fraction of the hotspots held out to evaluate the model.')
+@click.option('--seed', default=0, help='Seed of the holdout split.')
+def fit(graph_file, earnings_file, model_file, alpha, holdout, seed):
+    """Fit a model on graph_data/(graph_file)_nodes.csv and the earnings of downloader/main.py."""
+    reward_graph = RewardGraph()
+    reward_graph.import_graph_from_csv(graph_file)
+    earnings, lats, lngs, _ = read_earnings_file(earnings_file)
+    held_out = np.random.default_rng(seed).random(len(earnings)) < holdout
+    if held_out.any() and not held_out.all():
+        model, features = fit_model(reward_graph, lats[~held_out], lngs[~held_out], earnings[~held_out], alpha)
+        test = FeatureBuilder(reward_graph).location_features(lats[held_out], lngs[held_out], exclude=True)
+        print(f'train: {model.evaluate(features, earnings[~held_out])}')
+        print(f'holdout: {model.evaluate(test, earnings[held_out])}')
+    model, features = fit_model(reward_graph, lats, lngs, earnings, alpha)
+    print(f'all: {model.evaluate(features, earnings)}')
+    model.save(model_file)
+    print(f'Wrote model of {len(earnings)} hotspots to {model_file}')
+
+@main.command()
+@click.argument('graph_file')
+@click.argument('model_file')
+@click.argument('nelat')
+@click.argument('nelon')
+@click.argument('swlat')
+@click.argument('swlon')
+@click.option('--res', default=10, help='Resolution of the predicted cells.')
+@click.option('--batch-size', default=BATCH_SIZE, help='Number of cells predicted at once.')
+@click.option('--output', default=None, help='Output file, defaults to (graph_file)_earnings.npz.')
+def predict(graph_file, model_file, nelat, nelon, swlat, swlon, res, batch_size, output):
+    """Predict the earnings of a new hotspot in every cell of a box. For negative coords, prepend a 'n' on the number. Ex(n83 = -83)"""
+    if res > RES_MAX:
+        raise Exception(f"Prediction resolution must be at most {RES_MAX}.")
+    model = EarningsModel.load(model_file)
+    reward_graph = RewardGraph()
+    reward_graph.import_graph_from_csv(graph_file)
+    cells, centers = grid_cells(*(_coordinate(c) for c in (nelat, nelon, swlat, swlon)), res)
+    earnings = predict_cells(reward_graph, model, centers, batch_size)
+    if output is None:
+        output = f'{graph_file}_earnings.npz'
+    np.savez_compressed(output, cells=cells, earnings=earnings)
+    print(f'Wrote {len(cells)} cells to {output}')
+
+@main.command()
+@click.argument('graph_file')
+@click.option('--samples', default=20, help='Number of hotspots checked.')
+@click.option('--seed', default=0, help='Seed of the sampled hotspots.')
+def check(graph_file, samples, seed):
+    """Check that the training features of sampled hotspots of graph_data/(graph_file)_nodes.csv match prediction."""
+    reward_graph = RewardGraph()
+    reward_graph.import_graph_from_csv(graph_file)
+    node_ids = [node.node_identifier for node in reward_graph.nodes()]
+    sample = np.random.default_rng(seed).choice(len(node_ids), min(samples, len(node_ids)), replace=False)
+    mismatches = check_training_features(reward_graph, [node_ids[i] for i in sample.tolist()])
+    for node_id, name, expected, value in mismatches:
+        print(f'{node_id}: {name} is {expected} in training and {value} in prediction')
+    print(f'Checked {len(sample)} hotspots, {len(mismatches)} mismatching features')
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,27 @@
-import collections
+"""The hotspot graph: nodes with attributes, witness edges and a spatial index.
+
+Every node gets a stable integer index when it is added, which the witness
+edges refer to, and nodes() returns them in index order. Nodes loaded from
+a node file keep their attributes in the loader.NodeColumns chunks they
+were parsed into: only their index is recorded when they are loaded, and
+their Node is created the first time it is looked up. Nodes added one at a
+time are stored as Node objects. Edges are stored in compressed sparse row
+arrays. Node locations are kept in a SpatialIndex for radius and nearest
+hotspot queries. The index is built on the first spatial query, so loading
+a graph that is never queried spatially (e.g. from a snapshot) costs no
+h3 calls.
+"""
+
+import bisect
 import csv
 import doctest
+import os
+
+import numpy as np
+
+from loader import _to_float
+from loader import read_node_chunks
+from spatial_index import SpatialIndex
 
 class Node:
     def __init__(self, identifier, **attributes):
@@ -16,43 +37,247 @@ class Node:
     def __setitem__(self, key, value):
         self.attributes[key] = value
 
+class Adjacency:
+    """Directed weighted edges between node indexes, in compressed sparse row arrays.
+
+    The edges of node index i are targets[offsets[i]:offsets[i + 1]], with
+    their rssi in the same positions of rssi.
+    """
+
+    def __init__(self, node_count, sources, targets, rssi):
+        """Constructor.
+
+        REQUIRES:
+            -> node_count: the number of node indexes.
+            -> sources, targets: int64 arrays of node indexes below node_count.
+            -> rssi: a float64 array, nan where unknown.
+        """
+        order = np.argsort(sources, kind='stable')
+        self.targets = np.asarray(targets, dtype=np.int64)[order]
+        self.rssi = np.asarray(rssi, dtype=np.float64)[order]
+        self.offsets = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=node_count), out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.targets)
+
+    def edges(self, index):
+        """Return the (targets, rssi) arrays of the edges of a node index."""
+        if index + 1 >= len(self.offsets):
+            return self.targets[:0], self.rssi[:0]
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.targets[start:end], self.rssi[start:end]
+
 class Graph:
 
     def __init__(self):
+        # node_id -> Node of every node looked up or added one at a time.
         self.graph_nodes = {}
-        self.graph_edges = collections.defaultdict(dict)
+        # node_id -> stable index, and index -> node_id (None once removed).
+        self.node_indexes = {}
+        self.node_ids = []
+        # NodeColumns chunks and the index of their first node.
+        self.column_chunks = []
+        self.column_starts = []
+        self.edges = Adjacency(0, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+        # Built by the spatial_index property on first use.
+        self._spatial_index = None
 
     def __len__(self):
-        return len(self.graph_nodes)
+        return len(self.node_indexes)
+
+    def __contains__(self, node_id):
+        return node_id in self.node_indexes
+
+    @property
+    def spatial_index(self):
+        """The SpatialIndex of the node locations, built on first use."""
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex()
+            for start, columns in zip(self.column_starts, self.column_chunks):
+                # Rows replaced by add_node or removed since are skipped.
+                rows = [
+                    i for i, node_id in enumerate(self.node_ids[start:start + len(columns)])
+                    if node_id is not None and node_id not in self.graph_nodes
+                ]
+                self._spatial_index.insert_many(columns.address[rows].tolist(), columns.lat[rows], columns.lng[rows])
+            located = [node for node in self.graph_nodes.values() if 'lat' in node.attributes and 'lng' in node.attributes]
+            self._spatial_index.insert_many(
+                [node.node_identifier for node in located],
+                np.array([node['lat'] for node in located], dtype=np.float64),
+                np.array([node['lng'] for node in located], dtype=np.float64)
+            )
+        return self._spatial_index
+
+    def _index(self, node_id):
+        """Return the index of node_id, assigning a new one if needed."""
+        index = self.node_indexes.get(node_id)
+        if index is None:
+            index = self.node_indexes[node_id] = len(self.node_ids)
+            self.node_ids.append(node_id)
+        return index
 
     def add_node(self, node_id, **attributes):
+        """Add a node, or replace the attributes of an existing one."""
+        self._index(node_id)
         self.graph_nodes[node_id] = Node(identifier=node_id, **attributes)
+        if self._spatial_index is not None:
+            self._spatial_index.remove(node_id)
+            if 'lat' in attributes and 'lng' in attributes:
+                self._spatial_index.insert(node_id, attributes['lat'], attributes['lng'])
+
+    def add_node_columns(self, columns):
+        """Add every node of a loader.NodeColumns chunk, keyed by address.
+
+        The chunk is kept as is, see the module docstring.
+
+        REQUIRES:
+            -> Every address is non empty and not yet in the graph.
+        """
+        addresses = columns.address.tolist()
+        start = len(self.node_ids)
+        indexes = dict(zip(addresses, range(start, start + len(addresses))))
+        if '' in indexes:
+            raise Exception("Node file contains a node without an address.")
+        if len(indexes) != len(addresses) or not self.node_indexes.keys().isdisjoint(indexes):
+            seen = set(self.node_indexes)
+            for address in addresses:
+                if address in seen:
+                    raise Exception(f"Node file contains the address {address} more than once.")
+                seen.add(address)
+        self.node_indexes.update(indexes)
+        self.node_ids.extend(addresses)
+        self.column_starts.append(start)
+        self.column_chunks.append(columns)
+        if self._spatial_index is not None:
+            self._spatial_index.insert_many(columns.address.tolist(), columns.lat, columns.lng)
+
+    def move_node(self, node_id, lat:float, lng:float):
+        """Change the location of a node."""
+        node = self.node(node_id)
+        node['lat'] = lat
+        node['lng'] = lng
+        if self._spatial_index is not None:
+            self._spatial_index.insert(node_id, lat, lng)
+
+    def remove_node(self, node_id):
+        """Remove a node. Its index is not reused, its edges are ignored from now on."""
+        index = self.node_indexes.pop(node_id)
+        self.graph_nodes.pop(node_id, None)
+        self.node_ids[index] = None
+        if self._spatial_index is not None:
+            self._spatial_index.remove(node_id)
 
     def node(self, node_id):
-        return self.graph_nodes[node_id]
+        """Return the Node of node_id, creating it from its node columns if needed."""
+        node = self.graph_nodes.get(node_id)
+        if node is None:
+            index = self.node_indexes[node_id]
+            chunk = bisect.bisect_right(self.column_starts, index) - 1
+            attributes = self.column_chunks[chunk].row(index - self.column_starts[chunk])
+            node = self.graph_nodes[node_id] = Node(identifier=node_id, **attributes)
+        return node
+
+    def set_located_attribute(self, name, function):
+        """Set an attribute of every node to a function of its location.
+
+        REQUIRES:
+            -> function: maps float64 arrays of lats and lngs to an array of
+                values. It is called once per node columns chunk, whose
+                nodes get the values as an extra column, and once for the
+                Node objects.
+        """
+        for columns in self.column_chunks:
+            columns.extra[name] = np.asarray(function(columns.lat, columns.lng))
+        nodes = list(self.graph_nodes.values())
+        if nodes:
+            values = function(
+                np.array([node['lat'] for node in nodes], dtype=np.float64),
+                np.array([node['lng'] for node in nodes], dtype=np.float64)
+            )
+            for node, value in zip(nodes, np.asarray(values).tolist()):
+                node[name] = value
 
     def nodes(self):
-        return [self.graph_nodes[node] for node in sorted(self.graph_nodes)]
+        """Return every node, in index order."""
+        return [self.node(node_id) for node_id in self.node_ids if node_id is not None]
+
+    def within(self, lat:float, lng:float, radius_km:float):
+        """Return the nodes within radius_km of lat, lng.
+
+        RETURNS:
+            -> list: (distance in km, Node) tuples, nearest first.
+        """
+        return [(distance, self.node(node_id)) for distance, node_id in self.spatial_index.within(lat, lng, radius_km)]
+
+    def nearest(self, lat:float, lng:float, k:int=1):
+        """Return the k nodes nearest to lat, lng.
+
+        RETURNS:
+            -> list: at most k (distance in km, Node) tuples, nearest first.
+        """
+        return [(distance, self.node(node_id)) for distance, node_id in self.spatial_index.nearest(lat, lng, k)]
+
+    def set_edges(self, sources, targets, rssi=None):
+        """Replace the edges of the graph.
+
+        REQUIRES:
+            -> sources, targets: equal length sequences of node ids.
+            -> rssi: an optional sequence of edge rssi values.
+        RETURNS:
+            -> int: the number of edges dropped because a node is not in the graph.
+        """
+        if rssi is None:
+            rssi = [np.nan] * len(sources)
+        edges = [
+            (self.node_indexes[source], self.node_indexes[target], value)
+            for source, target, value in zip(sources, targets, rssi)
+            if source in self.node_indexes and target in self.node_indexes
+        ]
+        source_indexes, target_indexes, values = (list(column) for column in zip(*edges)) if edges else ([], [], [])
+        self.edges = Adjacency(
+            len(self.node_ids),
+            np.array(source_indexes, dtype=np.int64),
+            np.array(target_indexes, dtype=np.int64),
+            np.array(values, dtype=np.float64)
+        )
+        return len(sources) - len(edges)
+
+    def load_edges(self, edge_file):
+        """Load the edges of a csv file with source and target node id columns and an optional rssi column.
+
+        RETURNS:
+            -> int: the number of edges dropped, see set_edges.
+        """
+        with open(edge_file, 'r', newline='') as f:
+            reader = csv.reader(f)
+            header = [column.strip() for column in next(reader, [])]
+            rows = [row for row in reader if row]
+        if not rows:
+            return self.set_edges([], [])
+        for column in ('source', 'target'):
+            if column not in header:
+                raise Exception(f"Edge file {edge_file} is missing the {column} column.")
+        columns = list(zip(*rows))
+        rssi = None
+        if 'rssi' in header:
+            rssi = [_to_float(value) for value in columns[header.index('rssi')]]
+        return self.set_edges(columns[header.index('source')], columns[header.index('target')], rssi)
+
+    def witnesses(self, node_id):
+        """Return the (Node, rssi) of every edge of node_id to a node still in the graph."""
+        targets, rssi = self.edges.edges(self.node_indexes[node_id])
+        witnesses = []
+        for target, value in zip(targets.tolist(), rssi.tolist()):
+            target_id = self.node_ids[target]
+            if target_id is not None:
+                witnesses.append((self.node(target_id), value))
+        return witnesses
 
 def read_graph_from_csv(node_file, edge_file,unused=False):
     graph = Graph()
-    attributes = {}
-    with open(node_file, 'r') as f:
-        header = next(f) 
-        header = header.split(',')
-        for att in header:
-            attributes[att.strip('\n')] = None
-        
-        
-        for line in f:
-            atts = []
-            line = line.split(',')
-            for elt in line:
-                atts.append(elt.strip('\n'))
-
-            for i, elt in enumerate(attributes):
-                attributes[elt] = atts[i]
-
-            graph.add_node(line[0], **attributes)
-
+    for columns in read_node_chunks(node_file):
+        graph.add_node_columns(columns)
+    if os.path.exists(edge_file):
+        graph.load_edges(edge_file)
     return graph
@@ -0,0 +1,134 @@
+"""Generate a reward scale heatmap for a region.
+
+Every h3 cell of a bounding box is scored as the location of a new hotspot
+(see whatif.py). Cells are grouped by their RES_MIN ancestor and the groups
+are evaluated in a process pool. The precomputed HexDict is passed to every
+worker once, by the pool initializer, and is never rebuilt. With the fork
+start method (the default on Linux) the workers inherit it; with spawn
+(the default on macOS and Windows) it is pickled and sent to each worker.
+"""
+
+import concurrent.futures
+import os
+
+import click
+import h3
+import numpy as np
+
+from chain_vars import *
+from reward_graph import RewardGraph
+from whatif import score_candidate
+
+# Maximum number of cells evaluated by a single task.
+CHUNK_SIZE = 512
+
+# HexDict shared by the cells scored in a worker process.
+_worker_hex_dict = None
+
+def bbox_cells(nelat:float, nelng:float, swlat:float, swlng:float, res:int):
+    """Return all h3 cells at res whose center lies in the bounding box."""
+    box = [(swlat, swlng), (nelat, swlng), (nelat, nelng), (swlat, nelng)]
+    return sorted(h3.polyfill({'type': 'Polygon', 'coordinates': [box]}, res))
+
+def partition_cells(cells, chunk_size=CHUNK_SIZE):
+    """Split cells into tasks that share a RES_MIN ancestor.
+
+    RETURNS:
+        -> A list of lists of cells. No list is longer than chunk_size.
+    """
+    groups = {}
+    for cell in cells:
+        groups.setdefault(h3.h3_to_parent(cell, RES_MIN), []).append(cell)
+    tasks = []
+    for ancestor in sorted(groups):
+        group = groups[ancestor]
+        for start in range(0, len(group), chunk_size):
+            tasks.append(group[start:start + chunk_size])
+    return tasks
+
+def score_cells(hex_dict, cells):
+    """Score a new hotspot placed at the center of every cell.
+
+    RETURNS:
+        -> list: the reward scale of every cell.
+    """
+    scales = []
+    for cell in cells:
+        lat, lng = h3.h3_to_geo(cell)
+        scales.append(score_candidate(hex_dict, lat, lng)[0])
+    return scales
+
+def _init_worker(hex_dict):
+    """Process pool initializer, stores the shared HexDict."""
+    global _worker_hex_dict
+    _worker_hex_dict = hex_dict
+
+def _score_task(cells):
+    """Process pool task, scores cells against the shared HexDict."""
+    return score_cells(_worker_hex_dict, cells)
+
+def generate_heatmap(reward_graph, nelat:float, nelng:float, swlat:float, swlng:float, res:int, workers=None):
+    """Compute the reward scale of a new hotspot in every cell of a box.
+
+    REQUIRES:
+        -> reward_graph: a RewardGraph with all hotspots of the region loaded.
+        -> res: the resolution of the heatmap cells, at most RES_MAX.
+        -> workers: number of worker processes. Defaults to the cpu count,
+            1 evaluates all cells in the current process.
+    RETURNS:
+        -> (cells, scales): a uint64 array of cells sorted by index and the
+            float64 array of their reward scales.
+    """
+    if res > RES_MAX:
+        raise Exception(f"Heatmap resolution must be at most {RES_MAX}.")
+    if not reward_graph.hex_dict.generated:
+        reward_graph._generate_reward_scales()
+    hex_dict = reward_graph.hex_dict
+
+    tasks = partition_cells(bbox_cells(nelat, nelng, swlat, swlng, res))
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1:
+        results = [score_cells(hex_dict, task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(hex_dict,)
+        ) as executor:
+            results = list(executor.map(_score_task, tasks))
+
+    cells = np.array([int(cell, 16) for task in tasks for cell in task], dtype=np.uint64)
+    scales = np.array([scale for result in results for scale in result], dtype=np.float64)
+    order = np.argsort(cells)
+    return cells[order], scales[order]
+
+def write_heatmap(path, cells, scales):
+    """Write a heatmap to a compressed .npz file with 'cells' and 'scales' arrays."""
+    np.savez_compressed(path, cells=cells, scales=scales)
+
+def read_heatmap(path):
+    """Read a heatmap written by write_heatmap. Returns (cells, scales)."""
+    with np.load(path) as data:
+        return data['cells'], data['scales']
+
+@click.command()
+@click.argument('graph_file')
+@click.argument('nelat')
+@click.argument('nelon')
+@click.argument('swlat')
+@click.argument('swlon')
+@click.option('--res', default=8, help='Resolution of the heatmap cells.')
+@click.option('--workers', default=None, type=int, help='Number of worker processes.')
+@click.option('--output', default=None, help='Output file, defaults to (graph_file)_heatmap.npz.')
+def main(graph_file, nelat, nelon, swlat, swlon, res, workers, output):
+    """For negative coords, prepend a 'n' on the number. Ex(n83 = -83)"""
+    nelat, nelon, swlat, swlon = (float(c.replace('n', '-')) for c in (nelat, nelon, swlat, swlon))
+    reward_graph = RewardGraph()
+    reward_graph.import_graph_from_csv(graph_file)
+    cells, scales = generate_heatmap(reward_graph, nelat, nelon, swlat, swlon, res, workers)
+    if output is None:
+        output = f'{graph_file}_heatmap.npz'
+    write_heatmap(output, cells, scales)
+    print(f'Wrote {len(cells)} cells to {output}')
+
+if __name__ == "__main__":
+    main()
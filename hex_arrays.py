@@ -0,0 +1,144 @@
+"""Vectorized helpers for h3 indexes packed as uint64 integers.
+
+An h3 index stores its resolution in bits 52-55 and one 3 bit digit per
+resolution below that. Unused digits are set to 7, so the parent of a cell
+can be computed with a couple of bit operations instead of a call into h3.
+"""
+
+import warnings
+
+import h3
+import numpy as np
+
+from chain_vars import *
+
+H3_MAX_RES = 15
+H3_RES_OFFSET = 52
+H3_DIGIT_BITS = 3
+H3_RES_MASK = np.uint64(0xF << H3_RES_OFFSET)
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        from h3.unstable import vect as _h3_vect
+except ImportError:
+    _h3_vect = None
+
+def geo_to_cells(lats, lngs, res=RES_MAX):
+    """Index arrays of coordinates into h3 cells.
+
+    RETURNS:
+        -> np.ndarray[uint64]: the cell of every (lat, lng) pair at res.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    if _h3_vect is not None:
+        return _h3_vect.geo_to_h3(lats, lngs, res)
+    return np.fromiter(
+        (int(h3.geo_to_h3(lat, lng, res), 16) for lat, lng in zip(lats.tolist(), lngs.tolist())),
+        dtype=np.uint64,
+        count=len(lats)
+    )
+
+def strings_to_cells(hex_ids):
+    """Convert an iterable of h3 strings to a uint64 array."""
+    return np.fromiter((int(hex_id, 16) for hex_id in hex_ids), dtype=np.uint64)
+
+def cells_to_strings(cells):
+    """Convert a uint64 array of cells to a list of h3 strings."""
+    return [format(cell, 'x') for cell in cells.tolist()]
+
+def cells_to_parents(cells, res):
+    """Return the parents at res of a uint64 array of cells.
+
+    REQUIRES:
+        -> Every cell has a resolution >= res.
+    """
+    unused_digits = np.uint64((1 << ((H3_MAX_RES - res) * H3_DIGIT_BITS)) - 1)
+    cells = np.asarray(cells, dtype=np.uint64)
+    return (cells & ~H3_RES_MASK) | np.uint64(res << H3_RES_OFFSET) | unused_digits
+
+def cells_to_descendant_bounds(cells, res, child_res=RES_MAX):
+    """Return the bounds of the descendants at child_res of cells at res.
+
+    Sorting cells of one resolution by index keeps all descendants of a
+    parent next to each other. Every descendant lies in [low, high].
+
+    RETURNS:
+        -> (low, high): two uint64 arrays.
+    """
+    child_digits = np.uint64(((1 << ((child_res - res) * H3_DIGIT_BITS)) - 1) << ((H3_MAX_RES - child_res) * H3_DIGIT_BITS))
+    high = (np.asarray(cells, dtype=np.uint64) & ~H3_RES_MASK) | np.uint64(child_res << H3_RES_OFFSET)
+    return high & ~child_digits, high
+
+class PackedLevels:
+    """Sorted per-resolution arrays of the densities in a HexDict.
+
+    levels[res] holds (hex_ids, clipped, unclipped) for every res between
+    RES_MIN - 1 and RES_MAX, with hex_ids sorted so lookups can be done with
+    np.searchsorted.
+    """
+
+    def __init__(self, levels):
+        """Constructor.
+
+        REQUIRES:
+            -> levels: a dict of res -> (hex_ids, clipped, unclipped) arrays
+                sorted by hex_id, for every res in [RES_MIN - 1, RES_MAX].
+        """
+        self.levels = levels
+
+    @classmethod
+    def from_hex_dict(cls, hex_dict):
+        """Pack the densities of a fully generated HexDict."""
+        levels = {}
+        for res in range(RES_MIN - 1, RES_MAX + 1):
+            hexes = hex_dict.hex_dict[res]
+            hex_ids = strings_to_cells(hexes.keys())
+            clipped = np.fromiter((hex.clipped_density for hex in hexes.values()), dtype=np.int64, count=len(hexes))
+            unclipped = np.fromiter((hex.unclipped_density for hex in hexes.values()), dtype=np.int64, count=len(hexes))
+            order = np.argsort(hex_ids)
+            levels[res] = (hex_ids[order], clipped[order], unclipped[order])
+        return cls(levels)
+
+    def lookup(self, cells, res):
+        """Find the position of cells in the level res.
+
+        RETURNS:
+            -> (positions, found): found is False where a cell is not in the
+                level, positions are only meaningful where found is True.
+        """
+        hex_ids = self.levels[res][0]
+        positions = np.searchsorted(hex_ids, cells)
+        positions[positions == len(hex_ids)] = 0
+        found = hex_ids[positions] == cells if len(hex_ids) else np.zeros(len(cells), dtype=bool)
+        return positions, found
+
+    def reward_scales(self, cells, missing=None):
+        """Compute the reward scale of every RES_MAX cell in cells.
+
+        The per-level ratios are multiplied in the same order as
+        HexDict.compute_reward_scale, so results are bit-identical.
+
+        REQUIRES:
+            -> Every cell is a RES_MAX hex in the packed HexDict, unless
+                missing is given.
+            -> missing: if given, the reward scale of cells that are not in
+                the packed HexDict, e.g. nan.
+        RETURNS:
+            -> np.ndarray[float64]: the reward scale of every cell.
+        """
+        cells = np.asarray(cells, dtype=np.uint64)
+        _, found = self.lookup(cells, RES_MAX)
+        if not found.all():
+            if missing is None:
+                raise Exception("Cannot compute reward scale. Invalid starting hex.")
+            reward_scales = np.full(len(cells), missing, dtype=np.float64)
+            reward_scales[found] = self.reward_scales(cells[found])
+            return reward_scales
+        reward_scales = np.ones(len(cells), dtype=np.float64)
+        for res in range(RES_MAX - 1, RES_MIN - 2, -1):
+            _, clipped, unclipped = self.levels[res]
+            positions = np.searchsorted(self.levels[res][0], cells_to_parents(cells, res))
+            reward_scales *= clipped[positions] / unclipped[positions]
+        return reward_scales
@@ -0,0 +1,222 @@
+"""Leave-one-out impact analysis: how much every hotspot holds back its neighbors.
+
+Removing a hotspot is scored like a what-if candidate: its raw density is
+decremented in a HexOverlay of the generated HexDict, which only revisits
+the ancestor chain of its hex and the neighbor rings of ancestors whose
+occupied state flips. The full hierarchy is built once, never per hotspot.
+
+The hotspots whose reward scale can change are the ones below a hex whose
+clipped / unclipped ratio changed, and they are rescored with numpy from
+the packed ratios. All hotspots of a RES_MAX hex have the same effect on
+the rest of the graph when removed, so each occupied hex is scored once.
+Hexes can be split across a process pool, each worker building its own
+HexDict once.
+"""
+
+import concurrent.futures
+import csv
+import os
+import sys
+
+import click
+import numpy as np
+
+from chain_params import DEFAULT_PARAMS
+from chain_vars import *
+from hex_arrays import cells_to_descendant_bounds
+from hex_arrays import cells_to_parents
+from hex_arrays import geo_to_cells
+from hex_arrays import strings_to_cells
+from reward_graph import HexDict
+from reward_graph import RewardGraph
+from whatif import HexOverlay
+
+# Hexes scored per process pool task.
+TASK_SIZE = 256
+
+TABLE_COLUMNS = ('rank', 'address', 'name', 'lat', 'lng', 'reward_scale', 'affected', 'total_gain', 'max_gain')
+
+class RemovalScorer:
+    """Scores hotspot removals against a generated HexDict.
+
+    The reward scale of every occupied RES_MAX hex and the clipped /
+    unclipped ratio of all of its ancestors are packed once. A removal then
+    only replaces the ratios of the hexes the overlay changed, and rescores
+    the hexes below them with numpy, in the order of
+    PackedLevels.reward_scales so results are bit-identical.
+    """
+
+    def __init__(self, hex_dict):
+        """Constructor.
+
+        REQUIRES:
+            -> hex_dict: a HexDict whose densities have been generated.
+        """
+        packed = hex_dict.packed()
+        self.hex_dict = hex_dict
+        self.levels = packed.levels
+        # The occupied RES_MAX hexes, sorted, with their number of hotspots.
+        self.cells = self.levels[RES_MAX][0]
+        self.hotspot_counts = self.levels[RES_MAX][2]
+        self.reward_scales = packed.reward_scales(self.cells)
+        # res -> position in the level of the ancestor of every cell, and the ratios of the level.
+        self.ancestors = {}
+        self.ratios = {}
+        for res in range(RES_MAX - 1, RES_MIN - 2, -1):
+            hex_ids, clipped, unclipped = self.levels[res]
+            self.ancestors[res] = np.searchsorted(hex_ids, cells_to_parents(self.cells, res))
+            self.ratios[res] = clipped / unclipped
+
+    def impact(self, position):
+        """Compute the reward scale changes caused by removing one hotspot of a hex.
+
+        REQUIRES:
+            -> position: the position of the hex in self.cells.
+        RETURNS:
+            -> (positions, current, new): the positions in self.cells of every
+                hex whose remaining hotspots would change, with their current
+                and new reward scales.
+        """
+        overlay = HexOverlay(self.hex_dict)
+        changed = overlay.update_raw_densities({format(int(self.cells[position]), 'x'): -1})
+
+        # res -> (sorted positions in the level, new ratios) of the changed hexes.
+        # Emptied hexes are only above the removed hex, which is then skipped.
+        changed_ratios = {}
+        affected = [np.zeros(0, dtype=np.int64)]
+        for res in range(RES_MAX - 1, RES_MIN - 2, -1):
+            hexes = [hex for hex in changed if hex.res == res and hex.unclipped_density]
+            if not hexes:
+                continue
+            hex_ids = strings_to_cells(hex.hex_id for hex in hexes)
+            level_positions = np.searchsorted(self.levels[res][0], hex_ids)
+            order = np.argsort(level_positions)
+            ratios = np.array([hex.clipped_density / hex.unclipped_density for hex in hexes])
+            changed_ratios[res] = (level_positions[order], ratios[order])
+            low, high = cells_to_descendant_bounds(hex_ids, res, RES_MAX)
+            starts = np.searchsorted(self.cells, low, side='left')
+            ends = np.searchsorted(self.cells, high, side='right')
+            affected += [np.arange(start, end) for start, end in zip(starts.tolist(), ends.tolist())]
+        positions = np.unique(np.concatenate(affected))
+        if self.hotspot_counts[position] == 1:
+            positions = positions[positions != position]
+
+        new = np.ones(len(positions), dtype=np.float64)
+        for res in range(RES_MAX - 1, RES_MIN - 2, -1):
+            ancestors = self.ancestors[res][positions]
+            ratios = self.ratios[res][ancestors]
+            if res in changed_ratios:
+                level_positions, level_ratios = changed_ratios[res]
+                indexes = np.minimum(np.searchsorted(level_positions, ancestors), len(level_positions) - 1)
+                ratios = np.where(level_positions[indexes] == ancestors, level_ratios[indexes], ratios)
+            new *= ratios
+        current = self.reward_scales[positions]
+        keep = new != current
+        return positions[keep], current[keep], new[keep]
+
+# RemovalScorer of a process pool worker, set by _init_worker.
+_worker_scorer = None
+
+def _build_scorer(cells, params):
+    hex_dict = HexDict(params=params)
+    hex_dict.add_cells(cells, list(range(len(cells))))
+    hex_dict.generate_densities()
+    return RemovalScorer(hex_dict)
+
+def _init_worker(cells, params):
+    """Build the RemovalScorer of a process pool worker."""
+    global _worker_scorer
+    _worker_scorer = _build_scorer(cells, params)
+
+def _impact_task(positions):
+    """Process pool task, see RemovalScorer.impact."""
+    return [_worker_scorer.impact(position) for position in positions]
+
+def removal_impacts(cells, workers=1, params=DEFAULT_PARAMS, hex_dict=None):
+    """Score the removal of one hotspot of every occupied RES_MAX hex.
+
+    REQUIRES:
+        -> cells: a uint64 array with the RES_MAX cell of every hotspot.
+        -> workers: number of worker processes, 1 scores every hex in the
+            current process. None uses the cpu count.
+        -> hex_dict: an optional generated HexDict of cells, used instead
+            of building one when workers is 1.
+    RETURNS:
+        -> (hex_cells, impacts): the sorted occupied RES_MAX cells, and the
+            RemovalScorer.impact of each, whose positions index hex_cells.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    hex_cells = np.unique(cells)
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1 or len(hex_cells) <= TASK_SIZE:
+        scorer = _build_scorer(cells, params) if hex_dict is None else RemovalScorer(hex_dict)
+        impacts = [scorer.impact(position) for position in range(len(hex_cells))]
+    else:
+        tasks = [range(start, min(start + TASK_SIZE, len(hex_cells))) for start in range(0, len(hex_cells), TASK_SIZE)]
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(cells, params)
+        ) as executor:
+            impacts = [impact for results in executor.map(_impact_task, tasks) for impact in results]
+    return hex_cells, impacts
+
+def impact_table(reward_graph, workers=1):
+    """Rank the hotspots of a graph by how much their neighbors would gain without them.
+
+    RETURNS:
+        -> list: a dict of TABLE_COLUMNS per hotspot, ranked by total_gain,
+            the sum of the reward scale changes of the other hotspots.
+            affected counts the hotspots whose reward scale would change
+            and max_gain is the largest rise, 0 if none. Removals can also
+            lower reward scales, so gains can be negative.
+    """
+    nodes = reward_graph.nodes()
+    lats = np.array([node['lat'] for node in nodes], dtype=np.float64)
+    lngs = np.array([node['lng'] for node in nodes], dtype=np.float64)
+    cells = geo_to_cells(lats, lngs, RES_MAX)
+    hex_dict = reward_graph.hex_dict if isinstance(reward_graph.hex_dict, HexDict) else None
+    reward_scales = reward_graph.reward_scales(lats, lngs)
+    _, impacts = removal_impacts(cells, workers, reward_graph.params, hex_dict)
+    hex_positions, hotspot_counts = np.unique(cells, return_inverse=True, return_counts=True)[1:]
+
+    summaries = []
+    for position, (positions, current, new) in enumerate(impacts):
+        # The removed hotspot itself is not affected.
+        counts = hotspot_counts[positions] - (positions == position)
+        gains = new - current
+        summaries.append((int(counts.sum()), float((counts * gains).sum()), float(gains.max(initial=0.0))))
+
+    rows = []
+    for node, hex_position, reward_scale in zip(nodes, hex_positions.tolist(), reward_scales.tolist()):
+        affected, total_gain, max_gain = summaries[hex_position]
+        rows.append({
+            'address': node.node_identifier, 'name': node.attributes.get('name'),
+            'lat': node['lat'], 'lng': node['lng'], 'reward_scale': reward_scale,
+            'affected': affected, 'total_gain': total_gain, 'max_gain': max_gain,
+        })
+    rows.sort(key=lambda row: (-row['total_gain'], row['address']))
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+    return rows
+
+@click.command()
+@click.argument('graph_file')
+@click.option('--workers', default=1, help='Number of worker processes, 0 uses the cpu count.')
+@click.option('--top', default=None, type=int, help='Only output the top ranked hotspots.')
+@click.option('--output', default=None, help='Write the table to this csv file instead of stdout.')
+def main(graph_file, workers, top, output):
+    """Rank the hotspots of graph_data/(graph_file)_nodes.csv by the reward scale their neighbors would gain without them."""
+    reward_graph = RewardGraph()
+    reward_graph.import_graph_from_csv(graph_file)
+    rows = impact_table(reward_graph, workers or None)[:top]
+    f = sys.stdout if output is None else open(output, 'w', newline='')
+    try:
+        writer = csv.DictWriter(f, TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if output is not None:
+            f.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""On demand HIP17 densities for interactive lookups.
+
+LazyHexDict computes nothing when hotspots are loaded. A reward scale query
+evaluates only the densities its answer depends on: the ancestors of the
+queried hex, the neighbors of those ancestors, and the children summed into
+each of them. Every computed density is memoized per resolution and reused
+by later queries.
+
+Two bounds keep the evaluation local. The unclipped density of a hex never
+exceeds the number of hotspots below it, which is found with a binary
+search over the sorted RES_MAX cells. So:
+    -> a hex with fewer hotspots than density_tgt is not occupied, and its
+        density is never computed just to count occupied neighbors.
+    -> a hex with at most min(density_tgt, density_max) hotspots is never
+        clipped, so its ratio is exactly 1 and the level is skipped.
+At the coarse resolutions, whose targets are far above the number of
+hotspots in a region, this cuts the hierarchy off entirely.
+
+Reward scales are bit-identical to the ones of the other backends.
+"""
+
+import numpy as np
+
+from chain_params import DEFAULT_PARAMS
+from chain_vars import *
+from hex_arrays import cells_to_descendant_bounds
+from hex_arrays import cells_to_parents
+from hex_arrays import geo_to_cells
+from topology import TopologyCache
+
+class LazyHexDict:
+    """A read only hex dict evaluating densities on demand."""
+
+    # Densities never need to be generated ahead of a query.
+    generated = True
+
+    def __init__(self, topology=None, params=DEFAULT_PARAMS):
+        """Constructor for a lazy hex map.
+
+        REQUIRES:
+            -> topology: an optional, possibly shared, TopologyCache.
+            -> params: the chain_params.ChainParams used to clip densities.
+        """
+        self.topology = TopologyCache() if topology is None else topology
+        self.params = params
+
+        # Hotspots added since the last query, as array chunks.
+        self._pending_cells = []
+        self._pending_names = []
+
+        # RES_MAX cell and name of every hotspot, sorted by cell.
+        self.hotspot_cells = np.zeros(0, dtype=np.uint64)
+        self.hotspot_names = []
+
+        # res -> {cell: density} of every density computed so far.
+        self.unclipped_density = [ {} for _ in range(RES_MAX + 1) ]
+        self.clipped_density = [ {} for _ in range(RES_MAX + 1) ]
+
+    def __len__(self):
+        """Return the number of hotspots."""
+        return len(self.hotspot_cells) + sum(len(cells) for cells in self._pending_cells)
+
+    def add_hex(self, lat:float, lng:float, name=None):
+        """Insert a hotspot into the hex dict."""
+        self.add_hexes([lat], [lng], [name])
+
+    def add_hexes(self, lats, lngs, names):
+        """Insert many hotspots into the hex dict at once."""
+        self._pending_cells.append(geo_to_cells(lats, lngs, RES_MAX))
+        self._pending_names.extend(names)
+
+    def generate_densities(self):
+        """Index the hotspots added so far. Densities are computed on demand.
+
+        EFFECTS:
+            -> Drops the memoized densities if hotspots were added.
+        """
+        if not self._pending_cells:
+            return
+        cells = np.concatenate([self.hotspot_cells] + self._pending_cells)
+        names = list(self.hotspot_names) + self._pending_names
+        order = np.argsort(cells, kind='stable')
+        self.hotspot_cells = cells[order]
+        self.hotspot_names = [names[i] for i in order.tolist()]
+        self._pending_cells = []
+        self._pending_names = []
+        self.unclipped_density = [ {} for _ in range(RES_MAX + 1) ]
+        self.clipped_density = [ {} for _ in range(RES_MAX + 1) ]
+
+    def add_hotspot(self, lat:float, lng:float, name=None):
+        raise Exception("Incremental updates are not supported by the lazy storage backend.")
+
+    def move_hotspot(self, old_lat:float, old_lng:float, lat:float, lng:float, name=None):
+        raise Exception("Incremental updates are not supported by the lazy storage backend.")
+
+    def remove_hotspot(self, lat:float, lng:float, name=None):
+        raise Exception("Incremental updates are not supported by the lazy storage backend.")
+
+    def _descendants(self, cell, res):
+        """Return the (start, end) positions of the hotspots below the hex cell at res."""
+        low, high = cells_to_descendant_bounds(np.array([cell], dtype=np.uint64), res, RES_MAX)
+        start = int(np.searchsorted(self.hotspot_cells, low[0], side='left'))
+        end = int(np.searchsorted(self.hotspot_cells, high[0], side='right'))
+        return start, end
+
+    def _hotspot_count(self, cell, res):
+        """Return the number of hotspots below cell, an upper bound of its unclipped density."""
+        start, end = self._descendants(cell, res)
+        return end - start
+
+    def unclipped(self, cell, res):
+        """Return the unclipped density of the hex cell at res."""
+        densities = self.unclipped_density[res]
+        density = densities.get(cell)
+        if density is None:
+            start, end = self._descendants(cell, res)
+            if res == RES_MAX or start == end:
+                density = end - start
+            else:
+                children = np.unique(cells_to_parents(self.hotspot_cells[start:end], res + 1))
+                density = sum(self.clipped(child, res + 1) for child in children.tolist())
+            densities[cell] = density
+        return density
+
+    def clipped(self, cell, res):
+        """Return the clipped density of the hex cell at res."""
+        densities = self.clipped_density[res]
+        density = densities.get(cell)
+        if density is None:
+            N, density_tgt, density_max = self.params.res_meta[res]
+            density = self.unclipped(cell, res)
+            if density > min(density_tgt, density_max):
+                occupied_count = sum(
+                    self._occupied(neighbor, res) for neighbor in self.topology.cell_neighbors(cell).tolist()
+                )
+                density = min(density, min(density_tgt * max(occupied_count - N + 1, 1), density_max))
+            densities[cell] = density
+        return density
+
+    def _occupied(self, cell, res):
+        """Determine if the hex cell at res is occupied, without its density when possible."""
+        density_tgt = self.params.res_meta[res][1]
+        density = self.unclipped_density[res].get(cell)
+        if density is None:
+            if self._hotspot_count(cell, res) < density_tgt:
+                return False
+            density = self.unclipped(cell, res)
+        return density >= density_tgt
+
+    def _reward_scale(self, cell):
+        """Compute the reward scale of the RES_MAX cell, None if it holds no hotspot."""
+        if self._hotspot_count(cell, RES_MAX) == 0:
+            return None
+        reward_scale = 1.0
+        for res in range(RES_MAX - 1, RES_MIN - 2, -1):
+            parent = int(cells_to_parents(np.array([cell], dtype=np.uint64), res)[0])
+            N, density_tgt, density_max = self.params.res_meta[res]
+            # Hexes with fewer hotspots than any limit are never clipped, their ratio is 1.
+            if self._hotspot_count(parent, res) > min(density_tgt, density_max):
+                reward_scale *= self.clipped(parent, res) / self.unclipped(parent, res)
+        return reward_scale
+
+    def reward_scales(self, cells, missing=None):
+        """Compute the reward scale of every RES_MAX cell in cells.
+
+        REQUIRES:
+            -> Every cell holds a hotspot, unless missing is given.
+            -> missing: if given, the reward scale of cells without hotspots.
+        RETURNS:
+            -> np.ndarray[float64]: the reward scale of every cell.
+        """
+        self.generate_densities()
+        reward_scales = np.empty(len(cells), dtype=np.float64)
+        for i, cell in enumerate(np.asarray(cells, dtype=np.uint64).tolist()):
+            reward_scale = self._reward_scale(cell)
+            if reward_scale is None:
+                if missing is None:
+                    raise Exception("Cannot compute reward scale. Invalid starting hex.")
+                reward_scale = missing
+            reward_scales[i] = reward_scale
+        return reward_scales
+
+    def compute_reward_scale(self, lat:float, lng:float):
+        """Generate the reward scale for a given location."""
+        return float(self.reward_scales(geo_to_cells([lat], [lng], RES_MAX))[0])
+
+    def hex_reward_scale(self, hex_id):
+        """Generate the reward scale for a given RES_MAX hex."""
+        return float(self.reward_scales(np.array([int(hex_id, 16)], dtype=np.uint64))[0])
+
+    def packed(self):
+        """Return the hex dict itself, it answers the PackedLevels.reward_scales queries."""
+        return self
@@ -0,0 +1,103 @@
+"""Streaming loader for hotspot node files.
+
+Node files are parsed in chunks straight into typed columns, so loading a
+large snapshot does not create one attribute dict per row. Quoted fields
+and windows line endings are handled by the csv module.
+"""
+
+import csv
+import itertools
+
+import numpy as np
+
+NODE_COLUMNS = ('address', 'name', 'lat', 'lng', 'reward_scale_correct')
+
+# Number of rows parsed per chunk.
+CHUNK_SIZE = 65536
+
+class NodeColumns:
+    """A chunk of nodes stored as typed columns."""
+
+    def __init__(self, address, name, lat, lng, reward_scale_correct):
+        """Constructor.
+
+        REQUIRES:
+            -> address, name: arrays of strings.
+            -> lat, lng: float64 arrays.
+            -> reward_scale_correct: float64 array, nan where unknown.
+        """
+        self.address = address
+        self.name = name
+        self.lat = lat
+        self.lng = lng
+        self.reward_scale_correct = reward_scale_correct
+        # Attributes computed later, e.g. reward_scale: name -> array.
+        self.extra = {}
+
+    def __len__(self):
+        return len(self.address)
+
+    def row(self, index):
+        """Return the attributes of the node at index, extra columns included, as a dict of python values."""
+        attributes = {column: getattr(self, column)[index].item() for column in NODE_COLUMNS}
+        for name, values in self.extra.items():
+            attributes[name] = values[index].item()
+        return attributes
+
+def _to_float(value):
+    """Convert a string to a float, nan if it is not a number (e.g. None)."""
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+def _parse_floats(values, allow_missing=False):
+    """Convert a column of strings to a float64 array.
+
+    REQUIRES:
+        -> allow_missing: if True, values that are not numbers become nan,
+            otherwise they raise an Exception.
+    """
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        if not allow_missing:
+            raise Exception("Node file contains an invalid coordinate.")
+        # Missing values repeat a lot (e.g. None), so parse each distinct value once.
+        distinct, inverse = np.unique(np.array(values, dtype=str), return_inverse=True)
+        return np.array([_to_float(value) for value in distinct.tolist()], dtype=np.float64)[inverse]
+
+def read_node_chunks(node_file, chunk_size=CHUNK_SIZE):
+    """Read a node file in chunks of typed columns.
+
+    REQUIRES:
+        -> node_file: a csv file with a header containing NODE_COLUMNS.
+    RETURNS:
+        -> A generator of NodeColumns, each holding at most chunk_size nodes.
+    """
+    with open(node_file, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader)]
+        for column in NODE_COLUMNS:
+            if column not in header:
+                raise Exception(f"Node file {node_file} is missing the {column} column.")
+        indexes = [header.index(column) for column in NODE_COLUMNS]
+
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if not rows:
+                break
+            rows = [row for row in rows if row]
+            if not rows:
+                continue
+            if min(map(len, rows)) < len(header):
+                raise Exception(f"Node file {node_file} has a row with missing columns.")
+            columns = list(zip(*rows))
+            address, name, lat, lng, reward_scale_correct = (columns[i] for i in indexes)
+            yield NodeColumns(
+                np.array(address, dtype=str),
+                np.array(name, dtype=str),
+                _parse_floats(lat),
+                _parse_floats(lng),
+                _parse_floats(reward_scale_correct, allow_missing=True)
+            )
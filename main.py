@@ -1,16 +1,362 @@
-"""Main file for the program."""
+"""Main file for the program.
+
+Every tool of the project is a subcommand of this CLI. Modules are only
+imported by the subcommand that needs them, so starting up only costs the
+import of click: compute, query and batch are defined here and import
+reward_graph when they run, the other subcommands live in their own module
+and are imported on first use (see LAZY_COMMANDS).
+
+Arguments that are not a subcommand run compute, so 'main.py (graph_file)'
+keeps working. Results are written through a large buffer as csv or json
+lines, never one print per node.
+"""
+
+import contextlib
+import csv
+import glob
+import importlib
+import json
+import math
+import os
+import sys
 
 import click
 
-from reward_graph import RewardGraph
+# Subcommands defined in other modules: name -> (directory, module, attribute, help).
+# The directory is added to sys.path, the downloader modules import each other by name.
+LAZY_COMMANDS = {
+    'download': ('downloader', 'scaling', 'main_func', 'Download the nodes of a box of coordinates.'),
+    'heatmap': ('', 'heatmap', 'main', 'Reward scale of a new hotspot in every cell of a box.'),
+    'earnings': ('', 'earnings', 'main', 'Fit and apply HNT earnings models.'),
+    'impact': ('', 'impact', 'main', 'Rank hotspots by how much they hold back their neighbors.'),
+    'sweep': ('', 'sweep', 'main', 'Evaluate chain parameter sets against a dataset.'),
+    'replay': ('', 'replay', 'main', 'Replay hotspot events into a reward scale series.'),
+    'serve': ('', 'service', 'main', 'Serve reward scale queries over http.'),
+    'convert': ('', 'columnar', 'main', 'Convert a csv node file to a Parquet file.'),
+    'benchmark': ('', 'benchmark', 'cli', 'Benchmark speed and accuracy.'),
+}
 
-@click.command()
-@click.argument('graph_file')
-def main(graph_file):
-    reward_graph = RewardGraph()
-    reward_graph.import_graph_from_csv(graph_file)
+# Default directory of the (graph_file)_nodes.csv files.
+DATA_DIR = 'graph_data'
+NODES_SUFFIX = '_nodes.csv'
+
+# Extensions of the files read with RewardGraph.import_graph_from_table:
+# Parquet and columnar.IPC_EXTENSIONS, repeated here so loading a csv
+# dataset never imports pyarrow.
+TABLE_EXTENSIONS = ('.parquet', '.arrow', '.feather', '.ipc')
+
+# Size in bytes of the output buffer.
+OUTPUT_BUFFER = 1 << 20
+
+NODE_COLUMNS = ('address', 'name', 'lat', 'lng', 'reward_scale_correct', 'reward_scale')
+QUERY_COLUMNS = ('lat', 'lng', 'reward_scale')
+
+# Line of every node in the text format.
+TEXT_LINE = "Current RW Scale: {reward_scale_correct}, Computed RW Scale: {reward_scale}, {name}\n"
+
+def _option_value(args, option):
+    """Return the value of an option in a list of command line arguments, None if absent."""
+    for i, arg in enumerate(args):
+        if arg == option and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(option + '='):
+            return arg[len(option) + 1:]
+    return None
+
+def _names_dataset(args):
+    """Return True if the compute arguments args name an existing dataset or snapshot."""
+    if _option_value(args, '--snapshot') is not None:
+        return True
+    if args[0].endswith(TABLE_EXTENSIONS):
+        return os.path.exists(args[0])
+    directory = _option_value(args, '--directory') or DATA_DIR
+    return os.path.exists(os.path.join(directory, args[0] + NODES_SUFFIX))
+
+class LazyGroup(click.Group):
+    """A click group importing the subcommands of LAZY_COMMANDS on first use.
+
+    A first argument that does not name a subcommand but names an existing
+    dataset is passed to compute, anything else is a usage error.
+    """
+
+    def list_commands(self, ctx):
+        return sorted(list(self.commands) + list(LAZY_COMMANDS))
+
+    def get_command(self, ctx, name):
+        if name not in LAZY_COMMANDS:
+            return super().get_command(ctx, name)
+        directory, module, attribute, _ = LAZY_COMMANDS[name]
+        if directory:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+            if path not in sys.path:
+                sys.path.insert(0, path)
+        return getattr(importlib.import_module(module), attribute)
+
+    def resolve_command(self, ctx, args):
+        if args and not args[0].startswith('-') and args[0] not in self.list_commands(ctx):
+            if not _names_dataset(args):
+                raise click.UsageError(
+                    f"No such command or dataset '{args[0]}'. Commands: {', '.join(self.list_commands(ctx))}.", ctx
+                )
+            args = ['compute'] + args
+        return super().resolve_command(ctx, args)
+
+    def format_commands(self, ctx, formatter):
+        """List the subcommands without importing the lazy ones."""
+        names = list(self.commands) + list(LAZY_COMMANDS)
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = [(name, command.get_short_help_str(limit)) for name, command in self.commands.items()]
+        rows += [(name, command[3]) for name, command in LAZY_COMMANDS.items()]
+        with formatter.section('Commands'):
+            formatter.write_dl(sorted(rows))
+
+@contextlib.contextmanager
+def open_output(output=None):
+    """Open output, or stdout if None, as a text file with an OUTPUT_BUFFER byte buffer."""
+    if output is None:
+        sys.stdout.flush()
+        f = open(sys.stdout.fileno(), 'w', buffering=OUTPUT_BUFFER, encoding=sys.stdout.encoding, newline='', closefd=False)
+    else:
+        f = open(output, 'w', buffering=OUTPUT_BUFFER, newline='')
+    try:
+        yield f
+    finally:
+        f.close()
+
+def _json_value(value):
+    """Convert nan to None, json has no nan."""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+def write_rows(f, rows, columns, output_format, header=True):
+    """Write an iterable of dict rows to f.
+
+    REQUIRES:
+        -> output_format: 'csv', 'json' for one json object per line, or
+            'text' for the TEXT_LINE of every row.
+        -> header: if False, the csv header is not written.
+    """
+    if output_format == 'csv':
+        writer = csv.DictWriter(f, columns, extrasaction='ignore')
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+    elif output_format == 'json':
+        f.writelines(json.dumps({column: _json_value(row[column]) for column in columns}) + '\n' for row in rows)
+    else:
+        f.writelines(TEXT_LINE.format(**row) for row in rows)
+
+def load_graph(graph_file, directory=DATA_DIR, snapshot=None, bbox=None, workers=None, storage='dict', topology=None,
+               snapshot_params=False):
+    """Load a RewardGraph from a snapshot, a Parquet or Arrow file, or (directory)/(graph_file)_nodes.csv.
+
+    REQUIRES:
+        -> bbox: an optional (swlat, swlng, nelat, nelng) tuple, only used by
+            Parquet and Arrow files.
+        -> workers: if given, the reward scales are computed in this many
+            processes, see partition.generate_partitioned.
+        -> topology: an optional TopologyCache shared with other graphs.
+        -> snapshot_params: if True, the snapshot is loaded with the chain
+            params stored in it instead of those of chain_vars.py.
+    """
+    from reward_graph import RewardGraph
+
+    if snapshot is not None:
+        return RewardGraph.load_snapshot(snapshot, params='stored' if snapshot_params else None)
+    reward_graph = RewardGraph(storage=storage, topology=topology)
+    if graph_file.endswith(TABLE_EXTENSIONS):
+        reward_graph.import_graph_from_table(graph_file, bbox)
+    else:
+        reward_graph.import_graph_from_csv(graph_file, directory)
+    if workers is not None:
+        from partition import generate_partitioned
+
+        generate_partitioned(reward_graph, workers)
+    return reward_graph
+
+def node_rows(reward_graph, **fields):
+    """Yield a dict of NODE_COLUMNS, and the given fields, for every node of a graph."""
     for node in reward_graph.nodes():
-        print(f"Current RW Scale: {node['reward_scale_correct']}, Computed RW Scale: { reward_graph.get_reward_scale(node) }, {node['name']}")
+        yield dict(
+            fields,
+            address=node.node_identifier,
+            name=node['name'],
+            lat=node['lat'],
+            lng=node['lng'],
+            reward_scale_correct=node['reward_scale_correct'],
+            reward_scale=reward_graph.get_reward_scale(node)
+        )
+
+def resolve_datasets(patterns, directory=DATA_DIR):
+    """Find the datasets named by patterns.
+
+    REQUIRES:
+        -> patterns: dataset names of directory, node csv files, or Parquet
+            and Arrow files. All of them may be glob patterns.
+    RETURNS:
+        -> list: (name, graph_file, directory) of every dataset, in the order
+            of patterns, without duplicates. directory is None for Parquet
+            and Arrow files, whose graph_file is their path.
+    """
+    datasets = []
+    for pattern in patterns:
+        if not pattern.endswith(TABLE_EXTENSIONS + (NODES_SUFFIX,)):
+            pattern = os.path.join(directory, pattern + NODES_SUFFIX)
+        paths = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not paths:
+            raise Exception(f"No dataset matches {pattern}.")
+        for path in paths:
+            if path.endswith(NODES_SUFFIX):
+                name = os.path.basename(path)[:-len(NODES_SUFFIX)]
+                dataset = (name, name, os.path.dirname(path))
+            else:
+                dataset = (path, path, None)
+            if dataset not in datasets:
+                datasets.append(dataset)
+    return datasets
+
+def _coordinate(value):
+    """Parse a coordinate where a leading 'n' stands for a minus sign."""
+    return float(value.replace('n', '-'))
+
+def _read_locations(path):
+    """Read the lat and lng columns of a csv file."""
+    with open(path, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None or 'lat' not in reader.fieldnames or 'lng' not in reader.fieldnames:
+            raise Exception(f"Location file {path} needs lat and lng columns.")
+        return [(float(row['lat']), float(row['lng'])) for row in reader]
+
+@click.group(cls=LazyGroup)
+def main():
+    """Compute HIP17 reward scales of helium hotspots."""
+
+@main.command()
+@click.argument('graph_file')
+@click.option('--directory', default=DATA_DIR, help='Directory of the (graph_file)_nodes.csv files.')
+@click.option('--snapshot', default=None, help='Load the graph from this snapshot file instead of graph_data.')
+@click.option('--snapshot-params', is_flag=True, help='Use the chain params stored in the snapshot instead of chain_vars.py.')
+@click.option('--save-snapshot', default=None, help='Save the computed graph to this snapshot file.')
+@click.option('--workers', default=None, type=int, help='Compute the reward scales in this many processes, sharded by region.')
+@click.option('--storage', type=click.Choice(['dict', 'compact']), default='dict', help='Storage backend of the hex densities, compact uses the least memory.')
+@click.option('--profile', is_flag=True, help='Print per-phase timings and call counters when done.')
+@click.option('--bbox', nargs=4, type=float, default=None, help='SWLAT SWLNG NELAT NELNG, only import the hotspots of a Parquet or Arrow graph_file inside this box.')
+@click.option('--parquet-output', default=None, help='Write (prefix)_nodes.parquet and (prefix)_densities.parquet.')
+@click.option('--format', 'output_format', type=click.Choice(['text', 'csv', 'json']), default='text', help='Output format, json writes one object per node and line.')
+@click.option('--output', default=None, help='Write the nodes to this file instead of stdout.')
+def compute(graph_file, directory, snapshot, snapshot_params, save_snapshot, workers, storage, profile, bbox, parquet_output, output_format, output):
+    """Compute the reward scale of every node of a dataset.
+
+    GRAPH_FILE names graph_data/(graph_file)_nodes.csv, or is a Parquet or
+    Arrow file.
+    """
+    import profiling
+
+    profiler = profiling.Profiler()
+    if profile:
+        profiler.enable()
+    reward_graph = load_graph(graph_file, directory, snapshot, bbox, workers, storage, snapshot_params=snapshot_params)
+    with open_output(output) as f:
+        write_rows(f, node_rows(reward_graph), NODE_COLUMNS, output_format)
+    if save_snapshot is not None:
+        reward_graph.save_snapshot(save_snapshot)
+    if parquet_output is not None:
+        reward_graph.write_parquet(f'{parquet_output}_nodes.parquet', f'{parquet_output}_densities.parquet')
+    if profile:
+        profiler.disable()
+        click.echo(profiler.format_report(reward_graph.hex_dict), err=output is None and output_format != 'text')
+
+@main.command()
+@click.argument('graph_file', required=False)
+@click.option('--point', 'points', nargs=2, multiple=True, help='LAT LNG of a location, may be repeated.')
+@click.option('--directory', default=DATA_DIR, help='Directory of the (graph_file)_nodes.csv files.')
+@click.option('--snapshot', default=None, help='Query a snapshot file instead of a dataset.')
+@click.option('--snapshot-params', is_flag=True, help='Use the chain params stored in the snapshot instead of chain_vars.py.')
+@click.option('--locations', default=None, help='Also query the locations of a csv file with lat and lng columns.')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'json']), default='csv', help='Output format, json writes one object per location and line.')
+@click.option('--output', default=None, help='Write the results to this file instead of stdout.')
+def query(graph_file, points, directory, snapshot, snapshot_params, locations, output_format, output):
+    """Look up the reward scale of locations.
+
+    Locations get a nan reward scale where no hotspot shares their hex.
+    Datasets are loaded with the lazy storage backend, so only the densities
+    the queried hexes depend on are computed. For negative coords, prepend a
+    'n' on the number. Ex(n83 = -83)
+    """
+    if graph_file is None and snapshot is None:
+        raise click.BadParameter('Give a graph_file or a --snapshot.', param_hint='graph_file')
+    import numpy as np
+
+    from chain_vars import RES_MAX
+    from hex_arrays import geo_to_cells
+
+    points = [(_coordinate(lat), _coordinate(lng)) for lat, lng in points]
+    if locations is not None:
+        points += _read_locations(locations)
+    reward_graph = load_graph(graph_file, directory, snapshot, storage='lazy', snapshot_params=snapshot_params)
+    lats = np.array([lat for lat, _ in points], dtype=np.float64)
+    lngs = np.array([lng for _, lng in points], dtype=np.float64)
+    if not reward_graph.hex_dict.generated:
+        reward_graph._generate_reward_scales()
+    reward_scales = reward_graph.hex_dict.packed().reward_scales(geo_to_cells(lats, lngs, RES_MAX), missing=np.nan)
+    rows = (
+        {'lat': lat, 'lng': lng, 'reward_scale': reward_scale}
+        for lat, lng, reward_scale in zip(lats.tolist(), lngs.tolist(), reward_scales.tolist())
+    )
+    with open_output(output) as f:
+        write_rows(f, rows, QUERY_COLUMNS, output_format)
+
+@main.command()
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('--directory', default=DATA_DIR, help='Directory of the datasets named without a path.')
+@click.option('--storage', type=click.Choice(['dict', 'compact']), default='compact', help='Storage backend of the hex densities.')
+@click.option('--profile', is_flag=True, help='Print per-phase timings and call counters to stderr when done.')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'json']), default='csv', help='Output format, json writes one object per node and line.')
+@click.option('--output', default=None, help='Write the nodes to this file instead of stdout.')
+def batch(patterns, directory, storage, profile, output_format, output):
+    """Compute the reward scale of the nodes of many datasets at once.
+
+    The datasets are computed one after another in a single process.
+    PATTERNS are dataset names of --directory, node csv files, or Parquet and
+    Arrow files, and may be glob patterns (quote them). The nodes of every
+    dataset are written with a dataset column, streamed to the output as
+    they are read. The h3 topology lookups are shared by all datasets, so
+    overlapping datasets reuse them. A dataset that fails to load is
+    reported on stderr and skipped, and the exit code is 1.
+    """
+    import profiling
+    from topology import TopologyCache
+
+    profiler = profiling.Profiler()
+    if profile:
+        profiler.enable()
+    # Every dataset is a full graph pass, an LRU bound would only thrash.
+    topology = TopologyCache(maxsize=None)
+    failed = 0
+    header = True
+    reward_graph = None
+    with open_output(output) as f:
+        for name, graph_file, graph_directory in resolve_datasets(patterns, directory):
+            try:
+                reward_graph = load_graph(graph_file, graph_directory, storage=storage, topology=topology)
+                if not reward_graph.hex_dict.generated:
+                    reward_graph._generate_reward_scales()
+            except Exception as error:
+                failed += 1
+                click.echo(f'{name}: {error}', err=True)
+                continue
+            try:
+                write_rows(f, node_rows(reward_graph, dataset=name), ('dataset',) + NODE_COLUMNS, output_format, header)
+            except Exception as error:
+                failed += 1
+                click.echo(f'{name}: failed while writing, its nodes are incomplete: {error}', err=True)
+            header = False
+    if profile:
+        profiler.disable()
+        click.echo(profiler.format_report(None if reward_graph is None else reward_graph.hex_dict), err=True)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
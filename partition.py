@@ -0,0 +1,197 @@
+"""Compute the reward scales of a graph in parallel, one region at a time.
+
+Hotspots are sharded by their RES_MIN ancestor. Each shard holds the
+hotspots of a few RES_MIN cells (the core) and the hotspots around them (the
+halo), and is computed in its own HexDict in a process pool.
+
+The clipped density of a hex depends on the unclipped densities of its
+neighbors, which in turn depend on the neighbors of their children, so the
+hexes a core needs spread outwards by one ring per resolution. Summed from
+RES_MAX up to RES_MIN + 1 this stays within about 4.4 RES_MIN + 1 edge
+lengths of a core hex, while HALO_RINGS rings of RES_MIN + 1 hexes cover
+more than 6, so every core value is exact. The shards stop at RES_MIN + 1.
+The RES_MIN and RES_MIN - 1 levels span the whole graph and are computed in
+the main process from the core unclipped densities of every shard.
+
+Reward scales are multiplied from RES_MAX - 1 down, as in
+HexDict.compute_reward_scale, so results are identical to a single process
+run.
+"""
+
+import concurrent.futures
+import os
+
+import h3
+import numpy as np
+
+from chain_params import DEFAULT_PARAMS
+from chain_vars import *
+from hex_arrays import cells_to_parents
+from hex_arrays import cells_to_strings
+from hex_arrays import geo_to_cells
+from hex_arrays import strings_to_cells
+from reward_graph import HexDict
+from reward_graph import Hexagon
+import profiling
+
+# Rings of RES_MIN + 1 hexes around a core whose hotspots are loaded in a shard.
+HALO_RINGS = 3
+
+# Number of core hotspots after which a shard is closed.
+SHARD_SIZE = 50000
+
+def partition_hotspots(cells, halo_rings=HALO_RINGS, shard_size=SHARD_SIZE):
+    """Group hotspots into shards of whole RES_MIN cells plus a halo.
+
+    Neighboring RES_MIN cells have close indexes, so cells are grouped in
+    index order. The halo of a shard holds the other hotspots whose
+    RES_MIN + 1 ancestor is within halo_rings of an occupied RES_MIN + 1
+    hex of the core.
+
+    REQUIRES:
+        -> cells: a uint64 array with the RES_MAX cell of every hotspot.
+    RETURNS:
+        -> list: a (core, halo) pair of index arrays into cells per shard.
+    """
+    ancestors = cells_to_parents(cells, RES_MIN)
+    order = np.argsort(ancestors, kind='stable')
+    keys, starts = np.unique(ancestors[order], return_index=True)
+    ends = np.append(starts[1:], len(cells))
+
+    halo_ancestors = cells_to_parents(cells, RES_MIN + 1)
+    halo_order = np.argsort(halo_ancestors, kind='stable')
+    halo_keys, halo_starts = np.unique(halo_ancestors[halo_order], return_index=True)
+    halo_ends = np.append(halo_starts[1:], len(cells))
+
+    shards = []
+    group = []
+    count = 0
+    for i in range(len(keys)):
+        group.append(i)
+        count += ends[i] - starts[i]
+        if count < shard_size and i < len(keys) - 1:
+            continue
+        core = np.concatenate([order[starts[j]:ends[j]] for j in group])
+        rings = set()
+        for hex_id in cells_to_strings(np.unique(halo_ancestors[core])):
+            rings.update(h3.k_ring(hex_id, halo_rings))
+        ring_cells = strings_to_cells(rings)
+        ring_cells = ring_cells[~np.isin(cells_to_parents(ring_cells, RES_MIN), keys[group])]
+        positions = np.searchsorted(halo_keys, ring_cells)
+        positions[positions == len(halo_keys)] = 0
+        positions = np.sort(positions[halo_keys[positions] == ring_cells])
+        halo = [halo_order[halo_starts[j]:halo_ends[j]] for j in positions.tolist()]
+        shards.append((core, np.concatenate(halo) if halo else np.empty(0, dtype=np.int64)))
+        group = []
+        count = 0
+    return shards
+
+def compute_shard(core_cells, halo_cells, params=DEFAULT_PARAMS):
+    """Compute the densities of a shard down to RES_MIN + 1.
+
+    RETURNS:
+        -> (cells, partial, res_min_ids, res_min_unclipped): the sorted
+            unique core cells with the product of their reward scale ratios
+            from RES_MAX - 1 to RES_MIN + 1, and the RES_MIN cells of the
+            core with their unclipped densities.
+    """
+    hex_dict = HexDict(params=params)
+    hotspot_cells = np.concatenate([core_cells, halo_cells])
+    hex_dict.add_cells(hotspot_cells, [None] * len(hotspot_cells))
+    hex_dict.generate_max_res_meta()
+    for res in range(RES_MAX - 1, RES_MIN, -1):
+        with profiling.phase(f'res_{res}'):
+            hex_dict.aggregate_level(res)
+            hex_dict.clip_level(res)
+    with profiling.phase(f'res_{RES_MIN}'):
+        hex_dict.aggregate_level(RES_MIN)
+
+    cells = np.unique(core_cells)
+    partial = np.ones(len(cells), dtype=np.float64)
+    for res in range(RES_MAX - 1, RES_MIN, -1):
+        level = hex_dict.hex_dict[res]
+        hexes = [level[hex_id] for hex_id in cells_to_strings(cells_to_parents(cells, res))]
+        clipped = np.fromiter((hex.clipped_density for hex in hexes), dtype=np.int64, count=len(hexes))
+        unclipped = np.fromiter((hex.unclipped_density for hex in hexes), dtype=np.int64, count=len(hexes))
+        partial *= clipped / unclipped
+
+    res_min_ids = np.unique(cells_to_parents(cells, RES_MIN))
+    level = hex_dict.hex_dict[RES_MIN]
+    res_min_unclipped = np.fromiter(
+        (level[hex_id].unclipped_density for hex_id in cells_to_strings(res_min_ids)),
+        dtype=np.int64, count=len(res_min_ids)
+    )
+    return cells, partial, res_min_ids, res_min_unclipped
+
+def _compute_shard_task(shard):
+    """Process pool task, see compute_shard."""
+    return compute_shard(*shard)
+
+def level_ratios(hex_dict, res):
+    """Return the sorted hex ids at res and their clipped / unclipped ratios."""
+    level = hex_dict.hex_dict[res]
+    hex_ids = strings_to_cells(level.keys())
+    clipped = np.fromiter((hex.clipped_density for hex in level.values()), dtype=np.int64, count=len(level))
+    unclipped = np.fromiter((hex.unclipped_density for hex in level.values()), dtype=np.int64, count=len(level))
+    order = np.argsort(hex_ids)
+    return hex_ids[order], (clipped / unclipped)[order]
+
+def compute_reward_scales(cells, workers=None, halo_rings=HALO_RINGS, shard_size=SHARD_SIZE, params=DEFAULT_PARAMS):
+    """Compute the reward scale of every hotspot, one shard at a time.
+
+    REQUIRES:
+        -> cells: a uint64 array with the RES_MAX cell of every hotspot.
+        -> workers: number of worker processes. Defaults to the cpu count,
+            1 computes all shards in the current process.
+        -> params: the chain_params.ChainParams to compute with.
+    RETURNS:
+        -> np.ndarray[float64]: the reward scale of every hotspot, identical
+            to a single HexDict built from all hotspots.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    with profiling.phase('partition'):
+        shards = [
+            (cells[core], cells[halo], params)
+            for core, halo in partition_hotspots(cells, halo_rings, shard_size)
+        ]
+    if workers is None:
+        workers = os.cpu_count()
+    with profiling.phase('shards'):
+        if workers == 1 or len(shards) <= 1:
+            results = [compute_shard(*shard) for shard in shards]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_compute_shard_task, shards))
+
+    # The RES_MIN and RES_MIN - 1 levels, built from the exact core densities.
+    top = HexDict(params=params)
+    level = top.hex_dict[RES_MIN]
+    for _, _, res_min_ids, res_min_unclipped in results:
+        for hex_id, unclipped in zip(cells_to_strings(res_min_ids), res_min_unclipped.tolist()):
+            hex = level[hex_id] = Hexagon(hex_id)
+            hex.unclipped_density = unclipped
+    top.clip_level(RES_MIN)
+    top.aggregate_level(RES_MIN - 1)
+    top.clip_level(RES_MIN - 1)
+
+    shard_cells = np.concatenate([result[0] for result in results]) if results else np.empty(0, dtype=np.uint64)
+    reward_scales = np.concatenate([result[1] for result in results]) if results else np.empty(0)
+    for res in (RES_MIN, RES_MIN - 1):
+        hex_ids, ratios = level_ratios(top, res)
+        reward_scales *= ratios[np.searchsorted(hex_ids, cells_to_parents(shard_cells, res))]
+
+    order = np.argsort(shard_cells)
+    return reward_scales[order][np.searchsorted(shard_cells[order], cells)]
+
+def generate_partitioned(reward_graph, workers=None, halo_rings=HALO_RINGS, shard_size=SHARD_SIZE):
+    """Set the 'reward_scale' of every node of a graph, see compute_reward_scales.
+
+    EFFECTS:
+        -> Only the node reward scales are set, the hex dict of the graph is
+            left as is.
+    """
+    nodes = reward_graph.nodes()
+    cells = geo_to_cells([node['lat'] for node in nodes], [node['lng'] for node in nodes], RES_MAX)
+    reward_scales = compute_reward_scales(cells, workers, halo_rings, shard_size, reward_graph.params)
+    for node, reward_scale in zip(nodes, reward_scales.tolist()):
+        node['reward_scale'] = reward_scale
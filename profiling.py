@@ -0,0 +1,159 @@
+"""Opt-in instrumentation of the reward scale computation.
+
+Coarse phases (loading, every resolution of the density build, scoring) are
+marked in the code with 'with profiling.phase(name):', which is a shared no
+op context while profiling is disabled. Per call counters (h3 calls, counted
+as 'h3.name' for the string api and 'h3_int.name' for h3.api.basic_int, Hexagon
+objects, HexDict lookups, compute_reward_scale calls) are collected by
+wrapping the functions only while a Profiler is enabled, so nothing is
+instrumented otherwise.
+
+Use as:
+    with profiling.profile() as profiler:
+        reward_graph.import_graph_from_csv('chicago')
+        reward_graph._generate_reward_scales()
+    print(profiler.format_report(reward_graph.hex_dict))
+"""
+
+import contextlib
+import functools
+import inspect
+import time
+
+import h3
+from h3.api import basic_int as h3_int
+
+from chain_vars import *
+
+# The enabled Profiler, None while profiling is disabled.
+_profiler = None
+
+# Returned by phase while profiling is disabled.
+_NO_PHASE = contextlib.nullcontext()
+
+def phase(name):
+    """Return a context manager timing the phase name, if profiling is enabled.
+
+    Phases entered inside another phase are reported as 'outer/name'.
+    """
+    if _profiler is None:
+        return _NO_PHASE
+    return _profiler.phase(name)
+
+class Profiler:
+    """Per-phase timers and call counters."""
+
+    def __init__(self):
+        """Constructor."""
+        self.phases = {}
+        self.counters = {}
+        self.stack = []
+        self.patches = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a phase, see profiling.phase."""
+        self.stack.append(name)
+        path = '/'.join(self.stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds, calls = self.phases.get(path, (0.0, 0))
+            self.phases[path] = (seconds + time.perf_counter() - start, calls + 1)
+            self.stack.pop()
+
+    def count(self, name, amount=1):
+        """Increment the counter name."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _patch(self, owner, attribute, counter, timed=False):
+        """Replace owner.attribute with a wrapper counting its calls."""
+        function = getattr(owner, attribute)
+        profiler = self
+
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            profiler.count(counter)
+            return function(*args, **kwargs)
+
+        @functools.wraps(function)
+        def counted_and_timed(*args, **kwargs):
+            profiler.count(counter)
+            with profiler.phase(counter):
+                return function(*args, **kwargs)
+
+        self.patches.append((owner, attribute, function))
+        setattr(owner, attribute, counted_and_timed if timed else counted)
+
+    def enable(self):
+        """Install the counters and make this the active Profiler."""
+        global _profiler
+        if _profiler is not None:
+            raise Exception("A profiler is already enabled.")
+        from reward_graph import HexDict
+        from reward_graph import Hexagon
+
+        # The vectorized backends (topology, compact_hex_dict, spatial_index)
+        # call the integer api, which has its own module level functions.
+        for module, prefix in ((h3, 'h3'), (h3_int, 'h3_int')):
+            for name, function in inspect.getmembers(module):
+                if not name.startswith('_') and callable(function) and not inspect.isclass(function):
+                    self._patch(module, name, f'{prefix}.{name}')
+        self._patch(Hexagon, '__init__', 'Hexagon')
+        for name in ('__getitem__', '__contains__', 'neighbors', 'children'):
+            self._patch(HexDict, name, f'HexDict.{name}')
+        self._patch(HexDict, 'compute_reward_scale', 'compute_reward_scale', timed=True)
+        _profiler = self
+
+    def disable(self):
+        """Remove the counters installed by enable."""
+        global _profiler
+        for owner, attribute, original in reversed(self.patches):
+            setattr(owner, attribute, original)
+        self.patches = []
+        _profiler = None
+
+    def report(self, hex_dict=None):
+        """Return the collected measurements as a dict.
+
+        REQUIRES:
+            -> hex_dict: an optional HexDict or CompactHexDict whose number
+                of hexes per resolution is added to the report.
+        """
+        report = {
+            'phases': {
+                path: {'seconds': seconds, 'calls': calls}
+                for path, (seconds, calls) in self.phases.items()
+            },
+            'counters': dict(sorted(self.counters.items())),
+        }
+        if hex_dict is not None:
+            if hasattr(hex_dict, 'hex_dict'):
+                levels = dict(enumerate(hex_dict.hex_dict))
+            else:
+                levels = hex_dict.hex_ids
+            report['hexes'] = {str(res): len(levels.get(res, ())) for res in range(RES_MAX, RES_MIN - 2, -1)}
+        return report
+
+    def format_report(self, hex_dict=None):
+        """Return the report as a human readable table."""
+        report = self.report(hex_dict)
+        lines = ['phase,seconds,calls']
+        lines += [f"{path},{phase['seconds']:.6f},{phase['calls']}" for path, phase in report['phases'].items()]
+        lines += ['', 'counter,calls']
+        lines += [f'{name},{calls}' for name, calls in report['counters'].items()]
+        if 'hexes' in report:
+            lines += ['', 'res,hexes']
+            lines += [f'{res},{count}' for res, count in report['hexes'].items()]
+        return '\n'.join(lines)
+
+@contextlib.contextmanager
+def profile():
+    """Enable a new Profiler for the duration of a with block."""
+    profiler = Profiler()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
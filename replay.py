@@ -0,0 +1,228 @@
+"""Replay hotspot history and record how reward scales evolved.
+
+Events are read from a jsonl file, ordered by block:
+    {"block": 1200, "type": "assert_location", "address": ..., "lat": ..., "lng": ...}
+    {"block": 1350, "type": "inactive", "address": ...}
+    {"block": 1400, "type": "active", "address": ...}
+
+A hotspot counts towards the densities while it has an asserted location
+and is active. Asserting a location makes a new hotspot active, and moves an
+active one. Inactive hotspots keep their location, so they come back in
+place when they are active again.
+
+The events of a block are applied with the incremental RewardGraph updates,
+then a (block, hotspot, reward_scale) row is emitted for every hotspot whose
+reward scale changed, nan when it became inactive. Reward scales are
+constant between their rows. The rows are streamed to a SeriesWriter, so
+memory is bounded by the hotspots, not by the length of the history.
+"""
+
+import json
+import os
+
+import click
+import numpy as np
+
+from reward_graph import RewardGraph
+
+# Version of the series directory layout.
+SERIES_VERSION = 1
+
+# Rows buffered by a SeriesWriter before they are appended to the columns.
+SERIES_CHUNK_SIZE = 65536
+
+# Columns of a series, with their dtypes. hotspot indexes hotspots.txt.
+SERIES_COLUMNS = (('block', np.int64), ('hotspot', np.uint32), ('reward_scale', np.float64))
+
+EVENT_TYPES = ('assert_location', 'active', 'inactive')
+
+def read_events(path):
+    """Yield the events of a jsonl file one at a time."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+class SeriesWriter:
+    """Append only columnar storage of reward scale time series.
+
+    A series is a directory holding one raw array file per column, a
+    hotspots.txt with the address of every hotspot index, and a meta.json.
+    """
+
+    def __init__(self, path, chunk_size=SERIES_CHUNK_SIZE):
+        """Constructor.
+
+        EFFECTS:
+            -> Creates the directory path, replacing any previous series.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.hotspots = {}
+        self.rows = []
+        self.row_count = 0
+        self.columns = {name: open(os.path.join(path, f'{name}.bin'), 'wb') for name, _ in SERIES_COLUMNS}
+        self.addresses = open(os.path.join(path, 'hotspots.txt'), 'w')
+
+    def write(self, block, address, reward_scale):
+        """Record the reward scale of a hotspot from block on."""
+        hotspot = self.hotspots.get(address)
+        if hotspot is None:
+            hotspot = self.hotspots[address] = len(self.hotspots)
+            self.addresses.write(address + '\n')
+        self.rows.append((block, hotspot, reward_scale))
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered rows to the column files."""
+        if not self.rows:
+            return
+        for (name, dtype), values in zip(SERIES_COLUMNS, zip(*self.rows)):
+            np.asarray(values, dtype=dtype).tofile(self.columns[name])
+        self.row_count += len(self.rows)
+        self.rows = []
+
+    def close(self, **meta):
+        """Flush the rows and write meta.json, with the extra meta given."""
+        self.flush()
+        for f in self.columns.values():
+            f.close()
+        self.addresses.close()
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, version=SERIES_VERSION, rows=self.row_count, hotspots=len(self.hotspots)), f)
+
+def read_series(path):
+    """Read a series written by a SeriesWriter.
+
+    RETURNS:
+        -> (addresses, columns): the address of every hotspot index, and a
+            dict of column name -> memory-mapped array, in row order.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != SERIES_VERSION:
+        raise Exception(f"Unsupported series version {meta['version']}, expected {SERIES_VERSION}.")
+    with open(os.path.join(path, 'hotspots.txt')) as f:
+        addresses = f.read().splitlines()
+    columns = {}
+    for name, dtype in SERIES_COLUMNS:
+        if meta['rows']:
+            columns[name] = np.memmap(os.path.join(path, f'{name}.bin'), dtype=dtype, mode='r', shape=(meta['rows'],))
+        else:
+            columns[name] = np.zeros(0, dtype=dtype)
+    return addresses, columns
+
+class Replay:
+    """Hotspot state advanced one block at a time."""
+
+    def __init__(self, reward_graph=None):
+        """Constructor.
+
+        REQUIRES:
+            -> reward_graph: an optional RewardGraph using the dict storage
+                backend holding the state before the first event. Its nodes
+                are active. Defaults to an empty graph.
+        """
+        if reward_graph is None:
+            reward_graph = RewardGraph()
+        if not reward_graph.hex_dict.generated:
+            reward_graph._generate_reward_scales()
+        self.reward_graph = reward_graph
+        self.locations = {node.node_identifier: (node['lat'], node['lng']) for node in reward_graph.nodes()}
+        self.inactive = set()
+        self.block = None
+
+    def apply_block(self, block, events):
+        """Apply the events of one block.
+
+        RETURNS:
+            -> dict: address -> reward scale of every hotspot whose reward
+                scale changed, nan for hotspots that became inactive.
+        """
+        if self.block is not None and block < self.block:
+            raise Exception(f"Events are out of order: block {block} after block {self.block}.")
+        self.block = block
+        changed = set()
+        deactivated = set()
+        for event in events:
+            address = event['address']
+            if event['type'] == 'assert_location':
+                location = (event['lat'], event['lng'])
+                if address in self.inactive:
+                    # Placed when it is active again.
+                    pass
+                elif address in self.locations:
+                    changed |= self.reward_graph.move_hotspot(address, *location)
+                else:
+                    changed |= self.reward_graph.add_hotspot(address, *location, address=address, name=event.get('name'))
+                    deactivated.discard(address)
+                self.locations[address] = location
+            elif event['type'] == 'inactive':
+                if address in self.locations and address not in self.inactive:
+                    changed |= self.reward_graph.remove_hotspot(address)
+                    changed.discard(address)
+                    deactivated.add(address)
+                self.inactive.add(address)
+            elif event['type'] == 'active':
+                if address in self.inactive:
+                    self.inactive.discard(address)
+                    if address in self.locations:
+                        changed |= self.reward_graph.add_hotspot(address, *self.locations[address], address=address)
+                        deactivated.discard(address)
+            else:
+                raise Exception(f"Unknown event: {event['type']}.")
+        series = {address: self.reward_graph.graph.node(address)['reward_scale'] for address in changed}
+        series.update((address, float('nan')) for address in deactivated)
+        return series
+
+def replay(events, writer, reward_graph=None, start_block=0):
+    """Replay an ordered event stream, writing every reward scale change to writer.
+
+    REQUIRES:
+        -> events: an iterable of events ordered by block, see read_events.
+        -> writer: a SeriesWriter.
+        -> reward_graph: an optional initial state, see Replay. Its reward
+            scales are written at start_block.
+    RETURNS:
+        -> Replay: the state after the last event.
+    """
+    state = Replay(reward_graph)
+    for node in state.reward_graph.nodes():
+        writer.write(start_block, node.node_identifier, node['reward_scale'])
+
+    block, block_events = None, []
+    for event in events:
+        if event['block'] != block and block_events:
+            for address, reward_scale in sorted(state.apply_block(block, block_events).items()):
+                writer.write(block, address, reward_scale)
+            block_events = []
+        block = event['block']
+        block_events.append(event)
+    if block_events:
+        for address, reward_scale in sorted(state.apply_block(block, block_events).items()):
+            writer.write(block, address, reward_scale)
+    return state
+
+@click.command()
+@click.argument('events_file')
+@click.argument('output')
+@click.option('--graph-file', default=None, help='Start from graph_data/(graph_file)_nodes.csv instead of no hotspots.')
+@click.option('--start-block', default=0, help='Block of the initial state.')
+def main(events_file, output, graph_file, start_block):
+    """Replay the events of events_file and write the reward scale series to the directory output."""
+    reward_graph = None
+    if graph_file is not None:
+        reward_graph = RewardGraph()
+        reward_graph.import_graph_from_csv(graph_file)
+    writer = SeriesWriter(output)
+    state = replay(read_events(events_file), writer, reward_graph, start_block)
+    writer.close(
+        events_file=events_file, graph_file=graph_file, start_block=start_block,
+        last_block=state.block, params=state.reward_graph.params.key()
+    )
+    print(f'{writer.row_count} rows for {len(writer.hotspots)} hotspots, {len(state.reward_graph.graph)} active at block {state.block}')
+
+if __name__ == "__main__":
+    main()
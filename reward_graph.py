@@ -5,31 +5,200 @@ Information on the algorithm can be found at:
 
 """
 
+import os
+
 import h3
+import numpy as np
 
 from graph import Graph
-from graph import read_graph_from_csv
+from loader import read_node_chunks
+from snapshot import read_snapshot
+from snapshot import write_snapshot
 
+from chain_params import DEFAULT_PARAMS
 from chain_vars import *
+from compact_hex_dict import CompactHexDict
+from hex_arrays import PackedLevels
+from hex_arrays import cells_to_strings
+from hex_arrays import geo_to_cells
+from lazy_hex_dict import LazyHexDict
+from topology import TopologyCache
+import profiling
+
+# Density engines that can be used to build the HIP17 hierarchy.
+#   -> linear: two phases per resolution (aggregate, then clip), each hex is
+#       visited a constant number of times.
+#   -> legacy: the original recursive generate_parents implementation.
+DENSITY_ENGINES = ('linear', 'legacy')
+
+# Storage backends for the hex densities.
+#   -> dict: a HexDict of Hexagon objects, supports incremental updates.
+#   -> compact: a read only CompactHexDict of per-resolution arrays.
+#   -> lazy: a read only LazyHexDict, computing only the densities a query
+#       depends on, for interactive lookups.
+STORAGE_BACKENDS = ('dict', 'compact', 'lazy')
 
 class RewardGraph:
     """A graph data structure."""
 
-    def __init__(self):
-        """Constructor."""
+    def __init__(self, density_engine='linear', storage='dict', params=DEFAULT_PARAMS, topology=None):
+        """Constructor.
+
+        REQUIRES:
+            -> density_engine: one of DENSITY_ENGINES. Selects the algorithm
+                used to build the hex densities.
+            -> storage: one of STORAGE_BACKENDS. The compact and lazy backends
+                build their own densities and can only be used with the
+                linear engine.
+            -> params: the chain_params.ChainParams the reward scales are
+                computed with.
+            -> topology: an optional TopologyCache, shared by graphs loaded
+                one after another so h3 lookups stay warm.
+        """
+        if density_engine not in DENSITY_ENGINES:
+            raise Exception(f"Unknown density engine: {density_engine}.")
+        if storage not in STORAGE_BACKENDS:
+            raise Exception(f"Unknown storage backend: {storage}.")
+        if storage in ('compact', 'lazy') and density_engine != 'linear':
+            raise Exception(f"The {storage} storage backend requires the linear density engine.")
+        self.density_engine = density_engine
+        self.params = params
 
         # hex_dict is used to store all hexagons needed for reward algorithms.
-        self.hex_dict = HexDict()
+        if storage == 'compact':
+            self.hex_dict = CompactHexDict(topology=topology, params=params)
+        elif storage == 'lazy':
+            self.hex_dict = LazyHexDict(topology=topology, params=params)
+        else:
+            self.hex_dict = HexDict(topology=topology, params=params)
+        self.graph = Graph()
+
+    def import_graph_from_csv(self, graph_file, directory='graph_data'):
+        """Import a graph from the (graph_file)_nodes.csv and (graph_file)_edges.csv files of directory."""
+        nodes_file = os.path.join(directory, graph_file + "_nodes.csv")
+        edges_file = os.path.join(directory, graph_file + "_edges.csv")
+        self._import_node_chunks(read_node_chunks(nodes_file))
+        if os.path.exists(edges_file):
+            self.graph.load_edges(edges_file)
+
+    def import_graph_from_table(self, path, bbox=None):
+        """Import a graph from a Parquet or Arrow file, see columnar.read_table_chunks.
+
+        REQUIRES:
+            -> bbox: an optional (swlat, swlng, nelat, nelng) tuple, only the
+                hotspots inside it are imported.
+        """
+        from columnar import read_table_chunks
+
+        self._import_node_chunks(read_table_chunks(path, bbox))
+
+    def _import_node_chunks(self, chunks):
+        """Replace the graph with the nodes of an iterable of loader.NodeColumns.
+
+        Nodes are keyed by address, so every node needs a distinct, non empty
+        address. The nodes are added first, Graph.add_node_columns raises on
+        a repeated address before its density is added.
+        """
         self.graph = Graph()
+        with profiling.phase('load'):
+            for columns in chunks:
+                with profiling.phase('add_nodes'):
+                    self.graph.add_node_columns(columns)
+                with profiling.phase('add_hexes'):
+                    self.hex_dict.add_hexes(columns.lat, columns.lng, columns.address.tolist())
+
+    def save_snapshot(self, path):
+        """Save the computed densities and nodes to a snapshot file.
+
+        EFFECTS:
+            -> Generates the reward scales first if needed.
+        """
+        if not self.hex_dict.generated:
+            self._generate_reward_scales()
+        hex_dict = self.hex_dict
+        if not isinstance(hex_dict, CompactHexDict):
+            hex_dict = CompactHexDict.from_hex_dict(hex_dict)
+        nodes = [self.graph.node(node_id) for node_id in hex_dict.hotspot_names]
+        write_snapshot(path, hex_dict, {
+            'address': [node.node_identifier for node in nodes],
+            'name': [node.attributes.get('name', '') for node in nodes],
+            'lat': [node['lat'] for node in nodes],
+            'lng': [node['lng'] for node in nodes],
+            'reward_scale_correct': [node.attributes.get('reward_scale_correct', float('nan')) for node in nodes],
+            'reward_scale': hex_dict.packed().reward_scales(hex_dict.hotspot_cells)
+        })
+
+    def write_parquet(self, nodes_path, densities_path=None):
+        """Write the reward scale of every node, and optionally the densities, to Parquet files.
+
+        See columnar.py for the layout of the files.
+
+        EFFECTS:
+            -> Generates the reward scales first if needed.
+        """
+        from columnar import write_densities_table
+        from columnar import write_nodes_table
+
+        nodes = self.nodes()
+        lats = np.array([node['lat'] for node in nodes], dtype=np.float64)
+        lngs = np.array([node['lng'] for node in nodes], dtype=np.float64)
+        write_nodes_table(nodes_path, {
+            'address': [node.node_identifier for node in nodes],
+            'name': [node.attributes.get('name') for node in nodes],
+            'lat': lats,
+            'lng': lngs,
+            'reward_scale_correct': np.array(
+                [node.attributes.get('reward_scale_correct', np.nan) for node in nodes], dtype=np.float64
+            ),
+            'reward_scale': self.reward_scales(lats, lngs),
+            'cell': geo_to_cells(lats, lngs, RES_MAX),
+        })
+        if densities_path is not None:
+            if isinstance(self.hex_dict, LazyHexDict):
+                raise Exception("The lazy storage backend does not compute every density.")
+            if not self.hex_dict.generated:
+                self._generate_reward_scales()
+            write_densities_table(densities_path, self.hex_dict)
+
+    @classmethod
+    def load_snapshot(cls, path, nodes=True, params=None):
+        """Load a RewardGraph from a snapshot file.
+
+        The densities are memory-mapped and used as is, nothing is recomputed.
 
-    def import_graph_from_csv(self, graph_file):
-        """Import a graph from a csv file."""
-        nodes_file = graph_file + "_nodes.csv"
-        edges_file = graph_file + "_edges.csv"
+        REQUIRES:
+            -> path: a snapshot written with the current chain variables.
+            -> nodes: if False, the graph is left empty. Reward scales can
+                still be computed with compute_reward_scale / reward_scales.
+            -> params: the chain params the snapshot must have been computed
+                with, the chain variables of chain_vars.py if None. 'stored'
+                loads the snapshot with the params stored in it.
+        RETURNS:
+            -> RewardGraph: a graph using the compact storage backend.
+        """
+        hex_dict, columns = read_snapshot(path, params)
+        reward_graph = cls(storage='compact', params=hex_dict.params)
+        reward_graph.hex_dict = hex_dict
+        if nodes:
+            float_columns = [columns[name].tolist() for name in ('lat', 'lng', 'reward_scale_correct', 'reward_scale')]
+            for address, name, lat, lng, reward_scale_correct, reward_scale in zip(
+                columns['address'], columns['name'], *float_columns
+            ):
+                reward_graph.graph.add_node(
+                    address, address=address, name=name, lat=lat, lng=lng,
+                    reward_scale_correct=reward_scale_correct, reward_scale=reward_scale
+                )
+        return reward_graph
 
-        self.graph = read_graph_from_csv( f"graph_data/{nodes_file}", f"graph_data/{edges_file}", True )
-        for node in self.nodes(): 
-            self.hex_dict.add_hex(float(node['lat']), float(node['lng']), node['name'])
+    def compute_reward_scale(self, lat:float, lng:float):
+        """Return the reward scale of the RES_MAX hex containing lat, lng.
+
+        REQUIRES:
+            -> The RES_MAX hex must hold a node of the graph.
+        """
+        if not self.hex_dict.generated:
+            self._generate_reward_scales()
+        return self.hex_dict.compute_reward_scale(lat, lng)
 
     def geo_to_node(self, lat:float, lng:float, node_id = None):
         """A position to latitude and longitude coordinates.
@@ -46,7 +215,85 @@ class RewardGraph:
             node_id = f'{lat}{lng}'
 
         self.graph.add_node(node_id, lat=lat, lng=lng)
-        self.hex_dict.add_hex(lat, lng)
+        self.hex_dict.add_hex(lat, lng, node_id)
+
+    def add_hotspot(self, node_id, lat:float, lng:float, **attributes):
+        """Add a hotspot, updating the reward scales incrementally.
+
+        REQUIRES:
+            -> node_id: an id that is not yet in the graph.
+        RETURNS:
+            -> set: the ids of all nodes whose reward scale changed,
+                including the new node.
+        """
+        if not self.hex_dict.generated:
+            self._generate_reward_scales()
+        self.graph.add_node(node_id, lat=lat, lng=lng, **attributes)
+        return self._update_reward_scales(self.hex_dict.add_hotspot(lat, lng, node_id))
+
+    def move_hotspot(self, node_id, lat:float, lng:float):
+        """Move a hotspot to a new location, updating the reward scales incrementally.
+
+        RETURNS:
+            -> set: the ids of all nodes whose reward scale changed.
+        """
+        if not self.hex_dict.generated:
+            self._generate_reward_scales()
+        node = self.graph.node(node_id)
+        changed = self.hex_dict.move_hotspot(node['lat'], node['lng'], lat, lng, node_id)
+        self.graph.move_node(node_id, lat, lng)
+        return self._update_reward_scales(changed)
+
+    def remove_hotspot(self, node_id):
+        """Remove a hotspot from the graph, updating the reward scales incrementally.
+
+        RETURNS:
+            -> set: the ids of all remaining nodes whose reward scale changed.
+        """
+        if not self.hex_dict.generated:
+            self._generate_reward_scales()
+        node = self.graph.node(node_id)
+        changed = self.hex_dict.remove_hotspot(node['lat'], node['lng'], node_id)
+        self.graph.remove_node(node_id)
+        return self._update_reward_scales(changed)
+
+    def apply_changes(self, changes):
+        """Apply a change set, e.g. one emitted by downloader/sync.py.
+
+        REQUIRES:
+            -> changes: an iterable of dicts with an 'op' of 'add', 'move' or
+                'remove', an 'address', and 'lat'/'lng' for adds and moves.
+        RETURNS:
+            -> set: the ids of all remaining nodes whose reward scale changed.
+        """
+        changed = set()
+        for change in changes:
+            node_id = change['address']
+            if change['op'] == 'add':
+                changed |= self.add_hotspot(node_id, change['lat'], change['lng'], address=node_id, name=change.get('name'))
+            elif change['op'] == 'move':
+                changed |= self.move_hotspot(node_id, change['lat'], change['lng'])
+            elif change['op'] == 'remove':
+                changed |= self.remove_hotspot(node_id)
+                changed.discard(node_id)
+            else:
+                raise Exception(f"Unknown change: {change['op']}.")
+        return changed
+
+    def _update_reward_scales(self, node_ids):
+        """Recompute the reward scale of the given nodes.
+
+        RETURNS:
+            -> set: the ids of the nodes whose reward scale changed.
+        """
+        changed = set()
+        for node_id in node_ids:
+            node = self.graph.node(node_id)
+            reward_scale = self.hex_dict.compute_reward_scale(node['lat'], node['lng'])
+            if node.attributes.get('reward_scale') != reward_scale:
+                node['reward_scale'] = reward_scale
+                changed.add(node_id)
+        return changed
 
     def get_reward_scale(self, node):
         """Given a node in the graph, return the computed reward scale.
@@ -57,9 +304,48 @@ class RewardGraph:
             -> float: the reward scale as an float for a given node.
         """
         if 'reward_scale' not in node.attributes:
-            self._generate_reward_scales()
+            if isinstance(self.hex_dict, LazyHexDict):
+                node['reward_scale'] = self.hex_dict.compute_reward_scale(node['lat'], node['lng'])
+            else:
+                self._generate_reward_scales()
         return node['reward_scale']
 
+    def reward_scales(self, lats, lngs):
+        """Compute the reward scales of many locations at once.
+
+        REQUIRES:
+            -> lats, lngs: equal length arrays of coordinates. Every location
+                must lie in a RES_MAX hex that holds a node of the graph.
+        RETURNS:
+            -> np.ndarray: the reward scale of every location, identical to
+                HexDict.compute_reward_scale.
+        """
+        if not self.hex_dict.generated:
+            self._generate_reward_scales()
+        return self.hex_dict.packed().reward_scales(geo_to_cells(lats, lngs, RES_MAX))
+
+    def score_candidates(self, locations, impact=True):
+        """Score prospective hotspot placements without modifying the graph.
+
+        Each candidate is scored on its own against the current graph, as if
+        it was the only hotspot added.
+
+        REQUIRES:
+            -> locations: an iterable of (lat, lng) pairs.
+            -> impact: if True, also compute the change in reward scale of
+                the existing nodes.
+        RETURNS:
+            -> list: a (reward_scale, impact) tuple for every candidate, where
+                impact is a dict of node_id -> (current, new) reward scale.
+        """
+        from whatif import resident_hexes
+        from whatif import score_candidate
+
+        if not self.hex_dict.generated:
+            self._generate_reward_scales()
+        hexes = resident_hexes(self.hex_dict) if impact else None
+        return [score_candidate(self.hex_dict, lat, lng, hexes) for lat, lng in locations]
+
     def nodes(self):
         """Get the nodes of the graph."""
         return self.graph.nodes()
@@ -69,17 +355,38 @@ class RewardGraph:
         -> Will compute the reward scale for all nodes in the given graph.
             -> Node will receive a 'reward_scale' attribute once run.
         """
-        self.hex_dict.generate_max_res_meta()
-        self.hex_dict.generate_parents()
-        for node in self.graph.nodes():
-            node['reward_scale'] = self.hex_dict.compute_reward_scale(float(node['lat']), float(node['lng']))
+        with profiling.phase('densities'):
+            if self.density_engine == 'legacy':
+                self.hex_dict.generate_max_res_meta()
+                self.hex_dict.generate_parents()
+            else:
+                self.hex_dict.generate_densities()
+        with profiling.phase('score_nodes'):
+            packed = self.hex_dict.packed()
+            self.graph.set_located_attribute(
+                'reward_scale', lambda lats, lngs: packed.reward_scales(geo_to_cells(lats, lngs, RES_MAX))
+            )
 
 class HexDict:
     """A class representing a hexagon dictionary."""
 
-    def __init__(self): 
-        """Constructor for a hex map."""
+    def __init__(self, topology=None, params=DEFAULT_PARAMS): 
+        """Constructor for a hex map.
+
+        REQUIRES:
+            -> topology: an optional TopologyCache, which can be shared
+                between hex dicts. A new cache in precompute mode is
+                created by default, see topology.py.
+            -> params: the chain_params.ChainParams used to clip densities.
+        """
         self.hex_dict = [ {} for _ in range(RES_MAX + 1) ] 
+        self.topology = TopologyCache(maxsize=None) if topology is None else topology
+        self.params = params
+
+        # Set once the densities of all resolutions are up to date.
+        self.generated = False
+        # PackedLevels cache, built on demand from the generated densities.
+        self.packed_levels = None
     
     def __getitem__(self, hex_id):
         """Return the hex with the given hex id."""
@@ -119,6 +426,9 @@ class HexDict:
             returns the RES_MAX hexagon of the given coordinates.
         """
         
+        self.generated = False
+        self.packed_levels = None
+
         hex_id = h3.geo_to_h3(lat, lng, RES_MAX)
         if hex_id not in self.hex_dict[RES_MAX]:
             self.hex_dict[RES_MAX][hex_id] = Hexagon(hex_id)
@@ -130,6 +440,37 @@ class HexDict:
         return self.hex_dict[RES_MAX][hex_id]
 
 
+    def add_hexes(self, lats, lngs, names):
+        """Insert many coordinates into the HexDict at once.
+
+        REQUIRES:
+            -> lats, lngs: equal length arrays of coordinates.
+            -> names: the resident name of every coordinate.
+
+        EFFECTS:
+            -> Same as calling add_hex for every coordinate, but the
+                coordinates are indexed in a single vectorized call.
+        """
+        self.add_cells(geo_to_cells(lats, lngs, RES_MAX), names)
+
+    def add_cells(self, cells, names):
+        """Insert many already indexed RES_MAX cells into the HexDict.
+
+        REQUIRES:
+            -> cells: a uint64 array of RES_MAX cells, one per hotspot.
+            -> names: the resident name of every cell.
+        """
+        self.generated = False
+        self.packed_levels = None
+
+        level = self.hex_dict[RES_MAX]
+        for hex_id, name in zip(cells_to_strings(cells), names):
+            hex = level.get(hex_id)
+            if hex is None:
+                hex = level[hex_id] = Hexagon(hex_id)
+            hex.raw_density += 1
+            hex.residents.append(name)
+
     def generate_max_res_meta(self):
         """Generate the clipped densities for all MAX_RES hexagons.
         
@@ -138,22 +479,23 @@ class HexDict:
                 all MAX_RES hexagons.
         
         """
-        for hex in self.hex_dict[RES_MAX].values():
-            occupied_count = 0
-            hex_neighbors = self.neighbors(hex)
-            for neighbor in hex_neighbors:
-                if neighbor.raw_density >= HIP_RES_META[RES_MAX][1]:
-                    occupied_count += 1
-            hex.occupied_count = occupied_count
-            hex.hex_density_limit = min(
-                HIP_RES_META[RES_MAX][1] * max(occupied_count - HIP_RES_META[RES_MAX][0] + 1, 1),
-                HIP_RES_META[RES_MAX][2]
-            )
-            hex.clipped_density = min(
-                hex.hex_density_limit,
-                hex.raw_density
-            )
-            hex.unclipped_density = hex.raw_density
+        with profiling.phase(f'res_{RES_MAX}'):
+            for hex in self.hex_dict[RES_MAX].values():
+                occupied_count = 0
+                hex_neighbors = self.neighbors(hex)
+                for neighbor in hex_neighbors:
+                    if neighbor.raw_density >= self.params.res_meta[RES_MAX][1]:
+                        occupied_count += 1
+                hex.occupied_count = occupied_count
+                hex.hex_density_limit = min(
+                    self.params.res_meta[RES_MAX][1] * max(occupied_count - self.params.res_meta[RES_MAX][0] + 1, 1),
+                    self.params.res_meta[RES_MAX][2]
+                )
+                hex.clipped_density = min(
+                    hex.hex_density_limit,
+                    hex.raw_density
+                )
+                hex.unclipped_density = hex.raw_density
 
     def neighbors(self, hex):
         """Return a list of all neighbors of a hex.
@@ -161,17 +503,13 @@ class HexDict:
         REQUIRES:
             -> A valid hex object.
         RETURNS:
-            -> A list of all neighboring hex objects.
-        """
-        neighboring_hexs = list(hex.neighbors)
-        # neighboring_hexs.append(hex.hex_id)
-        neighbors = []
-        for neighbor in neighboring_hexs:
-            if neighbor in self:
-                neighbors.append(self[neighbor])
-            else:
-                neighbors.append(Hexagon(neighbor))
-        return neighbors
+            -> A list of all neighboring hex objects. Neighbors that are not
+                in the hex dict are the shared EMPTY_HEXAGONS sentinel of
+                their resolution.
+        """
+        level = self.hex_dict[hex.res]
+        empty = EMPTY_HEXAGONS[hex.res]
+        return [level.get(neighbor, empty) for neighbor in self.topology.neighbors(hex.hex_id)]
 
     def children(self, hex):
         """Generate all children hex.
@@ -182,21 +520,16 @@ class HexDict:
         EFFECTS:
             -> DOES NOT CHANGE THE HEX DICT.
                 - if there is a child that is not currently in the hex dict,
-                    it will be returned, but no information about the child in saved
-                    in the hex dict.
+                    the shared EMPTY_HEXAGONS sentinel of its resolution is
+                    returned in its place.
 
         RETURNS:
             -> A list of all child hex objects.
         
         """
-        children = hex.children()
-        children_list = []
-        for child in children:
-            if child in self:
-                children_list.append(self[child])
-            else:
-                children_list.append(Hexagon(child))
-        return children_list
+        level = self.hex_dict[hex.res + 1]
+        empty = EMPTY_HEXAGONS[hex.res + 1]
+        return [level.get(child, empty) for child in self.topology.children(hex.hex_id)]
 
     def generate_parents(self, resolution=RES_MAX, generation_id=0):
         """Takes all max res hexagons, and generates their parent hexagons.
@@ -209,6 +542,18 @@ class HexDict:
             -> Sets the clipped and unclipped densities of each hex added.
         """
         parent_res = resolution - 1
+        with profiling.phase(f'res_{parent_res}'):
+            self._generate_parent_level(resolution, generation_id)
+
+        if resolution > RES_MIN:
+            self.generate_parents(resolution-1, generation_id)
+        else:
+            self.generated = True
+            self.packed_levels = None
+
+    def _generate_parent_level(self, resolution, generation_id):
+        """Generate the parents of the hexagons at resolution, see generate_parents."""
+        parent_res = resolution - 1
         for hex in self.hex_dict[resolution].values():
                         
             parent = h3.h3_to_parent(hex.hex_id, parent_res)
@@ -217,11 +562,9 @@ class HexDict:
             # is no need to regenerate the hex meta data.
             if parent in self.hex_dict[parent_res]\
                 and self.hex_dict[parent_res][parent].generation_id == generation_id:
-                self.hex_dict[parent_res][parent].residents += hex.residents
                 continue
             self.hex_dict[parent_res][parent] = Hexagon(parent)
             self.hex_dict[parent_res][parent].generation_id = generation_id
-            self.hex_dict[parent_res][parent].residents += hex.residents
             # Generate the unclipped density of the parent hex
             unclipped = 0
             for child in self.children(self.hex_dict[parent_res][parent]):
@@ -235,24 +578,268 @@ class HexDict:
                 neighbors = self.neighbors(parent)
                 occupied_count = 0
                 for neighbor in neighbors:
-                    if neighbor.unclipped_density >= HIP_RES_META[parent.res][1]:
+                    if neighbor.unclipped_density >= self.params.res_meta[parent.res][1]:
                         occupied_count += 1
                 parent.occupied_count = occupied_count
                 parent.hex_density_limit = min(
-                    HIP_RES_META[parent.res][1] * max(occupied_count - HIP_RES_META[parent.res][0] + 1, 1),
-                    HIP_RES_META[parent.res][2]
+                    self.params.res_meta[parent.res][1] * max(occupied_count - self.params.res_meta[parent.res][0] + 1, 1),
+                    self.params.res_meta[parent.res][2]
                 )
                 parent.clipped_density = min(
                     parent.unclipped_density,
                     parent.hex_density_limit
                 )
-            
-        if resolution > RES_MIN:
-            self.generate_parents(resolution-1, generation_id)
     
+    def generate_densities(self):
+        """Generate the densities of every hexagon from RES_MAX to RES_MIN - 1.
+
+        Linear time replacement for generate_max_res_meta + generate_parents.
+        Each resolution is built in two phases:
+            1. aggregate: the clipped densities of the children are summed
+                into the unclipped density of their parent.
+            2. clip: the occupied count, density limit and clipped density
+                are computed once the whole level has been aggregated.
+
+        EFFECTS:
+            -> Rebuilds all hexagons below RES_MAX from scratch.
+            -> Produces the same clipped and unclipped densities as
+                generate_max_res_meta followed by generate_parents.
+        """
+        self.generate_max_res_meta()
+        for res in range(RES_MAX - 1, RES_MIN - 2, -1):
+            with profiling.phase(f'res_{res}'):
+                self.aggregate_level(res)
+                self.clip_level(res)
+        self.generated = True
+        self.packed_levels = None
+
+    def packed(self):
+        """Return the densities as PackedLevels, for vectorized lookups.
+
+        REQUIRES:
+            -> The densities have been generated.
+        """
+        if not self.generated:
+            raise Exception("Cannot pack hex dict. Densities have not been generated.")
+        if self.packed_levels is None:
+            self.packed_levels = PackedLevels.from_hex_dict(self)
+        return self.packed_levels
+
+    def aggregate_level(self, res):
+        """Build the hexagons at res from the (already clipped) level res + 1.
+
+        EFFECTS:
+            -> Replaces all hexagons at res.
+            -> Sets the unclipped density of every parent.
+        """
+        level = {}
+        for child in self.hex_dict[res + 1].values():
+            parent_id = h3.h3_to_parent(child.hex_id, res)
+            parent = level.get(parent_id)
+            if parent is None:
+                parent = level[parent_id] = Hexagon(parent_id)
+            parent.unclipped_density += child.clipped_density
+        self.hex_dict[res] = level
+
+    def clip_level(self, res):
+        """Compute the clipped densities of all hexagons at res.
+
+        REQUIRES:
+            -> The unclipped densities of the whole level have been set.
+        """
+        level = self.hex_dict[res]
+        for hex in level.values():
+            self._clip_hex(hex, level, *self.params.res_meta[res])
+
+    def _clip_hex(self, hex, level, N, density_tgt, density_max):
+        """Set the occupied count, density limit and clipped density of hex.
+
+        REQUIRES:
+            -> level: the dictionary of all hexagons at the res of hex.
+        """
+        occupied_count = 0
+        for neighbor in self.topology.neighbors(hex.hex_id):
+            neighbor_hex = level.get(neighbor)
+            if neighbor_hex is not None and neighbor_hex.unclipped_density >= density_tgt:
+                occupied_count += 1
+        hex.occupied_count = occupied_count
+        hex.hex_density_limit = min(
+            density_tgt * max(occupied_count - N + 1, 1),
+            density_max
+        )
+        hex.clipped_density = min(
+            hex.unclipped_density,
+            hex.hex_density_limit
+        )
+
+    def add_hotspot(self, lat:float, lng:float, name=None):
+        """Add a hotspot and incrementally update the densities.
+
+        RETURNS:
+            -> set: the residents whose reward scale may have changed, i.e.
+                the residents of every hexagon whose clipped / unclipped
+                ratio changed. Empty if the densities were never generated.
+        """
+        if not self.generated:
+            self.add_hex(lat, lng, name)
+            return set()
+        hex_id = h3.geo_to_h3(lat, lng, RES_MAX)
+        changed = self.update_raw_densities({hex_id: 1})
+        self._update_residents(hex_id, name, add=True)
+        return self._changed_residents(changed) | {name}
+
+    def remove_hotspot(self, lat:float, lng:float, name=None):
+        """Remove a hotspot and incrementally update the densities.
+
+        REQUIRES:
+            -> A hotspot named name was added at lat, lng.
+        RETURNS:
+            -> set: the residents whose reward scale may have changed.
+        """
+        hex_id = h3.geo_to_h3(lat, lng, RES_MAX)
+        if hex_id not in self.hex_dict[RES_MAX]:
+            raise Exception("Cannot remove hotspot. Invalid starting hex.")
+        if not self.generated:
+            self._remove_hex(hex_id, name)
+            return set()
+        self._update_residents(hex_id, name, add=False)
+        changed = self.update_raw_densities({hex_id: -1})
+        return self._changed_residents(changed)
+
+    def move_hotspot(self, old_lat:float, old_lng:float, lat:float, lng:float, name=None):
+        """Move a hotspot and incrementally update the densities.
+
+        RETURNS:
+            -> set: the residents whose reward scale may have changed,
+                including the moved hotspot.
+        """
+        if not self.generated:
+            self.remove_hotspot(old_lat, old_lng, name)
+            self.add_hex(lat, lng, name)
+            return set()
+        old_hex_id = h3.geo_to_h3(old_lat, old_lng, RES_MAX)
+        hex_id = h3.geo_to_h3(lat, lng, RES_MAX)
+        if old_hex_id not in self.hex_dict[RES_MAX]:
+            raise Exception("Cannot move hotspot. Invalid starting hex.")
+        if old_hex_id == hex_id:
+            return set()
+        self._update_residents(old_hex_id, name, add=False)
+        changed = self.update_raw_densities({old_hex_id: -1, hex_id: 1})
+        self._update_residents(hex_id, name, add=True)
+        return self._changed_residents(changed) | {name}
+
+    def update_raw_densities(self, deltas):
+        """Apply raw density changes to RES_MAX hexagons and propagate them.
+
+        Only the parent chain of the changed hexagons is revisited, along with
+        the neighbor rings of hexagons whose occupied state flipped.
+
+        REQUIRES:
+            -> The densities have been generated.
+            -> deltas: a dict of RES_MAX hex_id -> change in raw density.
+        EFFECTS:
+            -> Creates hexagons whose density becomes positive and deletes
+                hexagons whose density drops to zero.
+        RETURNS:
+            -> list: every hexagon below RES_MAX whose clipped / unclipped
+                ratio changed.
+        """
+        self.packed_levels = None
+        changed = []
+        for res in range(RES_MAX, RES_MIN - 2, -1):
+            level = self.hex_dict[res]
+            meta = self.params.res_meta[res]
+            density_tgt = meta[1]
+
+            # Phase 1: apply the unclipped density changes of this level.
+            before = {}
+            to_clip = set()
+            for hex_id, delta in deltas.items():
+                if hex_id in level:
+                    hex = self._writable_hex(level, hex_id)
+                else:
+                    hex = level[hex_id] = Hexagon(hex_id)
+                before[hex_id] = (hex.clipped_density, hex.unclipped_density)
+                was_occupied = hex.unclipped_density >= density_tgt
+                hex.unclipped_density += delta
+                if res == RES_MAX:
+                    hex.raw_density += delta
+                to_clip.add(hex_id)
+                if (hex.unclipped_density >= density_tgt) != was_occupied:
+                    to_clip.update(neighbor for neighbor in self.topology.neighbors(hex_id) if neighbor in level)
+
+            # Phase 2: reclip the affected hexagons and collect the parent deltas.
+            deltas = {}
+            for hex_id in to_clip:
+                hex = self._writable_hex(level, hex_id)
+                old_clipped, old_unclipped = before.get(hex_id, (hex.clipped_density, hex.unclipped_density))
+                self._clip_hex(hex, level, *meta)
+                ratio_changed = old_clipped * hex.unclipped_density != hex.clipped_density * old_unclipped \
+                    or (old_unclipped == 0) != (hex.unclipped_density == 0)
+                if ratio_changed and res < RES_MAX:
+                    changed.append(hex)
+                if hex.clipped_density != old_clipped and res >= RES_MIN:
+                    parent = h3.h3_to_parent(hex_id, res - 1)
+                    deltas[parent] = deltas.get(parent, 0) + hex.clipped_density - old_clipped
+                if hex.unclipped_density == 0:
+                    self._discard_hex(level, hex_id)
+            if not deltas:
+                break
+        return changed
+
+    def _writable_hex(self, level, hex_id):
+        """Return the hexagon hex_id of level so that it can be modified."""
+        return level[hex_id]
+
+    def _discard_hex(self, level, hex_id):
+        """Remove a hexagon whose density dropped to zero from level."""
+        del level[hex_id]
+
+    def _update_residents(self, hex_id, name, add):
+        """Add or remove name from the residents of the RES_MAX hex hex_id."""
+        hex = self.hex_dict[RES_MAX][hex_id]
+        if add:
+            hex.residents.append(name)
+        else:
+            hex.residents.remove(name)
+
+    def residents(self, hex_id):
+        """Return the names of all hotspots within hex_id.
+
+        Only RES_MAX hexagons store their residents, so memory does not grow
+        with the number of resolutions. Those of a parent are collected from
+        its descendants in the hex dict. Empty if hex_id is not in the hex dict.
+        """
+        res = h3.h3_get_resolution(hex_id)
+        hexes = [self.hex_dict[res][hex_id]] if hex_id in self.hex_dict[res] else []
+        for res in range(res + 1, RES_MAX + 1):
+            level = self.hex_dict[res]
+            hexes = [
+                level[child] for hex in hexes for child in self.topology.children(hex.hex_id) if child in level
+            ]
+        return [resident for hex in hexes for resident in hex.residents]
+
+    def _remove_hex(self, hex_id, name):
+        """Undo add_hex for a hex whose densities have not been generated."""
+        hex = self.hex_dict[RES_MAX][hex_id]
+        hex.residents.remove(name)
+        hex.raw_density -= 1
+        if hex.raw_density == 0:
+            del self.hex_dict[RES_MAX][hex_id]
+
+    def _changed_residents(self, changed):
+        """Return the residents of all hexagons in changed."""
+        residents = set()
+        for hex in changed:
+            residents.update(self.residents(hex.hex_id))
+        return residents
+
     def compute_reward_scale(self, lat:float, lng:float):
         """Generate the reward scale for a given location."""
-        hex_id = h3.geo_to_h3(lat, lng, RES_MAX)
+        return self.hex_reward_scale(h3.geo_to_h3(lat, lng, RES_MAX))
+
+    def hex_reward_scale(self, hex_id):
+        """Generate the reward scale for a given RES_MAX hex."""
         if hex_id not in self.hex_dict[RES_MAX]:
             raise Exception("Cannot compute reward scale. Invalid starting hex.")
         current_hex = self.hex_dict[RES_MAX][hex_id]
@@ -267,6 +854,11 @@ class HexDict:
 class Hexagon:
     """Class representing an h3 hexagon."""
 
+    __slots__ = (
+        'hex_id', 'res', 'raw_density', 'clipped_density', 'unclipped_density',
+        'occupied_count', 'hex_density_limit', 'generation_id', 'residents'
+    )
+
     def __init__(self, hex_id):
         """Hexagon constructor."""
         self.hex_id = hex_id
@@ -279,11 +871,6 @@ class Hexagon:
         self.clipped_density = 0
         self.unclipped_density = 0
 
-        # Information for reward scale algorithm
-        self.density_max = HIP_RES_META[self.res][2]
-        self.density_tgt = HIP_RES_META[self.res][1]
-        self.N = HIP_RES_META[self.res][0] 
-
         # more info for the algorithms
         self.occupied_count = 0
         self.hex_density_limit = self.density_max
@@ -291,10 +878,25 @@ class Hexagon:
         # generation id information for generating meta data about a hex.
         self.generation_id = -1
 
+        # Names of the hotspots in the hex, only kept at RES_MAX, see HexDict.residents.
         self.residents = []
 
     # ------------- PROPERTY METHODS FOR CLASS -------------------------------
-    
+
+    # Information for reward scale algorithm, looked up in chain_vars. A
+    # HexDict reads these from its own params instead.
+    @property
+    def density_max(self):
+        return HIP_RES_META[self.res][2]
+
+    @property
+    def density_tgt(self):
+        return HIP_RES_META[self.res][1]
+
+    @property
+    def N(self):
+        return HIP_RES_META[self.res][0]
+
     @property
     def neighbors(self):
         """Returns the neighbors of a given node as a list."""
@@ -304,4 +906,29 @@ class Hexagon:
         """Return the children of a given node with given res."""
         if res is None:
             res = self.res + 1
-        return h3.h3_to_children(self.hex_id, res)
\ No newline at end of file
+        return h3.h3_to_children(self.hex_id, res)
+
+class EmptyHexagon(Hexagon):
+    """Immutable stand-in for a hexagon that is not in a HexDict.
+
+    A single instance is shared by all missing hexagons of a resolution, so
+    its hex_id is None and only its resolution and densities are meaningful.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, res):
+        """EmptyHexagon constructor."""
+        for slot in Hexagon.__slots__:
+            object.__setattr__(self, slot, 0)
+        object.__setattr__(self, 'hex_id', None)
+        object.__setattr__(self, 'res', res)
+        object.__setattr__(self, 'hex_density_limit', HIP_RES_META[res][2])
+        object.__setattr__(self, 'generation_id', -1)
+        object.__setattr__(self, 'residents', ())
+
+    def __setattr__(self, name, value):
+        raise Exception("Cannot modify an empty hexagon.")
+
+# Shared empty hexagon of every resolution.
+EMPTY_HEXAGONS = [ EmptyHexagon(res) for res in range(len(HIP_RES_META)) ]
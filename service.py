@@ -0,0 +1,308 @@
+"""A long-running local query service over a precomputed RewardGraph.
+
+Serves, as json over http (or a unix socket):
+    GET  /reward_scale?lat=&lng=        reward scale of an occupied location
+    POST /reward_scale                  {"locations": [[lat, lng], ...]}
+    GET  /hotspot/{address}             attributes and reward scale of a hotspot
+    GET  /whatif?lat=&lng=&impact=1     score a prospective placement
+    POST /reload                        {"snapshot": path}, defaults to the current source
+    GET  /status
+
+Concurrent reward scale queries are queued and answered together, with one
+vectorized PackedLevels lookup per batch. A batch is flushed after
+batch_delay seconds, or as soon as it holds max_batch locations.
+
+Reloading builds the new graph in a worker thread while the current one
+keeps answering queries, then swaps the reference. Every batch and query
+reads a single ServiceState, so no query ever sees a partially loaded graph.
+
+Run with 'python3 service.py --snapshot (path)' or 'python3 service.py (graph_file)'.
+"""
+
+import asyncio
+import concurrent.futures
+import math
+
+from aiohttp import web
+import click
+import h3
+import numpy as np
+
+from chain_vars import *
+from hex_arrays import geo_to_cells
+from reward_graph import HexDict
+from reward_graph import RewardGraph
+from topology import TopologyCache
+from whatif import resident_hexes
+from whatif import score_candidate
+
+def load_reward_graph(graph_file=None, snapshot=None):
+    """Load and generate a RewardGraph from a snapshot or graph_data/(graph_file)_nodes.csv."""
+    if snapshot is not None:
+        return RewardGraph.load_snapshot(snapshot)
+    # What-if queries visit arbitrary hexes, keep their topology lookups bounded.
+    reward_graph = RewardGraph(topology=TopologyCache())
+    reward_graph.import_graph_from_csv(graph_file)
+    reward_graph._generate_reward_scales()
+    return reward_graph
+
+def parse_location(lat, lng):
+    """Parse a lat, lng pair of a request.
+
+    RETURNS:
+        -> (lat, lng): floats, lat in [-90, 90] and lng in [-180, 180].
+    EFFECTS:
+        -> Raises a ValueError for anything else, including nan and inf.
+    """
+    lat, lng = float(lat), float(lng)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError(f"invalid location {lat}, {lng}")
+    return lat, lng
+
+def _json_value(value):
+    """Convert a node attribute to a json value, nan becomes null."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+class ServiceState:
+    """An immutable view of one loaded RewardGraph."""
+
+    def __init__(self, reward_graph, source):
+        """Constructor.
+
+        REQUIRES:
+            -> reward_graph: a RewardGraph whose reward scales are generated.
+            -> source: the (graph_file, snapshot) it was loaded from.
+        """
+        self.reward_graph = reward_graph
+        self.source = source
+        self.packed = reward_graph.hex_dict.packed()
+        self._whatif = None
+
+    def reward_scales(self, lats, lngs):
+        """Return the reward scale of every location, nan if its hex holds no hotspot."""
+        return self.packed.reward_scales(geo_to_cells(lats, lngs, RES_MAX), missing=np.nan)
+
+    def hotspot(self, address):
+        """Return the attributes of a hotspot, None if unknown."""
+        try:
+            node = self.reward_graph.graph.node(address)
+        except KeyError:
+            return None
+        hotspot = {key: _json_value(value) for key, value in node.attributes.items()}
+        hotspot['address'] = node.node_identifier
+        return hotspot
+
+    def whatif(self):
+        """Return a future of the (hex_dict, hexes_by_resident) used for what-if queries.
+
+        Overlays need the dict storage backend. A HexDict is built from the
+        hotspots of a compact (snapshot) graph the first time it is needed,
+        in a worker thread.
+        """
+        if self._whatif is None:
+            self._whatif = asyncio.get_running_loop().run_in_executor(None, self._build_whatif)
+            self._whatif.add_done_callback(self._whatif_done)
+        return self._whatif
+
+    def _whatif_done(self, future):
+        """Forget a failed build, so the next what-if query tries again."""
+        if future.cancelled() or future.exception() is not None:
+            self._whatif = None
+
+    def _build_whatif(self):
+        hex_dict = self.reward_graph.hex_dict
+        if not isinstance(hex_dict, HexDict):
+            cells, names = hex_dict.hotspot_cells, hex_dict.hotspot_names
+            hex_dict = HexDict(topology=TopologyCache(), params=hex_dict.params)
+            hex_dict.add_cells(cells, names)
+            hex_dict.generate_densities()
+        return hex_dict, resident_hexes(hex_dict)
+
+class RewardScaleService:
+    """Query batching and hot swapping on top of a ServiceState."""
+
+    def __init__(self, state, batch_delay=0.001, max_batch=4096):
+        self.state = state
+        self.batch_delay = batch_delay
+        self.max_batch = max_batch
+        self.pending = []
+        self.flush_handle = None
+        self.reload_lock = asyncio.Lock()
+        # What-if queries are scored off the event loop, one at a time since
+        # they share the TopologyCache of the what-if HexDict.
+        self.whatif_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.queries = 0
+        self.reloads = 0
+
+    async def reward_scale(self, lat:float, lng:float):
+        """Queue a reward scale query and wait for its batch.
+
+        RETURNS:
+            -> float: the reward scale, nan if the hex holds no hotspot.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((lat, lng, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self.flush)
+        return await future
+
+    def flush(self):
+        """Answer every queued reward scale query with one vectorized lookup."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        self.batches += 1
+        self.queries += len(pending)
+        lats, lngs, futures = zip(*pending)
+        try:
+            reward_scales = self.state.reward_scales(lats, lngs).tolist()
+        except Exception as error:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for future, reward_scale in zip(futures, reward_scales):
+            if not future.done():
+                future.set_result(reward_scale)
+
+    async def reward_scales(self, locations):
+        """Answer a batch of locations submitted together, bypassing the queue."""
+        self.batches += 1
+        self.queries += len(locations)
+        if not locations:
+            return []
+        lats, lngs = zip(*locations)
+        return self.state.reward_scales(lats, lngs).tolist()
+
+    async def whatif(self, lat:float, lng:float, impact=True):
+        """Score a prospective hotspot at lat, lng against the current state."""
+        hex_dict, hexes_by_resident = await self.state.whatif()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.whatif_executor, score_candidate, hex_dict, lat, lng, hexes_by_resident if impact else None
+        )
+
+    async def reload(self, graph_file=None, snapshot=None):
+        """Load a new graph in a worker thread, then swap it in.
+
+        Defaults to reloading the source of the current state.
+        """
+        if graph_file is None and snapshot is None:
+            graph_file, snapshot = self.state.source
+        async with self.reload_lock:
+            state = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: ServiceState(load_reward_graph(graph_file, snapshot), (graph_file, snapshot))
+            )
+            self.state = state
+            self.reloads += 1
+        return state
+
+    def status(self):
+        graph_file, snapshot = self.state.source
+        return {
+            'graph_file': graph_file,
+            'snapshot': snapshot,
+            'hotspots': len(self.state.reward_graph.graph),
+            'params': self.state.reward_graph.params.key(),
+            'batches': self.batches,
+            'queries': self.queries,
+            'reloads': self.reloads,
+        }
+
+    async def get_reward_scale(self, request):
+        try:
+            lat, lng = parse_location(request.query['lat'], request.query['lng'])
+        except (KeyError, ValueError):
+            return web.json_response({'error': 'a valid lat and lng are required'}, status=400)
+        reward_scale = await self.reward_scale(lat, lng)
+        return web.json_response({'data': {'lat': lat, 'lng': lng, 'reward_scale': _json_value(reward_scale)}})
+
+    async def post_reward_scales(self, request):
+        try:
+            locations = [parse_location(lat, lng) for lat, lng in (await request.json())['locations']]
+        except (KeyError, TypeError, ValueError):
+            return web.json_response({'error': 'expected {"locations": [[lat, lng], ...]}'}, status=400)
+        reward_scales = await self.reward_scales(locations)
+        return web.json_response({'data': [_json_value(reward_scale) for reward_scale in reward_scales]})
+
+    async def get_hotspot(self, request):
+        hotspot = self.state.hotspot(request.match_info['address'])
+        if hotspot is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.json_response({'data': hotspot})
+
+    async def get_whatif(self, request):
+        try:
+            lat, lng = parse_location(request.query['lat'], request.query['lng'])
+        except (KeyError, ValueError):
+            return web.json_response({'error': 'a valid lat and lng are required'}, status=400)
+        impact = request.query.get('impact', '1') not in ('0', 'false')
+        try:
+            reward_scale, changes = await self.whatif(lat, lng, impact)
+        except h3.H3ValueError as error:
+            return web.json_response({'error': str(error)}, status=400)
+        return web.json_response({'data': {
+            'lat': lat, 'lng': lng, 'reward_scale': reward_scale,
+            'impact': {resident: list(scales) for resident, scales in changes.items()},
+        }})
+
+    async def post_reload(self, request):
+        try:
+            body = await request.json() if request.can_read_body else {}
+            if not isinstance(body, dict):
+                raise ValueError("expected a json object")
+        except ValueError as error:
+            return web.json_response({'error': f'invalid body: {error}'}, status=400)
+        try:
+            await self.reload(body.get('graph_file'), body.get('snapshot'))
+        except Exception as error:
+            return web.json_response({'error': str(error)}, status=400)
+        return web.json_response({'data': self.status()})
+
+    async def get_status(self, request):
+        return web.json_response({'data': self.status()})
+
+    def make_app(self):
+        """Return the aiohttp application serving the queries."""
+        app = web.Application()
+        app.router.add_get('/reward_scale', self.get_reward_scale)
+        app.router.add_post('/reward_scale', self.post_reward_scales)
+        app.router.add_get('/hotspot/{address}', self.get_hotspot)
+        app.router.add_get('/whatif', self.get_whatif)
+        app.router.add_post('/reload', self.post_reload)
+        app.router.add_get('/status', self.get_status)
+        return app
+
+@click.command()
+@click.argument('graph_file', required=False)
+@click.option('--snapshot', default=None, help='Serve a snapshot written by main.py --save-snapshot.')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8090)
+@click.option('--unix-socket', default=None, help='Listen on a unix socket instead of host and port.')
+@click.option('--batch-delay', default=0.001, help='Seconds reward scale queries are queued for.')
+@click.option('--max-batch', default=4096, help='Flush the queue once it holds this many queries.')
+def main(graph_file, snapshot, host, port, unix_socket, batch_delay, max_batch):
+    """Serve reward scale queries for graph_data/(graph_file)_nodes.csv or a snapshot."""
+    if graph_file is None and snapshot is None:
+        raise click.UsageError("Either graph_file or --snapshot is required.")
+    state = ServiceState(load_reward_graph(graph_file, snapshot), (graph_file, snapshot))
+
+    async def make_app():
+        return RewardScaleService(state, batch_delay, max_batch).make_app()
+
+    if unix_socket is not None:
+        web.run_app(make_app(), path=unix_socket)
+    else:
+        web.run_app(make_app(), host=host, port=port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Persistent snapshots of a fully computed RewardGraph.
+
+A snapshot stores the CompactHexDict arrays of every resolution (hex ids,
+densities, occupied counts and limits), the RES_MAX cell of every hotspot
+and the node columns, in a single binary file:
+
+    MAGIC | version (uint32) | header length (uint32) | json header | arrays
+
+The json header records the offset, dtype and length of every array, and
+the chain params used to compute the densities with their key. Arrays are
+64 byte aligned so that loading a snapshot memory-maps the file and wraps
+the arrays without copying or recomputing anything.
+"""
+
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from chain_params import DEFAULT_PARAMS
+from chain_params import ChainParams
+from chain_vars import *
+from compact_hex_dict import CompactHexDict
+
+MAGIC = b'HIP17SNP'
+SNAPSHOT_VERSION = 1
+ALIGNMENT = 64
+
+# Node columns stored alongside the densities, in hotspot order.
+STRING_COLUMNS = ('address', 'name')
+FLOAT_COLUMNS = ('lat', 'lng', 'reward_scale_correct', 'reward_scale')
+
+LEVEL_ARRAYS = ('hex_ids', 'unclipped_density', 'clipped_density', 'occupied_count', 'hex_density_limit')
+
+def chain_vars_key():
+    """Return a key identifying the chain variables of chain_vars.py."""
+    return DEFAULT_PARAMS.key()
+
+class StringColumn:
+    """A read only sequence of strings stored as utf-8 bytes and offsets."""
+
+    def __init__(self, offsets, data):
+        """Constructor.
+
+        REQUIRES:
+            -> offsets: int64 array, string i is data[offsets[i]:offsets[i + 1]].
+            -> data: uint8 array of the concatenated utf-8 strings.
+        """
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Encode a list of strings."""
+        encoded = [str(string).encode() for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("string column index out of range")
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]]).decode()
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def write_snapshot(path, hex_dict, columns):
+    """Write a snapshot file.
+
+    REQUIRES:
+        -> hex_dict: a generated CompactHexDict.
+        -> columns: a dict with a list or array for every STRING_COLUMNS and
+            FLOAT_COLUMNS entry, in the order of hex_dict.hotspot_names.
+    """
+    arrays = {'hotspot_cells': hex_dict.hotspot_cells}
+    for res in range(RES_MIN - 1, RES_MAX + 1):
+        for name in LEVEL_ARRAYS:
+            arrays[f'{name}_{res}'] = getattr(hex_dict, name)[res]
+    for name in STRING_COLUMNS:
+        strings = StringColumn.from_strings(columns[name])
+        arrays[f'{name}_offsets'] = strings.offsets
+        arrays[f'{name}_data'] = strings.data
+    for name in FLOAT_COLUMNS:
+        arrays[name] = np.asarray(columns[name], dtype=np.float64)
+
+    # Offsets are relative to the start of the data section, so the header
+    # can be written before they are known.
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        table[name] = [offset, array.dtype.str, len(array)]
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({
+        'chain_vars_key': hex_dict.params.key(),
+        'chain_params': hex_dict.params.to_dict(),
+        'arrays': table
+    }).encode()
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<II', SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        data_start = _aligned(f.tell())
+        for name, array in arrays.items():
+            f.seek(data_start + table[name][0])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+
+def read_snapshot(path, params=None):
+    """Memory-map a snapshot file.
+
+    REQUIRES:
+        -> params: the ChainParams the snapshot must have been computed with,
+            DEFAULT_PARAMS (chain_vars.py) if None. 'stored' accepts the
+            params stored in the snapshot, whatever they are.
+
+    RETURNS:
+        -> (hex_dict, columns): a generated CompactHexDict and a dict of the
+            node columns, both backed by the memory-mapped file.
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise Exception(f"{path} is not a reward graph snapshot.")
+    version, header_length = struct.unpack_from('<II', buffer, len(MAGIC))
+    if version != SNAPSHOT_VERSION:
+        raise Exception(f"Unsupported snapshot version {version}, expected {SNAPSHOT_VERSION}.")
+    header_start = len(MAGIC) + 8
+    header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+    # Snapshots without stored params were computed with chain_vars.py.
+    stored = ChainParams.from_dict(header['chain_params']) if 'chain_params' in header else DEFAULT_PARAMS
+    if params is None:
+        params = DEFAULT_PARAMS
+    elif params == 'stored':
+        params = stored
+    if header['chain_vars_key'] != stored.key() or params.key() != stored.key():
+        raise Exception("Snapshot was computed with different chain variables.")
+    data_start = _aligned(header_start + header_length)
+
+    def array(name):
+        offset, dtype, length = header['arrays'][name]
+        return np.frombuffer(buffer, dtype=np.dtype(dtype), count=length, offset=data_start + offset)
+
+    hex_dict = CompactHexDict(params=stored)
+    hex_dict.hotspot_cells = array('hotspot_cells')
+    for res in range(RES_MIN - 1, RES_MAX + 1):
+        for name in LEVEL_ARRAYS:
+            getattr(hex_dict, name)[res] = array(f'{name}_{res}')
+    columns = {}
+    for name in STRING_COLUMNS:
+        columns[name] = StringColumn(array(f'{name}_offsets'), array(f'{name}_data'))
+    for name in FLOAT_COLUMNS:
+        columns[name] = array(name)
+    hex_dict.hotspot_names = columns['address']
+    hex_dict.generated = True
+    return hex_dict, columns
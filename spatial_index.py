@@ -0,0 +1,152 @@
+"""An H3 bucketed spatial index of hotspot locations.
+
+Hotspots are bucketed by their cell at BUCKET_RES. Queries visit the rings
+of buckets around the queried location, nearest first. Every point of a
+ring is at least (distance to the nearest bucket center of the ring) -
+(bucket radius) away, and any path from the queried location to a farther
+point crosses every ring in between. So once a whole ring is beyond the
+search distance, no later ring can hold a match, and the results are exact.
+
+Distances are great circle distances in km, like h3.point_dist.
+"""
+
+import heapq
+
+import h3
+from h3.api import basic_int as h3_int
+import numpy as np
+
+from hex_arrays import geo_to_cells
+
+# Resolution of the buckets, cells have edges of about 1.2 km.
+BUCKET_RES = 7
+
+# Mean earth radius used by h3.point_dist.
+EARTH_RADIUS_KM = 6371.0088
+
+def distances_km(lat:float, lng:float, lats, lngs):
+    """Return the great circle distance in km from lat, lng to every point of lats, lngs."""
+    lat, lng = np.radians(lat), np.radians(lng)
+    lats, lngs = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lngs, dtype=np.float64))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class SpatialIndex:
+    """Locations bucketed by h3 cell, supporting radius and nearest neighbor queries."""
+
+    def __init__(self, res=BUCKET_RES):
+        """Constructor.
+
+        REQUIRES:
+            -> res: the h3 resolution of the buckets. Coarser buckets suit
+                larger query distances.
+        """
+        self.res = res
+        # cell -> {key: (lat, lng)} of every point in the bucket.
+        self.buckets = {}
+        self.cells = {}
+        # Upper bound of the distance between a bucket center and its points:
+        # no hexagon edge is twice the average edge length.
+        self.bucket_radius = 2 * h3.edge_length(res, unit='km')
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, key):
+        return key in self.cells
+
+    def insert(self, key, lat:float, lng:float):
+        """Insert or move the point key."""
+        self.remove(key)
+        cell = h3_int.geo_to_h3(lat, lng, self.res)
+        self.buckets.setdefault(cell, {})[key] = (lat, lng)
+        self.cells[key] = cell
+
+    def insert_many(self, keys, lats, lngs):
+        """Insert many points at once."""
+        cells = geo_to_cells(lats, lngs, self.res).tolist()
+        for key, lat, lng, cell in zip(keys, np.asarray(lats).tolist(), np.asarray(lngs).tolist(), cells):
+            self.remove(key)
+            self.buckets.setdefault(cell, {})[key] = (lat, lng)
+            self.cells[key] = cell
+
+    def remove(self, key):
+        """Remove the point key, if present."""
+        cell = self.cells.pop(key, None)
+        if cell is not None:
+            bucket = self.buckets[cell]
+            del bucket[key]
+            if not bucket:
+                del self.buckets[cell]
+
+    def _ring(self, origin, k):
+        """Return the cells at grid distance k of origin."""
+        try:
+            return h3_int.hex_ring(origin, k)
+        except Exception:
+            # hex_ring fails around pentagons, k_ring does not.
+            return set(h3_int.k_ring(origin, k)) - set(h3_int.k_ring(origin, k - 1)) if k else {origin}
+
+    def _rings(self, lat:float, lng:float):
+        """Yield (lower bound of the distance, keys, distances) for every ring of buckets around lat, lng.
+
+        Stops once every point has been yielded.
+        """
+        origin = h3_int.geo_to_h3(lat, lng, self.res)
+        seen = 0
+        k = 0
+        while seen < len(self.cells):
+            ring = list(self._ring(origin, k))
+            centers = np.array([h3_int.h3_to_geo(cell) for cell in ring], dtype=np.float64)
+            lower_bound = max(0.0, float(distances_km(lat, lng, centers[:, 0], centers[:, 1]).min()) - self.bucket_radius)
+            keys, points = [], []
+            for cell in ring:
+                bucket = self.buckets.get(cell)
+                if bucket:
+                    keys.extend(bucket.keys())
+                    points.extend(bucket.values())
+            seen += len(keys)
+            if points:
+                points = np.array(points, dtype=np.float64)
+                yield lower_bound, keys, distances_km(lat, lng, points[:, 0], points[:, 1])
+            else:
+                yield lower_bound, keys, np.zeros(0)
+            k += 1
+
+    def within(self, lat:float, lng:float, radius_km:float):
+        """Return the points within radius_km of lat, lng.
+
+        RETURNS:
+            -> list: (distance in km, key) tuples, nearest first.
+        """
+        matches = []
+        for lower_bound, keys, distances in self._rings(lat, lng):
+            if lower_bound > radius_km:
+                break
+            matches.extend(
+                (distance, key) for key, distance in zip(keys, distances.tolist()) if distance <= radius_km
+            )
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def nearest(self, lat:float, lng:float, k:int=1):
+        """Return the k points nearest to lat, lng.
+
+        RETURNS:
+            -> list: at most k (distance in km, key) tuples, nearest first.
+        """
+        if k < 1:
+            return []
+        # Max heap of the k nearest points found so far, as (-distance, order, key).
+        best = []
+        order = 0
+        for lower_bound, keys, distances in self._rings(lat, lng):
+            if len(best) == k and lower_bound > -best[0][0]:
+                break
+            for key, distance in zip(keys, distances.tolist()):
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, order, key))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, order, key))
+                order += 1
+        return [(-distance, key) for distance, _, key in sorted(best, key=lambda entry: (-entry[0], entry[1]))]
@@ -0,0 +1,174 @@
+"""Evaluate many chain parameter sets against one dataset.
+
+Everything that does not depend on the chain params is computed once in a
+SweepIndex: the h3 indexing of the hotspots, the raw RES_MAX densities, the
+occupied hexes of every resolution with their parent grouping and neighbor
+pairs (from a shared TopologyCache), and the ancestors of every hotspot.
+Evaluating a parameter set is then a few numpy operations per resolution,
+with the same results as a HexDict built with those params.
+
+Results are cached on disk per dataset and parameter set key, so re-running
+a sweep only evaluates new or changed parameter sets.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import click
+import numpy as np
+
+from chain_params import DEFAULT_PARAMS
+from chain_params import read_params_file
+from chain_vars import *
+from hex_arrays import cells_to_parents
+from hex_arrays import geo_to_cells
+from loader import read_node_chunks
+from topology import TopologyCache
+
+DEFAULT_CACHE_DIR = os.path.join('.cache', 'sweep')
+
+class SweepIndex:
+    """The parameter independent structure of a dataset."""
+
+    def __init__(self, cells, topology=None):
+        """Constructor.
+
+        REQUIRES:
+            -> cells: a uint64 array with the RES_MAX cell of every hotspot.
+            -> topology: an optional, possibly shared, TopologyCache.
+                Defaults to a new cache in precompute mode.
+        """
+        self.cells = np.asarray(cells, dtype=np.uint64)
+        self.key = hashlib.sha256(self.cells.tobytes()).hexdigest()
+        topology = TopologyCache(maxsize=None) if topology is None else topology
+
+        hex_ids, raw_density = np.unique(self.cells, return_counts=True)
+        self.raw_density = raw_density.astype(np.int64)
+        # res -> (hex_ids, starts of the children in level res + 1, neighbor pairs)
+        self.levels = {}
+        # res -> position of the ancestor at res of every hotspot
+        self.positions = {}
+        for res in range(RES_MAX, RES_MIN - 2, -1):
+            starts = None
+            if res < RES_MAX:
+                parents = cells_to_parents(hex_ids, res)
+                # hex_ids are sorted, so are their parents.
+                starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+                hex_ids = parents[starts]
+                self.positions[res] = np.searchsorted(hex_ids, cells_to_parents(self.cells, res))
+            self.levels[res] = (hex_ids, starts) + self._neighbor_pairs(hex_ids, topology)
+
+    @staticmethod
+    def _neighbor_pairs(hex_ids, topology):
+        """Return (source, neighbor) positions of every pair of neighboring hexes, themselves included."""
+        neighbors = [topology.cell_neighbors(hex_id) for hex_id in hex_ids.tolist()]
+        counts = np.array([len(cells) for cells in neighbors], dtype=np.int64)
+        sources = np.repeat(np.arange(len(hex_ids)), counts)
+        neighbors = np.concatenate(neighbors + [np.zeros(0, dtype=np.uint64)])
+        positions = np.searchsorted(hex_ids, neighbors)
+        positions[positions == len(hex_ids)] = 0
+        found = hex_ids[positions] == neighbors if len(hex_ids) else np.zeros(0, dtype=bool)
+        return sources[found], positions[found]
+
+    def reward_scales(self, params=DEFAULT_PARAMS):
+        """Compute the reward scale of every hotspot with params.
+
+        RETURNS:
+            -> np.ndarray[float64]: the reward scale of every hotspot, in the
+                order of the cells the index was built from.
+        """
+        reward_scales = np.ones(len(self.cells), dtype=np.float64)
+        unclipped = self.raw_density
+        clipped = unclipped
+        for res in range(RES_MAX, RES_MIN - 2, -1):
+            hex_ids, starts, sources, neighbors = self.levels[res]
+            if res < RES_MAX:
+                unclipped = np.add.reduceat(clipped, starts) if len(starts) else clipped[:0]
+            N, density_tgt, density_max = params.res_meta[res]
+            occupied = unclipped >= density_tgt
+            occupied_count = np.bincount(neighbors[occupied[sources]], minlength=len(hex_ids))
+            limit = np.minimum(density_tgt * np.maximum(occupied_count - N + 1, 1), density_max)
+            clipped = np.minimum(unclipped, limit)
+            if res < RES_MAX:
+                positions = self.positions[res]
+                reward_scales *= clipped[positions] / unclipped[positions]
+        return reward_scales
+
+class SweepCache:
+    """A directory of cached sweep results, one .npy file per dataset and params."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, dataset_key, params):
+        return os.path.join(self.directory, dataset_key[:16], params.key() + '.npy')
+
+    def get(self, dataset_key, params):
+        """Return the cached reward scales, None if missing."""
+        try:
+            return np.load(self._path(dataset_key, params))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, dataset_key, params, reward_scales):
+        """Store reward scales, replacing any previous entry atomically."""
+        path = self._path(dataset_key, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, reward_scales)
+        os.replace(tmp_path, path)
+
+def sweep(index, params_list, cache=None):
+    """Evaluate every parameter set of params_list against a SweepIndex.
+
+    RETURNS:
+        -> list: a (params, reward_scales, cached) tuple per parameter set.
+    """
+    results = []
+    for params in params_list:
+        reward_scales = None if cache is None else cache.get(index.key, params)
+        cached = reward_scales is not None
+        if not cached:
+            reward_scales = index.reward_scales(params)
+            if cache is not None:
+                cache.put(index.key, params, reward_scales)
+        results.append((params, reward_scales, cached))
+    return results
+
+@click.command()
+@click.argument('graph_file')
+@click.argument('params_files', nargs=-1, required=True)
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory of the result cache, empty to disable it.')
+@click.option('--scales-output', default=None, help='Write the reward scale of every node for every parameter set to this .npz file.')
+def main(graph_file, params_files, cache_dir, scales_output):
+    """Evaluate the parameter sets of params_files against graph_data/(graph_file)_nodes.csv.
+
+    The chain_vars.py parameters are always evaluated first, as the baseline.
+    """
+    chunks = list(read_node_chunks(f"graph_data/{graph_file}_nodes.csv"))
+    addresses = [address for chunk in chunks for address in chunk.address.tolist()]
+    cells = np.concatenate([geo_to_cells(chunk.lat, chunk.lng, RES_MAX) for chunk in chunks])
+    params_list = [DEFAULT_PARAMS] + [params for path in params_files for params in read_params_file(path)]
+
+    index = SweepIndex(cells)
+    results = sweep(index, params_list, SweepCache(cache_dir) if cache_dir else None)
+
+    baseline = results[0][1]
+    print('name,key,cached,mean,median,min,full_scale,changed')
+    for params, reward_scales, cached in results:
+        print(
+            f'{params.name},{params.key()[:12]},{cached},{reward_scales.mean():.6f},'
+            f'{np.median(reward_scales):.6f},{reward_scales.min():.6f},'
+            f'{(reward_scales == 1.0).mean():.4f},{(reward_scales != baseline).mean():.4f}'
+        )
+    if scales_output is not None:
+        np.savez_compressed(
+            scales_output, address=np.array(addresses), names=np.array([params.name for params, _, _ in results]),
+            keys=np.array([params.key() for params, _, _ in results]),
+            reward_scales=np.array([reward_scales for _, reward_scales, _ in results])
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""The compact storage backend against HexDict."""
+
+from chain_vars import *
+from compact_hex_dict import CompactHexDict
+from conftest import load_chicago
+
+def test_compact_reward_scales(params, baseline):
+    reward_graph = load_chicago(storage='compact', params=params)
+    reward_graph._generate_reward_scales()
+    assert {node.node_identifier: node['reward_scale'] for node in reward_graph.nodes()} == baseline
+
+def test_compact_densities(params):
+    compact = load_chicago(storage='compact', params=params)
+    compact._generate_reward_scales()
+    hex_dict = load_chicago(params=params)
+    hex_dict._generate_reward_scales()
+    converted = CompactHexDict.from_hex_dict(hex_dict.hex_dict)
+    for res in range(RES_MAX, RES_MIN - 2, -1):
+        level = hex_dict.hex_dict.hex_dict[res]
+        assert len(compact.hex_dict.hex_ids[res]) == len(level), f'res {res}'
+        for hex_id, hex in level.items():
+            densities = (hex.clipped_density, hex.unclipped_density)
+            assert compact.hex_dict.density(hex_id) == densities, hex_id
+            assert converted.density(hex_id) == densities, hex_id
+            assert sorted(compact.hex_dict.residents(hex_id)) == sorted(hex_dict.hex_dict.residents(hex_id)), hex_id
@@ -0,0 +1,18 @@
+"""The linear density engine against the legacy generate_parents."""
+
+from chain_vars import *
+from conftest import hex_densities
+from conftest import load_chicago
+
+def test_linear_reward_scales(params, baseline):
+    reward_graph = load_chicago(params=params)
+    reward_graph._generate_reward_scales()
+    assert {node.node_identifier: node['reward_scale'] for node in reward_graph.nodes()} == baseline
+
+def test_linear_densities(params):
+    linear = load_chicago(params=params)
+    linear._generate_reward_scales()
+    legacy = load_chicago(density_engine='legacy', params=params)
+    legacy._generate_reward_scales()
+    for res in range(RES_MAX, RES_MIN - 2, -1):
+        assert hex_densities(linear.hex_dict, res) == hex_densities(legacy.hex_dict, res), f'res {res}'
@@ -0,0 +1,52 @@
+"""Incremental add/move/remove of hotspots against a full recompute."""
+
+import random
+
+from chain_vars import *
+from conftest import hex_densities
+from conftest import load_chicago
+from reward_graph import RewardGraph
+
+def recompute(reward_graph):
+    """Return a RewardGraph generated from scratch from the nodes of reward_graph."""
+    full = RewardGraph(params=reward_graph.params)
+    for node in reward_graph.nodes():
+        full.hex_dict.add_hex(node['lat'], node['lng'], node.node_identifier)
+    full.hex_dict.generate_densities()
+    return full
+
+def random_location(rng):
+    # Around the chicago hotspots, so changes land in occupied hexes as well.
+    return 41.85 + rng.uniform(-0.15, 0.15), -87.7 + rng.uniform(-0.15, 0.15)
+
+def test_random_changes(params):
+    reward_graph = load_chicago(params=params)
+    reward_graph._generate_reward_scales()
+    rng = random.Random(17)
+    for step in range(40):
+        before = {node.node_identifier: node['reward_scale'] for node in reward_graph.nodes()}
+        node_ids = sorted(before)
+        operation = rng.choice(('add', 'move', 'remove'))
+        if operation == 'add':
+            node_id = f'added-{step}'
+            changed = reward_graph.add_hotspot(node_id, *random_location(rng))
+        elif operation == 'move':
+            node_id = rng.choice(node_ids)
+            changed = reward_graph.move_hotspot(node_id, *random_location(rng))
+        else:
+            node_id = rng.choice(node_ids)
+            changed = reward_graph.remove_hotspot(node_id)
+
+        full = recompute(reward_graph)
+        expected = {
+            node.node_identifier: full.hex_dict.compute_reward_scale(node['lat'], node['lng'])
+            for node in reward_graph.nodes()
+        }
+        after = {node.node_identifier: node['reward_scale'] for node in reward_graph.nodes()}
+        assert after == expected, f'step {step}: {operation} {node_id}'
+        assert changed == {node_id for node_id, reward_scale in after.items() if before.get(node_id) != reward_scale}
+
+    for res in range(RES_MAX, RES_MIN - 2, -1):
+        assert hex_densities(reward_graph.hex_dict, res) == hex_densities(full.hex_dict, res), f'res {res}'
+    for hex_id in full.hex_dict.hex_dict[RES_MAX]:
+        assert sorted(reward_graph.hex_dict.residents(hex_id)) == sorted(full.hex_dict.residents(hex_id))
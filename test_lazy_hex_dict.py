@@ -0,0 +1,23 @@
+"""The lazy storage backend against the full computation."""
+
+import math
+
+from chain_vars import *
+from conftest import load_chicago
+from hex_arrays import geo_to_cells
+
+def test_lazy_single_hotspots(params, baseline):
+    reward_graph = load_chicago(storage='lazy', params=params)
+    for node in reward_graph.nodes():
+        assert reward_graph.get_reward_scale(node) == baseline[node.node_identifier], node.node_identifier
+
+def test_lazy_all_hotspots(params, baseline):
+    reward_graph = load_chicago(storage='lazy', params=params)
+    reward_graph._generate_reward_scales()
+    assert {node.node_identifier: node['reward_scale'] for node in reward_graph.nodes()} == baseline
+
+def test_lazy_missing_location(params):
+    reward_graph = load_chicago(storage='lazy', params=params)
+    # Lake Michigan, far from every chicago hotspot.
+    cells = geo_to_cells([42.2], [-87.0], RES_MAX)
+    assert math.isnan(reward_graph.hex_dict.reward_scales(cells, missing=math.nan)[0])
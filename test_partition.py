@@ -0,0 +1,14 @@
+"""Partitioned reward scales against a single HexDict."""
+
+import pytest
+
+from conftest import load_chicago
+from partition import SHARD_SIZE
+from partition import generate_partitioned
+
+# shard_size=1 splits chicago into one shard per RES_MIN cell, 3 in total.
+@pytest.mark.parametrize('workers, shard_size', [(1, SHARD_SIZE), (1, 1), (2, 1)])
+def test_partitioned_reward_scales(params, baseline, workers, shard_size):
+    reward_graph = load_chicago(params=params)
+    generate_partitioned(reward_graph, workers=workers, shard_size=shard_size)
+    assert {node.node_identifier: node['reward_scale'] for node in reward_graph.nodes()} == baseline
@@ -0,0 +1,38 @@
+"""Parameter sweeps against a HexDict built with each parameter set."""
+
+from chain_params import DEFAULT_PARAMS
+from chain_vars import *
+from conftest import MODIFIED_PARAMS
+from conftest import baseline_reward_scales
+from conftest import load_chicago
+from hex_arrays import geo_to_cells
+from sweep import SweepCache
+from sweep import SweepIndex
+from sweep import sweep
+
+def chicago_index():
+    reward_graph = load_chicago()
+    nodes = reward_graph.nodes()
+    cells = geo_to_cells([node['lat'] for node in nodes], [node['lng'] for node in nodes], RES_MAX)
+    return reward_graph, SweepIndex(cells)
+
+def test_sweep_reward_scales(tmp_path):
+    reward_graph, index = chicago_index()
+    node_ids = [node.node_identifier for node in reward_graph.nodes()]
+    params_list = [DEFAULT_PARAMS, MODIFIED_PARAMS]
+    cache = SweepCache(str(tmp_path))
+
+    results = sweep(index, params_list, cache)
+    assert [cached for _, _, cached in results] == [False, False]
+    for params, reward_scales, _ in results:
+        baseline = baseline_reward_scales(load_chicago(params=params))
+        assert dict(zip(node_ids, reward_scales.tolist())) == baseline, params
+
+    cached_results = sweep(index, params_list, cache)
+    assert [cached for _, _, cached in cached_results] == [True, True]
+    for (_, reward_scales, _), (_, cached_scales, _) in zip(results, cached_results):
+        assert reward_scales.tolist() == cached_scales.tolist()
+
+def test_modified_params_change_reward_scales():
+    _, index = chicago_index()
+    assert index.reward_scales(DEFAULT_PARAMS).tolist() != index.reward_scales(MODIFIED_PARAMS).tolist()
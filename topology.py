@@ -0,0 +1,103 @@
+"""Memoized h3 topology lookups.
+
+The same hexagons have their neighbors and children looked up many times:
+once per level of a recompute, once per incremental update and once per
+what-if query. TopologyCache memoizes those h3 calls in a bounded LRU, or
+keeps everything when used in precompute mode (maxsize=None).
+
+The LRU limit counts entries, separately for each lookup kind, not bytes:
+a tuple of hex id strings takes several times the memory of a uint64
+array of the same cells, so maxsize is no real memory bound, and the
+cache can hold up to three times maxsize entries. A full graph pass
+visits every hex of a level before the next one and would keep evicting
+entries it needs again once the graph has more hexes than maxsize. The
+full graph builders (HexDict, CompactHexDict and sweep.SweepIndex)
+therefore default to precompute mode, where the cache holds about as many
+entries as the densities it is used for. Bounded caches are for
+long-running processes answering arbitrary locations, such as the lazy
+storage backend and service.py.
+"""
+
+import collections
+
+import h3
+from h3.api import basic_int as h3_int
+import numpy as np
+
+# Default number of hexagons whose topology is kept in each cache.
+DEFAULT_MAXSIZE = 262144
+
+class TopologyCache:
+    """An LRU cache of k-ring (k = 1) neighbors and children of hexagons.
+
+    String hex ids are cached as tuples of strings, integer cells as uint64
+    arrays, so both HexDict and CompactHexDict can share the cache.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        """Constructor.
+
+        REQUIRES:
+            -> maxsize: maximum number of entries per lookup kind. None keeps
+                every entry (precompute mode).
+        """
+        self.maxsize = maxsize
+        self._neighbors = collections.OrderedDict()
+        self._cell_neighbors = collections.OrderedDict()
+        self._children = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._neighbors) + len(self._cell_neighbors) + len(self._children)
+
+    def _get(self, cache, key, compute):
+        """Return cache[key], computing and inserting it on a miss."""
+        value = cache.get(key)
+        if value is not None:
+            self.hits += 1
+            if self.maxsize is not None:
+                cache.move_to_end(key)
+            return value
+        self.misses += 1
+        value = cache[key] = compute(key)
+        if self.maxsize is not None and len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return value
+
+    def neighbors(self, hex_id):
+        """Return the hex_ids within distance 1 of hex_id, itself included."""
+        return self._get(self._neighbors, hex_id, lambda key: tuple(h3.hex_range(key, 1)))
+
+    def cell_neighbors(self, cell):
+        """Return the integer cells within distance 1 of cell, itself included."""
+        return self._get(
+            self._cell_neighbors, cell,
+            lambda key: np.fromiter(h3_int.hex_range(key, 1), dtype=np.uint64)
+        )
+
+    def children(self, hex_id):
+        """Return the children of hex_id one resolution below it."""
+        return self._get(
+            self._children, hex_id,
+            lambda key: tuple(h3.h3_to_children(key, h3.h3_get_resolution(key) + 1))
+        )
+
+    def precompute(self, hex_ids):
+        """Switch to precompute mode and cache the neighbors of all hex_ids.
+
+        EFFECTS:
+            -> The cache becomes unbounded so no entry is ever evicted.
+        """
+        self.maxsize = None
+        for hex_id in hex_ids:
+            if isinstance(hex_id, str):
+                self.neighbors(hex_id)
+            else:
+                self.cell_neighbors(hex_id)
+
+    def clear(self):
+        """Drop every cached entry."""
+        self._neighbors.clear()
+        self._cell_neighbors.clear()
+        self._children.clear()
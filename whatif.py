@@ -0,0 +1,92 @@
+"""What-if scoring of prospective hotspot placements.
+
+A candidate is scored by applying its raw density to a HexOverlay, a
+copy-on-write view of a generated HexDict. Only the hexagons touched by the
+incremental update are copied, so the base HexDict is never modified or
+recomputed, and each candidate is scored independently of the others.
+"""
+
+import collections
+import copy
+
+import h3
+
+from chain_vars import *
+from reward_graph import HexDict
+
+class HexOverlay(HexDict):
+    """A copy-on-write view of a generated HexDict."""
+
+    def __init__(self, base):
+        """Constructor.
+
+        REQUIRES:
+            -> base: a HexDict whose densities have been generated.
+        """
+        if not isinstance(base, HexDict):
+            raise Exception("What-if overlays are only supported by the dict storage backend.")
+        if not base.generated:
+            raise Exception("Cannot overlay hex dict. Densities have not been generated.")
+        self.base = base
+        self.topology = base.topology
+        self.params = base.params
+        self.hex_dict = [ collections.ChainMap({}, level) for level in base.hex_dict ]
+        self.generated = True
+        self.packed_levels = None
+
+    def _writable_hex(self, level, hex_id):
+        """Copy the hexagon into the overlay before it is modified.
+
+        Residents are shared with the base hexagon, overlays never modify them.
+        """
+        overlay = level.maps[0]
+        if hex_id not in overlay:
+            overlay[hex_id] = copy.copy(level.maps[1][hex_id])
+        return overlay[hex_id]
+
+    def _discard_hex(self, level, hex_id):
+        """Keep the emptied hexagon in the overlay so that it shadows the base.
+
+        Hexagons with no density are never occupied and add nothing to their
+        parent, so they do not change any reward scale.
+        """
+        self._writable_hex(level, hex_id)
+
+def resident_hexes(hex_dict):
+    """Map every resident of hex_dict to its RES_MAX hex_id."""
+    return {
+        resident: hex_id
+        for hex_id, hex in hex_dict.hex_dict[RES_MAX].items()
+        for resident in hex.residents
+    }
+
+def score_candidate(hex_dict, lat:float, lng:float, hexes_by_resident=None):
+    """Compute the reward scale of a hypothetical hotspot at lat, lng.
+
+    REQUIRES:
+        -> hex_dict: a HexDict whose densities have been generated.
+        -> hexes_by_resident: an optional dict of resident -> RES_MAX hex_id. If
+            given, the impact on existing hotspots is computed as well.
+    RETURNS:
+        -> (reward_scale, impact): impact is a dict of
+            resident -> (current reward scale, reward scale with the candidate)
+            for every resident whose reward scale would change.
+    """
+    hex_id = h3.geo_to_h3(lat, lng, RES_MAX)
+    overlay = HexOverlay(hex_dict)
+    changed = overlay.update_raw_densities({hex_id: 1})
+    reward_scale = overlay.hex_reward_scale(hex_id)
+
+    impact = {}
+    if hexes_by_resident is not None:
+        scales = {}
+        for resident in overlay._changed_residents(changed):
+            resident_hex = hexes_by_resident[resident]
+            if resident_hex not in scales:
+                scales[resident_hex] = (
+                    hex_dict.hex_reward_scale(resident_hex),
+                    overlay.hex_reward_scale(resident_hex)
+                )
+            if scales[resident_hex][0] != scales[resident_hex][1]:
+                impact[resident] = scales[resident_hex]
+    return reward_scale, impact